@@ -0,0 +1,101 @@
+"""
+Compares the set-based calculation of the daily statistics with the record by record loop.
+
+Usage: python -m benchmarks.daily_statistics [--municipalities 355] [--days 400]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+# The database is configured on import, so point it to a scratch database first
+database_path = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + database_path
+
+import datetime
+import random
+from database import database_session, engine, util, writing_to
+from database.data_model import DutchStatistics, DutchCaseCounts, DutchRegions
+import dutch_statistics
+
+PROVINCES = ['Groningen', 'Friesland', 'Drenthe', 'Overijssel', 'Flevoland', 'Gelderland', 'Utrecht',
+             'Noord-Holland', 'Zuid-Holland', 'Zeeland', 'Noord-Brabant', 'Limburg']
+START_DATE = datetime.date(2020, 3, 13)
+
+
+def fill_database(no_municipalities, no_days):
+    random.seed(0)
+    util.drop_all_tables(confirmed=True)
+    util.create_data_model()
+    regions = [('Gemeente ' + str(index), PROVINCES[index % len(PROVINCES)]) for index in range(no_municipalities)]
+    regions.extend((None, province) for province in PROVINCES)
+    region_ids = {region: region_id for region_id, region in enumerate(regions, start=1)}
+    totals = {region: [0, 0, 0] for region in regions}
+
+    rows = []
+    for day in range(no_days):
+        reported_date = START_DATE + datetime.timedelta(days=day)
+        for region in regions:
+            region_totals = totals[region]
+            region_totals[0] += random.randint(0, 50)
+            region_totals[1] += random.randint(0, 3)
+            region_totals[2] += random.randint(0, 1)
+            rows.append({'region_id': region_ids[region], 'reported_date': reported_date,
+                         'cumulative_infections': region_totals[0], 'cumulative_hospitalised': region_totals[1],
+                         'cumulative_deaths': region_totals[2]})
+
+    cases = [{'reported_date': START_DATE, 'statistic_date': START_DATE + datetime.timedelta(days=day),
+              'cases': random.randint(0, 20)} for day in range(no_days)]
+
+    with engine.begin() as connection:
+        connection.execute(DutchRegions.__table__.insert(), [{'id': region_id, 'municipality': region[0],
+                                                              'province': region[1]}
+                                                             for region, region_id in region_ids.items()])
+        connection.execute(DutchStatistics.__table__.insert(), rows)
+        connection.execute(DutchCaseCounts.__table__.insert(), cases)
+    return len(rows)
+
+
+def reset_daily_statistics():
+    with engine.begin() as connection:
+        connection.execute(DutchStatistics.__table__.update().values(infections=None, deaths=None, hospitalised=None,
+                                                                     infections_by_date=None))
+
+
+def read_daily_statistics():
+    session = database_session()
+    daily_statistics = session.query(DutchStatistics.id, DutchStatistics.infections, DutchStatistics.deaths,
+                                     DutchStatistics.hospitalised, DutchStatistics.infections_by_date) \
+        .order_by(DutchStatistics.id).all()
+    session.close()
+    return daily_statistics
+
+
+def time_calculation(set_based):
+    reset_daily_statistics()
+    start_time = time.perf_counter()
+    with writing_to(engine):
+        dutch_statistics.calculate_dutch_daily_statistics(set_based=set_based)
+    return time.perf_counter() - start_time, read_daily_statistics()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--municipalities', type=int, default=355)
+    parser.add_argument('--days', type=int, default=400)
+    arguments = parser.parse_args()
+
+    no_rows = fill_database(arguments.municipalities, arguments.days)
+    loop_time, loop_result = time_calculation(set_based=False)
+    set_based_time, set_based_result = time_calculation(set_based=True)
+
+    print('rows:             %d' % no_rows)
+    print('record loop:      %.2f s' % loop_time)
+    print('set based:        %.2f s' % set_based_time)
+    print('speedup:          %.1fx' % (loop_time / set_based_time))
+    print('identical result: %s' % (loop_result == set_based_result))
+    os.remove(database_path)
+
+
+if __name__ == '__main__':
+    main()
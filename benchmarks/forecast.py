@@ -0,0 +1,58 @@
+"""
+Compares the batched trend fit of all series with one curve fit per series, like the plotter did before.
+
+Usage: python -m benchmarks.forecast [--series 1424] [--window 14]
+"""
+import argparse
+import time
+import numpy as np
+from scipy import optimize
+import forecast
+import reproduction
+
+
+def synthetic_windows(no_series, window, seed=0):
+    """Windows newest first, every series with its own growth rate and some noise"""
+    random = np.random.default_rng(seed)
+    growth_rates = random.uniform(-0.1, 0.1, (no_series, 1))
+    scales = random.uniform(10, 1000, (no_series, 1))
+    windows = scales * np.exp(growth_rates * reproduction.window_x_values(window))
+    return np.round(windows * random.normal(1, 0.05, windows.shape))
+
+
+def curve_fit_growth_factors(windows):
+    x = reproduction.window_x_values(windows.shape[-1])
+    growth_factors = []
+    for window in windows:
+        try:
+            popt, pcov = optimize.curve_fit(reproduction.exponent, x, window)
+            growth_factors.append(np.exp(popt[1]))
+        except (RuntimeError, ValueError):
+            growth_factors.append(np.nan)
+    return np.array(growth_factors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--series', type=int, default=1424, help='defaults to 356 regions with 4 metrics each')
+    parser.add_argument('--window', type=int, default=14)
+    arguments = parser.parse_args()
+
+    windows = synthetic_windows(arguments.series, arguments.window)
+    start_time = time.perf_counter()
+    curve_fit_result = curve_fit_growth_factors(windows)
+    curve_fit_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    batched_result = forecast.fit_trends(windows)['growth_factor']
+    batched_time = time.perf_counter() - start_time
+
+    print('series:                        %d' % arguments.series)
+    print('curve_fit per series:          %.4f s' % curve_fit_time)
+    print('batched:                       %.4f s' % batched_time)
+    print('speedup:                       %.0fx' % (curve_fit_time / batched_time))
+    print('max difference growth factor:  %.4f' % np.nanmax(np.abs(curve_fit_result - batched_result)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Compares the vectorized log-linear Re calculation with one curve fit per day and times the Monte Carlo bands of Re.
+
+Usage: python -m benchmarks.reproduction [--days 365] [--incubation-time 4] [--samples 2000]
+"""
+import argparse
+import time
+import numpy as np
+import reproduction
+
+
+def synthetic_cases(no_days, seed=0):
+    """Daily cases newest first, with a growth rate that changes slowly over time and some noise"""
+    random = np.random.default_rng(seed)
+    daily_growth = 0.05 * np.sin(np.linspace(0, 4 * np.pi, no_days))
+    cases = 1000 * np.exp(np.cumsum(daily_growth))
+    return np.round(cases * random.normal(1, 0.05, no_days))[::-1]
+
+
+def time_method(cases, arguments, method, repeats):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        rep_no_list = reproduction.daily_reproduction_numbers(cases, arguments.incubation_time,
+                                                              arguments.generational_interval,
+                                                              arguments.generational_interval_stdev, method=method)
+    return (time.perf_counter() - start_time) / repeats, rep_no_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--incubation-time', type=float, default=4)
+    parser.add_argument('--generational-interval', type=float, default=3.86)
+    parser.add_argument('--generational-interval-stdev', type=float, default=2.65)
+    parser.add_argument('--samples', type=int, default=2000)
+    arguments = parser.parse_args()
+
+    cases = synthetic_cases(arguments.days)
+    curve_fit_time, curve_fit_result = time_method(cases, arguments, reproduction.CURVE_FIT, repeats=1)
+    log_linear_time, log_linear_result = time_method(cases, arguments, reproduction.LOG_LINEAR, repeats=100)
+
+    start_time = time.perf_counter()
+    bands = reproduction.reproduction_number_bands(cases, arguments.incubation_time, arguments.generational_interval,
+                                                   arguments.generational_interval_stdev, samples=arguments.samples,
+                                                   seed=0)
+    bands_time = time.perf_counter() - start_time
+
+    print('days:                 %d' % arguments.days)
+    print('curve_fit per day:    %.4f s' % curve_fit_time)
+    print('vectorized:           %.4f s' % log_linear_time)
+    print('speedup:              %.0fx' % (curve_fit_time / log_linear_time))
+    print('max difference in Re: %.2f' % np.nanmax(np.abs(curve_fit_result - log_linear_result)))
+    print('bands:                %.4f s, %d samples' % (bands_time, arguments.samples))
+    print('days within 95%% band: %.0f%%' % (100 * np.nanmean((bands['low'] <= log_linear_result) &
+                                                              (log_linear_result <= bands['high']))))
+
+
+if __name__ == '__main__':
+    main()
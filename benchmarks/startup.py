@@ -0,0 +1,56 @@
+"""
+Measures how long the entry points take to import and checks them against their budget.
+
+Usage: python -m benchmarks.startup [--repeat 5]
+
+Every entry point is imported in a fresh interpreter, the fastest of the runs counts.
+The exit code is 1 when an entry point takes longer than its budget.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules an entry point imports and the seconds it may take, see cli
+STARTUP_BUDGETS = {
+    'cli': (['cli'], 0.05),
+    'refresh': (['main'], 1.0),
+    'export': (['dutch_statistics'], 0.8),
+    'reproduction': (['reproduction', 'series_cache'], 0.8),
+    'plot': (['graph_plotter', 'series_cache'], 4.0),
+    'web': (['main', 'frontend'], 4.0),
+}
+MEASURE_IMPORT = 'import time; start_time = time.perf_counter(); import %s; print(time.perf_counter() - start_time)'
+
+
+def measure_import(modules, repeat):
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', MEASURE_IMPORT % ', '.join(modules)], cwd=repository,
+                                stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+
+    over_budget = []
+    print('%-15s %10s %10s' % ('entry point', 'seconds', 'budget'))
+    for name, (modules, budget) in STARTUP_BUDGETS.items():
+        seconds = measure_import(modules, arguments.repeat)
+        print('%-15s %10.3f %10.3f' % (name, seconds, budget))
+        if seconds > budget:
+            over_budget.append('%s: %.3f s, budget %.3f s' % (name, seconds, budget))
+
+    for message in over_budget:
+        print('OVER BUDGET ' + message)
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Times the refresh stages, the queries and the plots on synthetic data and compares them with a stored baseline.
+
+Usage: python -m benchmarks.suite [--municipalities 355] [--days 300] [--cases-per-day 2000] [--repeat 3]
+                                  [--baseline benchmarks/baseline.json] [--save-baseline]
+                                  [--time-threshold 0.25] [--memory-threshold 0.25]
+
+Every benchmark reports the fastest of its runs and the peak memory of one extra run traced with tracemalloc.
+Memory used by worker processes, like the parse workers and the Re calculation of the refresh, is not included.
+The exit code is 1 when a benchmark is slower or uses more memory than the baseline allows.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The database and the data folders are configured on import, so point them to a scratch folder first.
+# Worker processes import this module again and keep the folder of the benchmark.
+work_directory = os.environ.get('BENCHMARK_WORK_DIR') or tempfile.mkdtemp()
+os.environ['BENCHMARK_WORK_DIR'] = work_directory
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(work_directory, 'benchmark.db')
+os.environ['DATA_FILES_DIR'] = os.path.join(work_directory, 'data_files')
+os.environ['SERIES_CACHE_DIR'] = os.path.join(work_directory, 'series')
+
+import datetime
+import inspect
+import shutil
+from benchmarks import synthetic_data
+from config import Config
+from database import util as database_util
+import dutch_statistics
+import graph_plotter
+import metrics
+import series_cache
+import main as refresh
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# Differences below this are noise, whatever the threshold
+MIN_SECONDS_DIFFERENCE = 0.01
+# Stages of metrics that measure the memory of a refresh stage, by default the stage and its parsing
+TRACED_STAGES = {'totals': ['daily_totals', 'series_cache', 'reproduction'], 'publish': []}
+
+
+def measure(benchmark, repeat):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        benchmark()
+        timings.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    benchmark()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': min(timings), 'peak_memory': peak_memory}
+
+
+def measure_refresh(repeat):
+    """
+    Times every stage of a full rebuild from the synthetic files. The peak memory of the stages is traced by metrics
+    in one more rebuild, which shares the trace between the stages running at the same time
+    """
+    timings = {}
+    start_times = {}
+
+    def time_stage(stage, state):
+        if state == 'running':
+            start_times[stage] = time.perf_counter()
+        elif state.startswith('done'):
+            timings.setdefault(stage, []).append(time.perf_counter() - start_times[stage])
+
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        refresh.refresh_dutch_statistics(full_rebuild=True, progress=time_stage, download=False)
+        timings.setdefault('total', []).append(time.perf_counter() - start_time)
+
+    Config.METRICS_TRACE_MEMORY = True
+    try:
+        refresh.refresh_dutch_statistics(full_rebuild=True, download=False)
+    finally:
+        Config.METRICS_TRACE_MEMORY = False
+    peak_memory = {stage: max((metrics.stage_metrics.get(name, {}).get('traced_peak_bytes', 0)
+                               for name in TRACED_STAGES.get(stage, [stage, stage + '_parse'])), default=0)
+                   for stage in timings}
+    peak_memory['total'] = max(peak_memory.values())
+    return {'refresh.' + stage: {'seconds': min(stage_timings), 'peak_memory': peak_memory.get(stage, 0)}
+            for stage, stage_timings in timings.items()}
+
+
+def query_benchmarks():
+    municipality, province = 'Gemeente 0', synthetic_data.PROVINCES[0]
+    # The readers are called undecorated, so every run queries the database instead of hitting the query cache
+    sum_dutch_total_infections = inspect.unwrap(dutch_statistics.sum_dutch_total_infections)
+    get_region_series = inspect.unwrap(dutch_statistics.get_region_series)
+    get_regional_reproduction_numbers = inspect.unwrap(dutch_statistics.get_regional_reproduction_numbers)
+    return {
+        'query.sum_dutch_total_infections.national': lambda: sum_dutch_total_infections(None, None),
+        'query.sum_dutch_total_infections.province': lambda: sum_dutch_total_infections(None, province),
+        'query.sum_dutch_total_infections.municipality': lambda: sum_dutch_total_infections(municipality, None),
+        'query.get_region_series': lambda: get_region_series(['Gemeente %d' % index for index in range(20)],
+                                                             synthetic_data.PROVINCES),
+        'query.get_infections_by_date': inspect.unwrap(dutch_statistics.get_infections_by_date),
+        'query.get_daily_prevalence_numbers': inspect.unwrap(dutch_statistics.get_daily_prevalence_numbers),
+        'query.get_daily_reproduction_number': inspect.unwrap(dutch_statistics.get_daily_reproduction_number),
+        'query.get_regional_reproduction_numbers': lambda: get_regional_reproduction_numbers(municipality, None),
+        'query.get_growth_factors': lambda: inspect.unwrap(dutch_statistics.get_growth_factors)(
+                region_type='municipality'),
+        'query_cache.sum_dutch_total_infections.municipality':
+            lambda: dutch_statistics.sum_dutch_total_infections(municipality, None),
+        'series_cache.sum_dutch_total_infections.national': lambda: list(
+                series_cache.sum_dutch_total_infections(None, None)),
+        'series_cache.sum_dutch_total_infections.municipality': lambda: list(
+                series_cache.sum_dutch_total_infections(municipality, None)),
+        'series_cache.get_infections_by_date': lambda: list(series_cache.get_infections_by_date()),
+    }
+
+
+def plot_benchmarks(no_days):
+    # The plot functions are called undecorated, so every run renders instead of hitting the render cache
+    plot_statistics = inspect.unwrap(graph_plotter.plot_statistics)
+    plot_reproduction_no = inspect.unwrap(graph_plotter.plot_reproduction_no)
+    start_date = synthetic_data.START_DATE + datetime.timedelta(days=no_days // 2)
+    return {
+        'plot.plot_statistics': lambda: plot_statistics(
+                data_set=series_cache.sum_dutch_total_infections(None, None), start_date=start_date,
+                no_days_to_predict=7, plot_deaths=True, image_name='benchmark_statistics.png'),
+        'plot.plot_statistics.full_range': lambda: plot_statistics(
+                data_set=series_cache.sum_dutch_total_infections(None, None), no_days_to_predict=7, plot_deaths=True,
+                image_name='benchmark_statistics_full_range.png'),
+        'plot.plot_reproduction_no': lambda: plot_reproduction_no(
+                data_set=series_cache.get_infections_by_date(), incubation_time=4, generational_interval=3.86,
+                generational_interval_stdev=2.65, start_date=start_date, image_name='benchmark_reproduction.png'),
+    }
+
+
+def compare(results, baseline, time_threshold, memory_threshold):
+    """Returns a description of every benchmark that got slower or uses more memory than the thresholds allow"""
+    regressions = []
+    for name, result in sorted(results.items()):
+        baseline_result = baseline.get(name)
+        if not baseline_result:
+            continue
+        if result['seconds'] > baseline_result['seconds'] * (1 + time_threshold) \
+                and result['seconds'] - baseline_result['seconds'] > MIN_SECONDS_DIFFERENCE:
+            regressions.append('%s: %.3f s, baseline %.3f s' % (name, result['seconds'], baseline_result['seconds']))
+        if result['peak_memory'] > baseline_result['peak_memory'] * (1 + memory_threshold):
+            regressions.append('%s: %.1f MB peak, baseline %.1f MB' % (name, result['peak_memory'] / 2 ** 20,
+                                                                       baseline_result['peak_memory'] / 2 ** 20))
+    return regressions
+
+
+def print_results(results, baseline):
+    print('%-55s %10s %10s %8s %12s' % ('benchmark', 'seconds', 'baseline', 'change', 'peak MB'))
+    for name, result in sorted(results.items()):
+        baseline_seconds = baseline.get(name, {}).get('seconds')
+        change = '%+.0f%%' % ((result['seconds'] / baseline_seconds - 1) * 100) if baseline_seconds else ''
+        print('%-55s %10.3f %10s %8s %12.1f' % (name, result['seconds'],
+                                                 '%.3f' % baseline_seconds if baseline_seconds else '-',
+                                                 change, result['peak_memory'] / 2 ** 20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--municipalities', type=int, default=355)
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--cases-per-day', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--time-threshold', type=float, default=0.25, help='allowed slowdown, 0.25 is 25%%')
+    parser.add_argument('--memory-threshold', type=float, default=0.25, help='allowed memory increase')
+    arguments = parser.parse_args()
+    parameters = {'municipalities': arguments.municipalities, 'days': arguments.days,
+                  'cases_per_day': arguments.cases_per_day}
+
+    try:
+        synthetic_data.generate(Config.DATA_FILES_DIR, arguments.municipalities, arguments.days,
+                                arguments.cases_per_day)
+        database_util.create_data_model()
+        Config.PLOT_DIR = work_directory
+
+        results = measure_refresh(arguments.repeat)
+        for name, benchmark in list(query_benchmarks().items()) + list(plot_benchmarks(arguments.days).items()):
+            results[name] = measure(benchmark, arguments.repeat)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as baseline_file:
+            stored_baseline = json.load(baseline_file)
+        # Results of other data volumes can not be compared
+        if stored_baseline['parameters'] == parameters:
+            baseline = stored_baseline['results']
+        else:
+            print('Baseline was measured with %s, not comparing' % stored_baseline['parameters'])
+
+    print_results(results, baseline)
+    print('max resident memory: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    if arguments.save_baseline:
+        with open(arguments.baseline, mode='w') as baseline_file:
+            json.dump({'parameters': parameters, 'results': results}, baseline_file, indent=4, sort_keys=True)
+        print('Stored baseline in ' + arguments.baseline)
+        return
+
+    regressions = compare(results, baseline, arguments.time_threshold, arguments.memory_threshold)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
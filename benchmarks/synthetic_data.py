@@ -0,0 +1,122 @@
+"""
+Generates synthetic RIVM and NICE data files in the shapes the endpoints deliver, so refreshes can run offline.
+
+Usage: python -m benchmarks.synthetic_data directory [--municipalities 355] [--days 300] [--cases-per-day 2000]
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+
+PROVINCES = ['Groningen', 'Friesland', 'Drenthe', 'Overijssel', 'Flevoland', 'Gelderland', 'Utrecht',
+             'Noord-Holland', 'Zuid-Holland', 'Zeeland', 'Noord-Brabant', 'Limburg']
+AGE_GROUPS = ['0-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80-89', '90+']
+START_DATE = datetime.date(2020, 3, 13)
+
+
+def generate(directory, no_municipalities=355, no_days=300, cases_per_day=2000, seed=0):
+    """
+    Writes RIVM_CUMULATIVE, RIVM_CASES, RIVM_PREVALENCE, RIVM_REPRODUCTION, NICE_DAILY_INTAKE and
+    NICE_CUMULATIVE_INTAKE to the directory. The infections follow waves, so the fits on the data are meaningful.
+    The same arguments always generate the same files.
+    """
+    randomizer = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    dates = [START_DATE + datetime.timedelta(days=day) for day in range(no_days)]
+    # Relative infection rate per day, two waves a year
+    wave = [0.2 + math.sin(math.pi * day / 180) ** 2 for day in range(no_days)]
+
+    regions = [('GM%04d' % index, 'Gemeente %d' % index, PROVINCES[index % len(PROVINCES)])
+               for index in range(no_municipalities)]
+    # RIVM reports the cases of unknown municipalities per province without a municipality
+    regions.extend((None, None, province) for province in PROVINCES)
+    write_json_array(os.path.join(directory, 'RIVM_CUMULATIVE.json'),
+                     cumulative_records(randomizer, regions, dates, wave, cases_per_day))
+
+    write_json_array(os.path.join(directory, 'RIVM_CASES.json'),
+                     case_records(randomizer, dates, wave, cases_per_day))
+
+    write_json_array(os.path.join(directory, 'RIVM_PREVALENCE.json'),
+                     ({'Date': reported_date.isoformat(), 'prev_low': round(rate * cases_per_day * 8),
+                       'prev_avg': round(rate * cases_per_day * 10), 'prev_up': round(rate * cases_per_day * 12),
+                       'population': 'hosp'}
+                      for reported_date, rate in zip(dates[:-3], wave)))
+
+    # Re follows the change of the wave
+    write_json_array(os.path.join(directory, 'RIVM_REPRODUCTION.json'),
+                     ({'Date': dates[day].isoformat(),
+                       'Rt_low': round(reproduction_no - 0.1, 2), 'Rt_avg': round(reproduction_no, 2),
+                       'Rt_up': round(reproduction_no + 0.1, 2), 'population': 'hosp'}
+                      for day, reproduction_no in ((day, (wave[day + 1] / wave[day]) ** 4)
+                                                   for day in range(no_days - 14))))
+
+    nice_dates = dates[:-1]
+    intake_proven = [randomizer.randint(0, max(1, round(rate * cases_per_day / 50))) for rate in wave[:-1]]
+    intake_suspected = [randomizer.randint(0, max(1, round(rate * cases_per_day / 200))) for rate in wave[:-1]]
+    with open(os.path.join(directory, 'NICE_DAILY_INTAKE.json'), mode='w') as nice_file:
+        json.dump([[{'date': intake_date.isoformat(), 'value': value} for intake_date, value in zip(nice_dates, intake)]
+                   for intake in (intake_proven, intake_suspected)], nice_file)
+
+    cumulative_intake = 0
+    intake_counts = []
+    for intake_date, value in zip(nice_dates, intake_proven):
+        cumulative_intake += value
+        intake_counts.append({'date': intake_date.isoformat(), 'value': cumulative_intake})
+    write_json_array(os.path.join(directory, 'NICE_CUMULATIVE_INTAKE.json'), intake_counts)
+
+
+def cumulative_records(randomizer, regions, dates, wave, cases_per_day):
+    totals = {region: [0, 0, 0] for region in regions}
+    mean_infections = cases_per_day / len(regions)
+    for reported_date, rate in zip(dates, wave):
+        for region in regions:
+            region_totals = totals[region]
+            infections = randomizer.randint(0, max(1, round(2 * rate * mean_infections)))
+            region_totals[0] += infections
+            region_totals[1] += randomizer.randint(0, infections // 20 + 1) if infections else 0
+            region_totals[2] += randomizer.randint(0, infections // 50 + 1) if infections else 0
+            yield {'Date_of_report': reported_date.isoformat() + ' 10:00:00',
+                   'Municipality_code': region[0], 'Municipality_name': region[1], 'Province': region[2],
+                   'Total_reported': region_totals[0], 'Hospital_admission': region_totals[1],
+                   'Deceased': region_totals[2]}
+
+
+def case_records(randomizer, dates, wave, cases_per_day):
+    """The case file is a snapshot of one report date, every case refers to the day of its first symptoms"""
+    file_date = dates[-1].isoformat() + ' 10:00:00'
+    for statistic_date, rate in zip(dates, wave):
+        for _ in range(randomizer.randint(0, max(1, round(2 * rate * cases_per_day)))):
+            province = randomizer.choice(PROVINCES)
+            yield {'Date_file': file_date, 'Date_statistics': statistic_date.isoformat(),
+                   'Date_statistics_type': randomizer.choice(['DOO', 'DPL', 'DON']),
+                   'Agegroup': randomizer.choice(AGE_GROUPS), 'Sex': randomizer.choice(['Male', 'Female']),
+                   'Province': province, 'Hospital_admission': randomizer.choice(['Yes', 'No', 'Unknown']),
+                   'Deceased': randomizer.choice(['Yes', 'No']), 'Week_of_death': None,
+                   'Municipal_health_service': 'GGD ' + province}
+
+
+def write_json_array(path, records):
+    """Writes the records one by one, so large files are never held in memory"""
+    with open(path, mode='w') as json_file:
+        json_file.write('[')
+        for index, record in enumerate(records):
+            json_file.write(',\n' if index else '\n')
+            json_file.write(json.dumps(record))
+        json_file.write('\n]')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--municipalities', type=int, default=355)
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--cases-per-day', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    generate(arguments.directory, arguments.municipalities, arguments.days, arguments.cases_per_day, arguments.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,59 @@
+from config import Config
+from requests.adapters import HTTPAdapter
 import requests
+import hashlib
+import tempfile
+import logging
+import os
 
+logger = logging.getLogger(__name__)
 
-# Gets data from supplied endpoint and returns the json
-def get_covid_stats(url):
+# All callouts share one session, so connections to the same host are pooled and reused
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=10))
+http_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=10))
+
+
+def download_covid_stats(url, path, etag=None, last_modified=None):
+    """
+    Streams the response of the endpoint to a temporary file, which replaces the file at path once the download
+    succeeded. The ETag and Last-Modified of the previous download are sent along, so unchanged sources are not
+    downloaded again.
+
+    :return:
+    dict containing the status ('modified', 'not_modified' or 'failed') and the etag, last_modified and
+    sha256 hash of the downloaded file
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    temporary_file, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.download')
     try:
-        stats_response = requests.get(url)
-        if stats_response.status_code == 200:
-            return stats_response.content
-    except:
-        return None
+        with os.fdopen(temporary_file, mode='wb') as download_file, \
+                http_session.get(url, headers=headers, stream=True, timeout=Config.DOWNLOAD_TIMEOUT) as response:
+            if response.status_code == 304:
+                return {'status': 'not_modified', 'etag': etag, 'last_modified': last_modified}
+            if response.status_code != 200:
+                logger.warning('Downloading %s failed with status %d, the previous download is kept', url,
+                               response.status_code)
+                return {'status': 'failed'}
+
+            content_hash = hashlib.sha256()
+            for chunk in response.iter_content(chunk_size=Config.DOWNLOAD_CHUNK_SIZE):
+                download_file.write(chunk)
+                content_hash.update(chunk)
+
+        os.replace(temporary_path, path)
+        return {'status': 'modified',
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'sha256': content_hash.hexdigest()}
+    except requests.RequestException as error:
+        logger.warning('Downloading %s failed, the previous download is kept: %s', url, error)
+        return {'status': 'failed'}
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
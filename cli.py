@@ -0,0 +1,151 @@
+"""
+Command line entry point for the cron jobs and the shell.
+
+Usage: python cli.py refresh [--full-rebuild] [--no-download] [--profile]
+       python cli.py upgrade
+       python cli.py plot [--municipality NAME | --province NAME] [--start-date 2020-07-06] [--end-date DATE]
+                          [--predict 7] [--deaths] --output plot.png
+       python cli.py export [--municipality NAME ...] [--province NAME ...] [--national]
+                            [--start-date DATE] [--end-date DATE] [--format csv] [--output FILE]
+       python cli.py reproduction [--municipality NAME | --province NAME] [--since DATE] [--method log_linear]
+
+Every command imports only the modules it needs, so a refresh does not load Flask or matplotlib and printing the
+usage loads nothing at all. The import time of the commands is checked against a budget by benchmarks.startup.
+"""
+import argparse
+import datetime
+import sys
+
+
+def refresh_command(arguments):
+    import main
+    main.refresh_dutch_statistics(full_rebuild=arguments.full_rebuild, download=arguments.download,
+                                  profile=arguments.profile,
+                                  progress=lambda stage, state: print('%-17s %s' % (stage, state), flush=True))
+
+
+def upgrade_command(arguments):
+    import main
+    main.upgrade_database()
+
+
+def plot_command(arguments):
+    import graph_plotter
+    import series_cache
+    import inspect
+    import os
+    end_date = arguments.end_date or datetime.date.max
+    data_set = series_cache.sum_dutch_total_infections(arguments.municipality, arguments.province)
+    if not len(graph_plotter.select_date_range(data_set, arguments.start_date, end_date)[0]):
+        sys.exit('No statistics for ' + (arguments.municipality or arguments.province or 'the Netherlands') +
+                 ' in the date range')
+    # A single plot is drawn in this process, without the render cache and its pool, straight to the output file
+    plot_statistics = inspect.unwrap(graph_plotter.plot_statistics)
+    plot_statistics(data_set=data_set, start_date=arguments.start_date, end_date=end_date,
+                    no_days_to_predict=arguments.predict, plot_deaths=arguments.deaths,
+                    image_name=os.path.abspath(arguments.output))
+
+
+def export_command(arguments):
+    import dutch_statistics
+    import numpy as np
+    import json
+    import csv
+    data_set = dutch_statistics.get_region_series(arguments.municipality, arguments.province, arguments.national,
+                                                  arguments.start_date, arguments.end_date)
+    dates = data_set['dates'].astype(str).tolist()
+    rows = []
+    for region_index, (region_type, region) in enumerate(data_set['regions']):
+        for date_index, date in enumerate(dates):
+            row = {'region_type': region_type, 'region': region, 'date': date}
+            for metric in dutch_statistics.REGION_METRICS:
+                value = data_set[metric][region_index, date_index]
+                row[metric] = None if np.isnan(value) else int(value)
+            rows.append(row)
+
+    output = open(arguments.output, mode='w', newline='') if arguments.output else sys.stdout
+    try:
+        if arguments.format == 'json':
+            json.dump(rows, output, indent=1)
+            output.write('\n')
+        else:
+            writer = csv.DictWriter(output, fieldnames=['region_type', 'region', 'date'] +
+                                    list(dutch_statistics.REGION_METRICS))
+            writer.writeheader()
+            writer.writerows(rows)
+    finally:
+        if arguments.output:
+            output.close()
+
+
+def reproduction_command(arguments):
+    import reproduction
+    import series_cache
+    region_type = 'municipality' if arguments.municipality else 'province' if arguments.province else 'national'
+    build_id = series_cache.get_current_build()
+    if not build_id:
+        sys.exit('No series cache yet, run a refresh first')
+    rows = reproduction.calculate_region((build_id, region_type, arguments.municipality or arguments.province,
+                                          arguments.method, arguments.since))
+    print('date,growth_rate,reproduction_no')
+    for row in reversed(rows):
+        print('%s,%s,%s' % (row['reported_date'], '' if row['growth_rate'] is None else '%.4f' % row['growth_rate'],
+                            '' if row['reproduction_no'] is None else row['reproduction_no']))
+
+
+def add_region_arguments(parser):
+    region = parser.add_mutually_exclusive_group()
+    region.add_argument('--municipality')
+    region.add_argument('--province')
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    refresh_parser = commands.add_parser('refresh', help='download the data files and update the database')
+    refresh_parser.add_argument('--full-rebuild', action='store_true', help='process all report dates again')
+    refresh_parser.add_argument('--no-download', dest='download', action='store_false',
+                                help='only process the data files already present')
+    refresh_parser.add_argument('--profile', action='store_true', help='store a cProfile of the refresh')
+    refresh_parser.set_defaults(handler=refresh_command)
+
+    upgrade_parser = commands.add_parser('upgrade', help='convert the database to the current data model')
+    upgrade_parser.set_defaults(handler=upgrade_command)
+
+    plot_parser = commands.add_parser('plot', help='plot the statistics of a region to a png file')
+    add_region_arguments(plot_parser)
+    plot_parser.add_argument('--start-date', type=datetime.date.fromisoformat, default=datetime.date(2020, 7, 6))
+    plot_parser.add_argument('--end-date', type=datetime.date.fromisoformat)
+    plot_parser.add_argument('--predict', type=int, default=7, help='number of days to predict')
+    plot_parser.add_argument('--deaths', action='store_true', help='also plot the deaths')
+    plot_parser.add_argument('--output', required=True)
+    plot_parser.set_defaults(handler=plot_command)
+
+    export_parser = commands.add_parser('export', help='write the daily totals of regions as csv or json')
+    export_parser.add_argument('--municipality', action='append', default=[])
+    export_parser.add_argument('--province', action='append', default=[])
+    export_parser.add_argument('--national', action='store_true')
+    export_parser.add_argument('--start-date', type=datetime.date.fromisoformat)
+    export_parser.add_argument('--end-date', type=datetime.date.fromisoformat)
+    export_parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    export_parser.add_argument('--output', help='defaults to the standard output')
+    export_parser.set_defaults(handler=export_command)
+
+    reproduction_parser = commands.add_parser('reproduction', help='calculate the daily Re of a region')
+    add_region_arguments(reproduction_parser)
+    reproduction_parser.add_argument('--since', type=datetime.date.fromisoformat)
+    reproduction_parser.add_argument('--method', choices=['log_linear', 'curve_fit'], default='log_linear')
+    reproduction_parser.set_defaults(handler=reproduction_command)
+    return parser
+
+
+def main(argv=None):
+    arguments = create_parser().parse_args(argv)
+    if arguments.command == 'export' and not (arguments.municipality or arguments.province or arguments.national):
+        arguments.national = True
+    arguments.handler(arguments)
+
+
+if __name__ == '__main__':
+    main()
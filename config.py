@@ -6,6 +6,69 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir,
                                                                                             'covid_analysis.db')
+    DATA_FILES_DIR = os.environ.get('DATA_FILES_DIR') or 'data_files'
+    SERIES_CACHE_DIR = os.environ.get('SERIES_CACHE_DIR') or os.path.join(DATA_FILES_DIR, 'series')
+
+    # Number of records converted and written per transaction when streaming large files
+    INGEST_BATCH_SIZE = 10000
+    INGEST_READ_CHUNK_SIZE = 1024 * 1024
+    # NICE revises the intake of recent days, so an incremental refresh applies this many days before the NICE
+    # high-water marks again
+    NICE_REVISION_DAYS = 7
+
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+    DOWNLOAD_TIMEOUT = 60
+
+    # Rendered plots are stored in the static folder and reused until the data changes
+    PLOT_DIR = 'frontend/static'
+    RENDER_CACHE_MAX_FILES = 500
+    RENDER_CACHE_MAX_BYTES = 200 * 1024 * 1024
+    # Plots of long date ranges draw a series with at most this many points and label every day up to this many days
+    PLOT_MAX_POINTS = 400
+    PLOT_MAX_DAY_TICKS = 31
+
+    # Plots are rendered by a pool of processes, 0 workers renders in the process handling the request.
+    # At most RENDER_QUEUE_SIZE plots wait or render at once, a request waits RENDER_QUEUE_TIMEOUT seconds
+    # for a free slot and RENDER_TIMEOUT seconds for its plot.
+    RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS') or os.cpu_count() or 1)
+    RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE') or 4 * RENDER_WORKERS)
+    RENDER_QUEUE_TIMEOUT = 5
+    RENDER_TIMEOUT = 60
+
+    # Data files are decoded by a pool of processes during a refresh, 0 decodes them in a thread of the refresh
+    PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS') or min(3, os.cpu_count() or 1))
+
+    # A refresh builds in a copy of the database with this page cache, the copy replaces the database when no table
+    # of VALIDATED_TABLES in database.shadow shrank below the ratio of its rows before the refresh
+    SHADOW_CACHE_KIB = 64 * 1024
+    SHADOW_MIN_ROW_RATIO = 0.9
+
+    # Results of the dutch_statistics readers are kept in memory until the data changes. With QUERY_CACHE_DIR set
+    # they are stored on disk as well, so all processes of a server share them
+    QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    QUERY_CACHE_DIR = os.environ.get('QUERY_CACHE_DIR')
+
+    # Tracing the peak memory of every refresh stage with tracemalloc slows the refresh down considerably
+    METRICS_TRACE_MEMORY = os.environ.get('METRICS_TRACE_MEMORY') == '1'
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(DATA_FILES_DIR, 'profiles')
+
+    # Seconds browsers and proxies may reuse a JSON response before revalidating its ETag
+    API_MAX_AGE = 300
+
+    # Re of every region is calculated at refresh with these parameters, spread over a pool of processes.
+    # 0 workers calculates in the refreshing process
+    REPRODUCTION_WORKERS = int(os.environ.get('REPRODUCTION_WORKERS') or os.cpu_count() or 1)
+    REPRODUCTION_INCUBATION_TIME = 4
+    REPRODUCTION_GENERATIONAL_INTERVAL = 3.86
+    REPRODUCTION_GENERATIONAL_INTERVAL_STDEV = 2.65
+    # The uncertainty bands of Re sample the growth rates and the generational interval, whose mean and standard
+    # deviation are estimates with these standard errors
+    REPRODUCTION_SAMPLES = 2000
+    REPRODUCTION_GENERATIONAL_INTERVAL_ERROR = 0.2
+    REPRODUCTION_GENERATIONAL_INTERVAL_STDEV_ERROR = 0.3
+
+    # Trends are fitted at refresh on this many of the most recent days, the plot form shows two weeks by default
+    FORECAST_WINDOW = 14
 
 
 class Endpoints(object):
@@ -24,5 +87,3 @@ class FlaskConfig(object):
     # Flask development settings
     FLASK_ENV = 'development'
     DEBUG = True
-
-
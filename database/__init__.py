@@ -1,10 +1,88 @@
 from config import Config
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import QueuePool
+import contextlib
+import threading
+import os
 
 engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
 
-database_session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# Path of the SQLite database file, None for other databases
+database_path = engine.url.database if engine.url.get_backend_name() == 'sqlite' and \
+    engine.url.database not in (None, '', ':memory:') else None
+
+
+def create_read_engine():
+    """
+    Pooled read-only connections to the database file. A refresh replaces the file, see database.shadow,
+    a connection to the replaced file is dropped when it is checked out and a new one is opened.
+    """
+    if not database_path:
+        return engine
+    read_engine = create_engine('sqlite:///file:' + os.path.abspath(database_path) + '?mode=ro&uri=true',
+                                poolclass=QueuePool, connect_args={'check_same_thread': False})
+
+    @event.listens_for(read_engine, 'do_connect')
+    def remember_file(dialect, connection_record, cargs, cparams):
+        # Taken before opening, so a swap in between makes the connection look outdated rather than current
+        connection_record.info['inode'] = file_inode()
+
+    @event.listens_for(read_engine, 'checkout')
+    def drop_replaced_file(dbapi_connection, connection_record, connection_proxy):
+        if connection_record.info.get('inode') != file_inode():
+            raise exc.DisconnectionError('The database file was replaced')
+
+    @event.listens_for(read_engine, 'handle_error')
+    def explain_read_only(context):
+        if 'readonly database' in str(context.original_exception):
+            raise ReadOnlyDatabaseError('Sessions only write within database.writing_to or '
+                                        'database.shadow.shadow_build, other sessions are read-only') \
+                from context.original_exception
+
+    return read_engine
+
+
+def file_inode():
+    try:
+        return os.stat(database_path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+class ReadOnlyDatabaseError(Exception):
+    pass
+
+
+read_engine = create_read_engine()
+
+# The engine the sessions of the current thread write to, set while a thread builds the statistics
+write_target = threading.local()
+
+
+class RoutingSession(Session):
+    """
+    Reads through the read-only pool, unless the thread writes to a database with writing_to.
+    Writers like the dutch_statistics ingest functions therefore only write within writing_to or
+    shadow.shadow_build, elsewhere their writes raise ReadOnlyDatabaseError.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        return getattr(write_target, 'engine', None) or read_engine
+
+
+@contextlib.contextmanager
+def writing_to(target_engine):
+    """Binds the sessions the current thread creates within to the engine"""
+    outer_engine = getattr(write_target, 'engine', None)
+    write_target.engine = target_engine
+    try:
+        yield target_engine
+    finally:
+        write_target.engine = outer_engine
+
+
+database_session = sessionmaker(class_=RoutingSession, autoflush=False, autocommit=False)
 
 Base = declarative_base()
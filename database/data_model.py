@@ -1,20 +1,61 @@
-from sqlalchemy import Column, Integer, String, Date, Boolean
+from sqlalchemy import Column, Integer, String, Date, Boolean, Float, ForeignKey
+from sqlalchemy.types import TypeDecorator
 from database import Base
+import datetime
 
+DAY_NUMBER_EPOCH = datetime.date(2020, 1, 1)
 
-class DutchIndividualCases(Base):
-    __tablename__ = 'DutchIndividualCases'
+
+class DayNumber(TypeDecorator):
+    """
+    Stores a date as the number of days since DAY_NUMBER_EPOCH, which takes less space and is faster to index,
+    group and compare than a date as text. Dates are converted both ways, so queries use datetime.date as usual.
+    """
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else value.toordinal() - DAY_NUMBER_EPOCH.toordinal()
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else datetime.date.fromordinal(value + DAY_NUMBER_EPOCH.toordinal())
+
+
+class DutchRegions(Base):
+    """
+    A municipality within a province. RIVM reports the cases of unknown municipalities per province,
+    those are stored as a region without municipality.
+    """
+    __tablename__ = 'DutchRegions'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    reported_date = Column(Date, index=True)
-    statistic_date = Column(Date, index=True)
-    hospitalised = Column(Boolean, index=True)
-    deceased = Column(Boolean, index=True)
-    sex = Column(String, index=True)
-    municipal_health_service = Column(String)
     province = Column(String)
+    municipality = Column(String, index=True)
+
+    def __repr__(self):
+        return self.attributes()
+
+    def __str__(self):
+        return str(self.attributes())
+
+    def attributes(self):
+        return {key: value for key, value in self.__dict__.items() if key[:1] != '_'}
+
+
+class DutchCaseCounts(Base):
+    """Number of cases of the RIVM cases file per combination of the properties RIVM publishes for a case"""
+    __tablename__ = 'DutchCaseCounts'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    reported_date = Column(DayNumber)
+    statistic_date = Column(DayNumber, index=True)
+    province = Column(String)
+    municipal_health_service = Column(String)
     age_group = Column(String)
-    week_of_death = Column(Integer)
+    sex = Column(String)
+    hospitalised = Column(Boolean)
+    deceased = Column(Boolean)
+    cases = Column(Integer)
 
     def __repr__(self):
         return self.attributes()
@@ -29,10 +70,8 @@ class DutchStatistics(Base):
     __tablename__ = 'DutchStatistics'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    province = Column(String, index=True)
-    municipality = Column(String, index=True)
-    city = Column(String, index=True)
-    reported_date = Column(Date, index=True)
+    region_id = Column(Integer, ForeignKey('DutchRegions.id'), index=True)
+    reported_date = Column(DayNumber, index=True)
     cumulative_infections = Column(Integer)
     cumulative_hospitalised = Column(Integer)
     cumulative_hospitalised_nice = Column(Integer)
@@ -60,3 +99,138 @@ class DutchStatistics(Base):
 
     def attributes(self):
         return {key: value for key, value in self.__dict__.items() if key[:1] != '_'}
+
+
+class DataSourceState(Base):
+    __tablename__ = 'DataSourceState'
+
+    source = Column(String, primary_key=True)
+    high_water_mark = Column(Date)
+
+    def __repr__(self):
+        return self.attributes()
+
+    def __str__(self):
+        return str(self.attributes())
+
+    def attributes(self):
+        return {key: value for key, value in self.__dict__.items() if key[:1] != '_'}
+
+
+class DutchDailyTotals(Base):
+    """National totals per day, aggregated from DutchStatistics at the end of a refresh"""
+    __tablename__ = 'DutchDailyTotals'
+
+    reported_date = Column(DayNumber, primary_key=True)
+    infections = Column(Integer)
+    infections_by_date = Column(Integer)
+    hospitalised = Column(Integer)
+    deaths = Column(Integer)
+    hospitalised_nice_proven = Column(Integer)
+    prevalence_avg = Column(Integer)
+    reproduction_no = Column(Float)
+
+    def __repr__(self):
+        return self.attributes()
+
+    def __str__(self):
+        return str(self.attributes())
+
+    def attributes(self):
+        return {key: value for key, value in self.__dict__.items() if key[:1] != '_'}
+
+
+class DutchProvinceDailyTotals(Base):
+    """Totals per province per day, aggregated from DutchStatistics at the end of a refresh"""
+    __tablename__ = 'DutchProvinceDailyTotals'
+
+    province = Column(String, primary_key=True)
+    reported_date = Column(DayNumber, primary_key=True)
+    infections = Column(Integer)
+    hospitalised = Column(Integer)
+    deaths = Column(Integer)
+    hospitalised_nice_proven = Column(Integer)
+
+    def __repr__(self):
+        return self.attributes()
+
+    def __str__(self):
+        return str(self.attributes())
+
+    def attributes(self):
+        return {key: value for key, value in self.__dict__.items() if key[:1] != '_'}
+
+
+class DutchMunicipalityDailyTotals(Base):
+    """Totals per municipality per day, aggregated from DutchStatistics at the end of a refresh"""
+    __tablename__ = 'DutchMunicipalityDailyTotals'
+
+    region_id = Column(Integer, ForeignKey('DutchRegions.id'), primary_key=True)
+    reported_date = Column(DayNumber, primary_key=True)
+    infections = Column(Integer)
+    hospitalised = Column(Integer)
+    deaths = Column(Integer)
+    hospitalised_nice_proven = Column(Integer)
+
+    def __repr__(self):
+        return self.attributes()
+
+    def __str__(self):
+        return str(self.attributes())
+
+    def attributes(self):
+        return {key: value for key, value in self.__dict__.items() if key[:1] != '_'}
+
+
+class DutchReproductionNumbers(Base):
+    """Daily Re per region, calculated from the daily infections at the end of a refresh"""
+    __tablename__ = 'DutchReproductionNumbers'
+
+    region_type = Column(String, primary_key=True)
+    region = Column(String, primary_key=True)
+    reported_date = Column(DayNumber, primary_key=True)
+    growth_rate = Column(Float)
+    reproduction_no = Column(Float)
+
+    def __repr__(self):
+        return self.attributes()
+
+    def __str__(self):
+        return str(self.attributes())
+
+    def attributes(self):
+        return {key: value for key, value in self.__dict__.items() if key[:1] != '_'}
+
+
+class DutchForecasts(Base):
+    """
+    Linear and exponential trend of the most recent days of a metric per region, fitted at the end of a refresh.
+    Both trends are a function of x, the day number within the fitted window, 1 for its first day and window for
+    fitted_to. The errors are the standard errors of the parameters, see forecast.fit_trends.
+    """
+    __tablename__ = 'DutchForecasts'
+
+    region_type = Column(String, primary_key=True)
+    region = Column(String, primary_key=True)
+    metric = Column(String, primary_key=True)
+    fitted_to = Column(DayNumber)
+    window = Column(Integer)
+    linear_intercept = Column(Float)
+    linear_intercept_error = Column(Float)
+    linear_slope = Column(Float)
+    linear_slope_error = Column(Float)
+    # Exponential trend scale * exp(growth_rate * x), the growth factor per day is exp(growth_rate)
+    scale = Column(Float)
+    scale_error = Column(Float)
+    growth_rate = Column(Float)
+    growth_rate_error = Column(Float)
+    growth_factor = Column(Float, index=True)
+
+    def __repr__(self):
+        return self.attributes()
+
+    def __str__(self):
+        return str(self.attributes())
+
+    def attributes(self):
+        return {key: value for key, value in self.__dict__.items() if key[:1] != '_'}
@@ -0,0 +1,109 @@
+"""
+Upgrades a database created with an older data model in place, run it through main.upgrade_database.
+
+DutchStatistics used to store the province, municipality and city as text on every row and all tables stored dates
+as text. The regions move to DutchRegions and the dates become day numbers, see data_model.DayNumber.
+Tables derived from the statistics are not converted but dropped and built again.
+"""
+from database import data_model, engine
+from sqlalchemy import inspect, text, Table, MetaData, Integer
+from database.data_model import DutchRegions, DutchStatistics, DutchCaseCounts
+import datetime
+
+COPY_BATCH_SIZE = 50000
+DERIVED_TABLES = ['DutchDailyTotals', 'DutchProvinceDailyTotals', 'DutchMunicipalityDailyTotals',
+                  'DutchReproductionNumbers']
+LEGACY_TABLES = ['DutchIndividualCases']
+
+
+def migrate():
+    """Upgrades the tables that use an older layout, returns True when the totals have to be built again"""
+    inspector = inspect(engine)
+    table_names = inspector.get_table_names()
+    rebuild_totals = False
+
+    if 'DutchStatistics' in table_names and \
+            'region_id' not in [column['name'] for column in inspector.get_columns('DutchStatistics')]:
+        migrate_statistics()
+        rebuild_totals = True
+
+    if 'DutchReproductionNumbers' in table_names and \
+            not uses_day_numbers(inspector, 'DutchReproductionNumbers', 'reported_date'):
+        rebuild_totals = True
+
+    if 'DutchCaseCounts' in table_names and not uses_day_numbers(inspector, 'DutchCaseCounts', 'statistic_date'):
+        copy_table(DutchCaseCounts, convert_dates(['reported_date', 'statistic_date']))
+
+    with engine.begin() as connection:
+        for table_name in LEGACY_TABLES + (DERIVED_TABLES if rebuild_totals else []):
+            connection.execute(text('DROP TABLE IF EXISTS "%s"' % table_name))
+    data_model.Base.metadata.create_all(bind=engine)
+    return rebuild_totals
+
+
+def uses_day_numbers(inspector, table_name, column_name):
+    column_type = next(column['type'] for column in inspector.get_columns(table_name) if column['name'] == column_name)
+    return isinstance(column_type, Integer)
+
+
+def migrate_statistics():
+    """Fills DutchRegions from the regions in DutchStatistics and refers to them by id"""
+    DutchRegions.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as connection:
+        connection.execute(text('INSERT INTO "DutchRegions" (province, municipality) '
+                                'SELECT DISTINCT province, municipality FROM "DutchStatistics"'))
+        region_ids = {(province, municipality): region_id for region_id, province, municipality in
+                      connection.execute(text('SELECT id, province, municipality FROM "DutchRegions"'))}
+
+    convert_row = convert_dates(['reported_date'])
+
+    def convert_statistics_row(row):
+        converted_row = convert_row(row)
+        converted_row['region_id'] = region_ids[(row['province'], row['municipality'])]
+        return converted_row
+
+    copy_table(DutchStatistics, convert_statistics_row)
+
+
+def convert_dates(date_columns):
+    """Returns a function converting the dates of a row to day numbers"""
+    epoch = data_model.DAY_NUMBER_EPOCH.toordinal()
+
+    def convert_row(row):
+        converted_row = dict(row)
+        for column in date_columns:
+            value = converted_row[column]
+            # Reflected date columns return dates, columns without a known type the text
+            if isinstance(value, str):
+                value = datetime.date.fromisoformat(value[:10])
+            converted_row[column] = None if value is None else value.toordinal() - epoch
+        return converted_row
+
+    return convert_row
+
+
+def copy_table(model, convert_row):
+    """
+    Recreates the table of the model with the current layout and copies the rows of the old table in batches,
+    converting every row with convert_row. The ids are kept.
+    """
+    table_name = model.__tablename__
+    old_table_name = table_name + '_old'
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        # Index names are global in SQLite, the old ones are in the way of the new table
+        for index in inspector.get_indexes(table_name):
+            connection.execute(text('DROP INDEX "%s"' % index['name']))
+        connection.execute(text('ALTER TABLE "%s" RENAME TO "%s"' % (table_name, old_table_name)))
+
+        model.__table__.create(bind=connection)
+        old_table = Table(old_table_name, MetaData(), autoload_with=connection)
+        new_columns = [column.name for column in model.__table__.columns]
+        # The dates are converted here already, the raw insert skips the DayNumber conversion
+        insert = model.__table__.insert().compile(dialect=connection.dialect, column_keys=new_columns)
+        rows = connection.execution_options(stream_results=True).execute(old_table.select())
+        for batch in rows.mappings().partitions(COPY_BATCH_SIZE):
+            converted_rows = [convert_row(row) for row in batch]
+            connection.exec_driver_sql(str(insert), [tuple(row[column] for column in new_columns)
+                                                     for row in converted_rows])
+        old_table.drop(bind=connection)
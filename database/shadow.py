@@ -0,0 +1,130 @@
+"""
+Builds the statistics in a copy of the database file and swaps it into place once it is complete.
+
+Web requests keep reading the live file at full speed while a refresh runs and never see a half-built table.
+The copy is made with the SQLite backup API, written in WAL mode with the syncs switched off, validated and
+renamed over the live file. Readers pick up the new file on their next checkout, see database.create_read_engine.
+"""
+from config import Config
+from database import data_model, database_path, engine, read_engine, writing_to
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool
+import contextlib
+import logging
+import metrics
+import sqlite3
+import os
+
+logger = logging.getLogger(__name__)
+
+SHADOW_SUFFIX = '.shadow'
+# Tables that never shrink much from one refresh to the next
+VALIDATED_TABLES = ['DutchStatistics', 'DutchCaseCounts', 'DutchDailyTotals', 'DutchReproductionNumbers']
+
+
+class ShadowValidationError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def shadow_build():
+    """
+    Sessions created within by the current thread write to a copy of the database, which replaces the live
+    database when the block finishes without errors and passes validation. Otherwise the copy is removed.
+    Yields the engine of the copy, so other threads can write to it with writing_to.
+    Databases other than SQLite files are written in place.
+    """
+    if not database_path:
+        with writing_to(engine):
+            yield engine
+        return
+
+    shadow_path = database_path + SHADOW_SUFFIX
+    remove_database_file(shadow_path)
+    with metrics.measure_stage('shadow_copy'):
+        copy_database(database_path, shadow_path)
+    shadow_engine = create_shadow_engine(shadow_path)
+    try:
+        data_model.Base.metadata.create_all(bind=shadow_engine)
+        with writing_to(shadow_engine):
+            yield shadow_engine
+        with metrics.measure_stage('shadow_swap'):
+            validate(shadow_engine)
+            finish(shadow_engine, shadow_path)
+            os.replace(shadow_path, database_path)
+    finally:
+        shadow_engine.dispose()
+        remove_database_file(shadow_path)
+
+
+def copy_database(source_path, target_path):
+    """Copies a consistent snapshot, also while other connections read the source"""
+    target = sqlite3.connect(target_path)
+    try:
+        if os.path.exists(source_path):
+            source = sqlite3.connect('file:' + os.path.abspath(source_path) + '?mode=ro', uri=True)
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+        target.execute('PRAGMA journal_mode=WAL')
+    finally:
+        target.close()
+
+
+def create_shadow_engine(shadow_path):
+    # The copy is created by the refresh and written by the writer of the pipeline, see pipeline
+    shadow_engine = create_engine('sqlite:///' + shadow_path, poolclass=QueuePool,
+                                  connect_args={'check_same_thread': False})
+
+    @event.listens_for(shadow_engine, 'connect')
+    def set_build_pragmas(dbapi_connection, connection_record):
+        # The shadow file is thrown away when the build fails, so nothing has to survive a crash
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA synchronous=OFF')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-%d' % Config.SHADOW_CACHE_KIB)
+        cursor.close()
+
+    return shadow_engine
+
+
+def count_rows(connection, table_names):
+    existing_tables = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type='table'"))}
+    return {table_name: connection.execute(text('SELECT COUNT(*) FROM "%s"' % table_name)).scalar()
+            if table_name in existing_tables else 0 for table_name in table_names}
+
+
+def validate(shadow_engine):
+    """Raises ShadowValidationError when a table of the shadow lost more rows than Config.SHADOW_MIN_ROW_RATIO allows"""
+    with shadow_engine.connect() as connection:
+        shadow_counts = count_rows(connection, VALIDATED_TABLES)
+    live_counts = {table_name: 0 for table_name in VALIDATED_TABLES}
+    if os.path.exists(database_path):
+        with read_engine.connect() as connection:
+            live_counts = count_rows(connection, VALIDATED_TABLES)
+
+    for table_name in VALIDATED_TABLES:
+        if shadow_counts[table_name] < live_counts[table_name] * Config.SHADOW_MIN_ROW_RATIO:
+            raise ShadowValidationError('%s has %d rows after the refresh, %d before' % (
+                    table_name, shadow_counts[table_name], live_counts[table_name]))
+        metrics.add_rows(shadow_counts[table_name])
+    logger.info('Validated shadow database: %s', shadow_counts)
+
+
+def finish(shadow_engine, shadow_path):
+    """Moves the WAL into the file and leaves WAL mode, so the live file is complete by itself and durable"""
+    with shadow_engine.connect() as connection:
+        connection.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+        connection.exec_driver_sql('PRAGMA journal_mode=DELETE')
+    shadow_engine.dispose()
+    with open(shadow_path, mode='rb') as shadow_file:
+        os.fsync(shadow_file.fileno())
+
+
+def remove_database_file(path):
+    for file_path in (path, path + '-wal', path + '-shm', path + '-journal'):
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
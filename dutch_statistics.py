@@ -1,53 +1,245 @@
+import collections
 import datetime
 import json
+import logging
+import metrics
+import numpy as np
+import os
+import query_cache
+import time
+import util
+from config import Config
 from database import data_model, database_session
-from database.data_model import DutchStatistics, DutchIndividualCases
+from database.data_model import DutchStatistics, DutchRegions, DutchCaseCounts, DataSourceState, DutchDailyTotals, \
+    DutchProvinceDailyTotals, DutchMunicipalityDailyTotals, DutchReproductionNumbers, DutchForecasts
+from sqlalchemy import bindparam, select, case, literal, union_all
 from sqlalchemy.sql import func
 
+logger = logging.getLogger(__name__)
 
-def get_rivm_stats():
+# Cases are counted per combination of these columns of DutchCaseCounts, see case_key
+CASE_KEY_COLUMNS = ['reported_date', 'statistic_date', 'province', 'municipal_health_service', 'age_group', 'sex',
+                    'hospitalised', 'deceased']
+# Unknown is stored as NULL
+YES_NO = {'Yes': True, 'No': False}
+# Columns shared by the national, province and municipality totals
+REGION_METRICS = ('infections', 'hospitalised', 'deaths', 'hospitalised_nice_proven')
+NICE_SOURCES = ['NICE_DAILY_INTAKE', 'NICE_CUMULATIVE_INTAKE']
+# Days before the high-water mark that a source revises, see get_first_new_date
+REVISED_DAYS = {source: Config.NICE_REVISION_DAYS for source in NICE_SOURCES}
+
+
+@metrics.instrumented_stage('rivm')
+def get_rivm_stats(bulk=True, batch_size=Config.INGEST_BATCH_SIZE, incremental=False, parsed_files=None):
+    """
+    Parameters
+    ----------
+    bulk: boolean, optional
+        defaults to true; insert plain rows through Core executemany in batches of batch_size.
+        When false every row is added as a DutchStatistics ORM instance
+    batch_size: int, optional
+        number of rows per executemany call in bulk mode
+    incremental: boolean, optional
+        defaults to false; keep the stored statistics and only insert report dates newer than the high-water mark.
+        Prevalence and reproduction numbers published since the previous refresh are added to the stored rows.
+        Without a stored high-water mark all statistics are replaced, as without incremental
+    parsed_files: tuple, optional
+        the result of parse_rivm_files for the same high-water mark, the files are parsed when it is not given
+
+    :return:
+    number of rows stored
+    """
     session = database_session()
-    session.query(DutchStatistics).delete()
-    rivm_cumulative = json.loads(open('data_files/RIVM_CUMULATIVE.json').read())
-    rivm_prevalence = json.loads(open('data_files/RIVM_PREVALENCE.json').read())
-    rivm_reproduction = json.loads(open('data_files/RIVM_REPRODUCTION.json').read())
+    high_water_marks = get_high_water_marks() if incremental else {}
+    # Without a high-water mark, like in a database upgraded by migrations, it is unknown which reports are stored
+    incremental = bool(high_water_marks.get('RIVM_CUMULATIVE'))
+    if not incremental:
+        high_water_marks = {}
+        session.query(DutchStatistics).delete()
+    if parsed_files is None:
+        with metrics.phase('parse'):
+            parsed_files = parse_rivm_files(high_water_marks.get('RIVM_CUMULATIVE'))
+    rivm_cumulative, prevalence_dict, reproduction_dict = parsed_files
+
+    if incremental:
+        update_daily_figures(session, prevalence_dict, high_water_marks.get('RIVM_PREVALENCE'),
+                             {'prevalence_low': 'prev_low', 'prevalence_avg': 'prev_avg', 'prevalence_high': 'prev_up'})
+        update_daily_figures(session, reproduction_dict, high_water_marks.get('RIVM_REPRODUCTION'),
+                             {'reproduction_no': 'Rt_avg'})
+
+    rivm_high_water_mark = high_water_marks.get('RIVM_CUMULATIVE')
+    start_time = time.perf_counter()
+    region_ids = get_region_ids(session, rivm_cumulative)
+    if bulk:
+        insert_statement = DutchStatistics.__table__.insert()
+        rows = (convert_rivm_record(record, prevalence_dict, reproduction_dict, region_ids)
+                for record in rivm_cumulative)
+        for batch in metrics.timed_iteration(util.batched(rows, batch_size), 'convert'):
+            with metrics.phase('insert'):
+                session.execute(insert_statement, batch)
+    else:
+        for record in rivm_cumulative:
+            session.add(data_model.DutchStatistics(**convert_rivm_record(record, prevalence_dict, reproduction_dict,
+                                                                         region_ids)))
+    metrics.add_rows(len(rivm_cumulative))
+
+    if rivm_cumulative:
+        rivm_high_water_mark = datetime.date.fromisoformat(max(record['Date_of_report'] for record in
+                                                               rivm_cumulative)[0:10])
+    set_high_water_mark(session, 'RIVM_CUMULATIVE', rivm_high_water_mark)
+    set_high_water_mark(session, 'RIVM_PREVALENCE', max(prevalence_dict, default=None))
+    set_high_water_mark(session, 'RIVM_REPRODUCTION', max(reproduction_dict, default=None))
+    with metrics.phase('commit'):
+        session.commit()
+    session.close()
+
+    elapsed_time = time.perf_counter() - start_time
+    logger.info('Stored %d RIVM statistics in %.1f seconds (%s)', len(rivm_cumulative), elapsed_time,
+                'bulk' if bulk else 'orm')
+    return len(rivm_cumulative)
+
+
+def parse_rivm_files(high_water_mark=None):
+    """
+    Decodes the RIVM files, runs in a parse worker during a refresh, see pipeline
+
+    :return:
+    the cumulative records reported after the high-water mark and the prevalence and reproduction records per date
+    """
+    rivm_cumulative = util.load_data_file('RIVM_CUMULATIVE')
+    rivm_prevalence = util.load_data_file('RIVM_PREVALENCE')
+    rivm_reproduction = util.load_data_file('RIVM_REPRODUCTION')
     prevalence_dict = {datetime.date.fromisoformat(record['Date']): record for record in rivm_prevalence}
     reproduction_dict = {datetime.date.fromisoformat(record['Date']): record for record in rivm_reproduction}
-    for record in rivm_cumulative:
-        reported_date = datetime.date.fromisoformat(record['Date_of_report'][0:10])
-        dutch_daily_stat = data_model.DutchStatistics(
-                province=record['Province'],
-                municipality=record['Municipality_name'],
-                reported_date=reported_date,
-                cumulative_infections=record['Total_reported'],
-                cumulative_hospitalised=record['Hospital_admission'],
-                cumulative_deaths=record['Deceased']
-        )
-        related_record = prevalence_dict.get(reported_date)
-        if related_record:
-            dutch_daily_stat.prevalence_low = related_record.get('prev_low')
-            dutch_daily_stat.prevalence_avg = related_record.get('prev_avg')
-            dutch_daily_stat.prevalence_high = related_record.get('prev_up')
-        reproduction_record = reproduction_dict.get(reported_date)
-        if related_record:
-            dutch_daily_stat.reproduction_no = reproduction_record.get('Rt_avg')
-        session.add(dutch_daily_stat)
-    session.commit()
+
+    # Dates in the ISO format can be compared as strings, which saves parsing the dates of known records
+    if high_water_mark:
+        rivm_cumulative = [record for record in rivm_cumulative
+                           if record['Date_of_report'][0:10] > high_water_mark.isoformat()]
+    return rivm_cumulative, prevalence_dict, reproduction_dict
+
+
+def get_region_ids(session, rivm_cumulative):
+    """Returns the id of every province and municipality pair, the regions of the records that are new are added"""
+    region_ids = {(region.province, region.municipality): region.id for region in session.query(DutchRegions)}
+    new_regions = {(record['Province'], record['Municipality_name']) for record in rivm_cumulative} - set(region_ids)
+    if new_regions:
+        session.execute(DutchRegions.__table__.insert(),
+                        [{'province': province, 'municipality': municipality} for province, municipality in
+                         sorted(new_regions, key=lambda region: (region[0] or '', region[1] or ''))])
+        region_ids = {(region.province, region.municipality): region.id for region in session.query(DutchRegions)}
+    return region_ids
+
+
+def get_municipality_region_id(session, municipality):
+    """Returns the id of the region of the municipality, None when it is unknown"""
+    region_ids = session.query(DutchRegions.id).filter_by(municipality=municipality).limit(2).all()
+    # The totals and the series cache identify a municipality by its name, so it must be in one province only
+    if len(region_ids) > 1:
+        raise ValueError('Municipality ' + municipality + ' is stored in more than one province')
+    return region_ids[0].id if region_ids else None
+
+
+def convert_rivm_record(record, prevalence_dict, reproduction_dict, region_ids):
+    """
+    Converts a RIVM cumulative record to a DutchStatistics row joined with the prevalence and Re of that day
+    and the id of its region, see get_region_ids
+    """
+    reported_date = datetime.date.fromisoformat(record['Date_of_report'][0:10])
+    prevalence_record = prevalence_dict.get(reported_date, {})
+    reproduction_record = reproduction_dict.get(reported_date, {})
+    return {
+        'region_id': region_ids[(record['Province'], record['Municipality_name'])],
+        'reported_date': reported_date,
+        'cumulative_infections': record['Total_reported'],
+        'cumulative_hospitalised': record['Hospital_admission'],
+        'cumulative_deaths': record['Deceased'],
+        'prevalence_low': prevalence_record.get('prev_low'),
+        'prevalence_avg': prevalence_record.get('prev_avg'),
+        'prevalence_high': prevalence_record.get('prev_up'),
+        'reproduction_no': reproduction_record.get('Rt_avg')
+    }
+
+
+def update_daily_figures(session, records_by_date, high_water_mark, columns):
+    """
+    Sets the columns of all stored statistics of a day to the values of the record of that day,
+    for every record newer than the high-water mark.
+    columns maps the DutchStatistics column to the key of the value in the record.
+    """
+    new_records = [(record_date, record) for record_date, record in records_by_date.items()
+                   if not high_water_mark or record_date > high_water_mark]
+    if not new_records:
+        return
+
+    update_statement = DutchStatistics.__table__.update() \
+        .where(DutchStatistics.reported_date == bindparam('record_date')) \
+        .values({column: bindparam('new_' + column) for column in columns})
+    session.execute(update_statement, [dict({'new_' + column: record.get(key) for column, key in columns.items()},
+                                            record_date=record_date) for record_date, record in new_records])
+
+
+def get_high_water_marks():
+    """Returns the date of the newest record stored per data source, keyed by the name of the source"""
+    session = database_session()
+    high_water_marks = {state.source: state.high_water_mark for state in session.query(DataSourceState)}
     session.close()
+    return high_water_marks
+
 
+def set_high_water_mark(session, source, high_water_mark):
+    session.merge(DataSourceState(source=source, high_water_mark=high_water_mark))
 
-def get_nice_stats():
+
+@metrics.instrumented_stage('nice')
+def get_nice_stats(incremental=False, parsed_files=None):
     """
     NICE daily intake data consists of two arrays:
         the first array contains proven covid cases
         the second array contains suspected covid cases
+
+    In incremental mode only the statistics reported after the NICE high-water marks are updated, together with the
+    Config.NICE_REVISION_DAYS days before them, because NICE revises the intake of recent days.
+    The high-water marks are the newest stored report dates NICE had figures for, so days RIVM published before NICE
+    are updated once NICE publishes them.
+    parsed_files is the result of parse_nice_files, the files are parsed when it is not given
     """
     session = database_session()
     query = session.query(DutchStatistics).order_by(DutchStatistics.reported_date.desc())
-    all_stats = query.all()
+    high_water_marks = get_high_water_marks() if incremental else {}
+    first_new_date = get_first_new_date(high_water_marks, NICE_SOURCES)
+    if first_new_date:
+        query = query.filter(DutchStatistics.reported_date >= first_new_date)
+    with metrics.phase('query'):
+        all_stats = query.all()
+
+    if parsed_files is None:
+        with metrics.phase('parse'):
+            parsed_files = parse_nice_files()
+    daily_proven_dict, daily_suspected_dict, nice_intake_cumulative_dict = parsed_files
+
+    for record in all_stats:
+        record.hospitalised_nice_proven = daily_proven_dict.get(record.reported_date)
+        record.hospitalised_nice_suspected = daily_suspected_dict.get(record.reported_date)
+        record.cumulative_hospitalised_nice = nice_intake_cumulative_dict.get(record.reported_date)
+    metrics.add_rows(len(all_stats))
+
+    for source, figures_dict in (('NICE_DAILY_INTAKE', daily_proven_dict),
+                                 ('NICE_CUMULATIVE_INTAKE', nice_intake_cumulative_dict)):
+        stored_dates = {record.reported_date for record in all_stats if record.reported_date in figures_dict}
+        if high_water_marks.get(source):
+            stored_dates.add(high_water_marks[source])
+        set_high_water_mark(session, source, max(stored_dates, default=None))
+    # The changed records are flushed by the commit
+    with metrics.phase('commit'):
+        session.commit()
+    session.close()
 
-    nice_daily_intake = json.loads(open('data_files/NICE_DAILY_INTAKE.json').read())
-    nice_intake_cumulative = json.loads(open('data_files/NICE_CUMULATIVE_INTAKE.json').read())
+
+def parse_nice_files():
+    """Returns the proven and suspected daily intake and the cumulative intake per date"""
+    nice_daily_intake = util.load_data_file('NICE_DAILY_INTAKE')
+    nice_intake_cumulative = util.load_data_file('NICE_CUMULATIVE_INTAKE')
 
     daily_proven_dict = {datetime.date.fromisoformat(stat.get('date')): stat.get('value') for stat in
                          nice_daily_intake[0]}
@@ -55,45 +247,224 @@ def get_nice_stats():
                             nice_daily_intake[1]}
     nice_intake_cumulative_dict = {datetime.date.fromisoformat(stat.get('date')): stat.get('value') for stat in
                                    nice_intake_cumulative}
+    return daily_proven_dict, daily_suspected_dict, nice_intake_cumulative_dict
 
-    for record in all_stats:
-        record.hospitalised_nice_proven = daily_proven_dict.get(record.reported_date)
-        record.hospitalised_nice_suspected = daily_suspected_dict.get(record.reported_date)
-        record.cumulative_hospitalised_nice = nice_intake_cumulative_dict.get(record.reported_date)
 
-    session.commit()
+@metrics.instrumented_stage('cases')
+def get_individual_cases_stats(streaming=True, batch_size=Config.INGEST_BATCH_SIZE, incremental=False,
+                               parsed_file=None):
+    """
+    Counts the cases of the cases file per combination of their properties in one pass and replaces the counts
+    stored in DutchCaseCounts
+
+    Parameters
+    ----------
+    streaming: boolean, optional
+        defaults to true; parse the cases file incrementally, so only the counts are held in memory.
+        When false the whole file is loaded first
+    batch_size: int, optional
+        number of cases parsed and counts written at a time
+    incremental: boolean, optional
+        defaults to false; skip the file when its Date_file is not newer than the stored cases.
+        The cases file is a full snapshot, so a newer file always replaces the stored cases
+    parsed_file: tuple, optional
+        the result of parse_cases_file for the same high-water mark, the file is parsed when it is not given
+
+    :return:
+    number of cases counted
+    """
+    start_time = time.perf_counter()
+    if parsed_file is None:
+        high_water_mark = get_high_water_marks().get('RIVM_CASES') if incremental else None
+        parsed_file = parse_cases_file(high_water_mark, streaming, batch_size)
+    if parsed_file is None:
+        return 0
+    file_date, no_cases, case_counts = parsed_file
+    metrics.add_bytes_read(os.path.getsize(util.data_file_path('RIVM_CASES')))
+    metrics.add_rows(no_cases)
+
+    # The counts are replaced in one transaction, so readers never see a partial set
+    session = database_session()
+    with metrics.phase('insert'):
+        session.query(DutchCaseCounts).delete()
+        insert_statement = DutchCaseCounts.__table__.insert()
+        rows = (convert_case_count(case_key, case_count) for case_key, case_count in case_counts.items())
+        for batch in util.batched(rows, batch_size):
+            session.execute(insert_statement, batch)
+
+    set_high_water_mark(session, 'RIVM_CASES', file_date)
+    with metrics.phase('commit'):
+        session.commit()
     session.close()
 
+    elapsed_time = time.perf_counter() - start_time
+    logger.info('Stored %d individual cases as %d counts in %.1f seconds (%.0f cases/s)', no_cases, len(case_counts),
+                elapsed_time, no_cases / elapsed_time if elapsed_time else 0)
+    return no_cases
+
+
+def parse_cases_file(high_water_mark=None, streaming=True, batch_size=Config.INGEST_BATCH_SIZE):
+    """
+    Counts the cases of the cases file, see get_individual_cases_stats
+
+    :return:
+    the date of the file, the number of cases and the Counter of the cases per case_key.
+    None when the file is empty or not newer than the high-water mark
+    """
+    cases_path = util.data_file_path('RIVM_CASES')
+    first_case = next(util.iterate_json_array(cases_path), None)
+    if first_case is None:
+        return None
+    file_date = datetime.date.fromisoformat(first_case.get('Date_file')[0:10])
+    if high_water_mark and file_date <= high_water_mark:
+        logger.info('Skipping individual cases, the stored cases of %s are up to date', high_water_mark)
+        return None
+
+    if streaming:
+        rivm_cases = util.iterate_json_array(cases_path)
+    else:
+        rivm_cases = json.loads(open(cases_path).read())
+    no_cases, case_counts = count_cases(rivm_cases, batch_size)
+    return file_date, no_cases, case_counts
+
+
+def count_cases(rivm_cases, batch_size=Config.INGEST_BATCH_SIZE):
+    """Returns the number of cases and a Counter of the cases per case_key"""
+    case_counts = collections.Counter()
+    no_cases = 0
+    for batch in metrics.timed_iteration(util.batched(rivm_cases, batch_size), 'parse'):
+        with metrics.phase('count'):
+            case_counts.update(map(case_key, batch))
+        no_cases += len(batch)
+    return no_cases, case_counts
+
+
+def case_key(record):
+    """The properties a case is counted by, in the order of CASE_KEY_COLUMNS"""
+    return (record.get('Date_file')[0:10], record.get('Date_statistics'), record.get('Province'),
+            record.get('Municipal_health_service'), record.get('Agegroup'), record.get('Sex'),
+            YES_NO.get(record.get('Hospital_admission')), YES_NO.get(record.get('Deceased')))
+
+
+def convert_case_count(key, no_cases):
+    row = dict(zip(CASE_KEY_COLUMNS, key))
+    row['reported_date'] = datetime.date.fromisoformat(row['reported_date'])
+    row['statistic_date'] = datetime.date.fromisoformat(row['statistic_date'])
+    row['cases'] = no_cases
+    return row
+
+
+@metrics.instrumented_stage('daily_statistics')
+def calculate_dutch_daily_statistics(since=None, set_based=True, batch_size=Config.INGEST_BATCH_SIZE):
+    """
+    Parameters
+    ----------
+    since: datetime.date, optional
+        only recalculate the statistics reported on or after this date, used by incremental refreshes.
+        Defaults to recalculating everything
+    set_based: boolean, optional
+        defaults to true; calculate the daily differences with LAG() window functions and write them back with
+        executemany in batches of batch_size. When false the ORM records are compared and updated one by one
+    """
+    if not set_based:
+        return calculate_dutch_daily_statistics_per_record(since)
 
-def get_individual_cases_stats():
     session = database_session()
-    rivm_cases = json.loads(open('data_files/RIVM_CASES.json').read())
-    for record in rivm_cases:
-        reported_date = datetime.date.fromisoformat(record.get('Date_file')[0:10])
-        statistic_date = datetime.date.fromisoformat(record.get('Date_statistics'))
-        case_stat = data_model.DutchIndividualCases(reported_date=reported_date,
-                                                    statistic_date=statistic_date)
-        session.add(case_stat)
-    session.commit()
+    with metrics.phase('query'):
+        dutch_cases_stat_dict = get_cases_by_statistic_date(session)
+
+        # Municipality records are compared per municipality, records without a municipality per province
+        municipality_differences = select_daily_differences(session, DutchRegions.municipality.isnot(None), since)
+        province_differences = select_daily_differences(session, DutchRegions.municipality.is_(None), since)
+
+    first_records = []
+    municipality_records = []
+    province_records = []
+    for differences, records in ((municipality_differences, municipality_records),
+                                 (province_differences, province_records)):
+        for row_id, reported_date, yesterday_id, infections, deaths, hospitalised in differences:
+            if since and reported_date < since:
+                continue
+            if yesterday_id is None:
+                first_records.append({'row_id': row_id, 'new_infections': 0, 'new_deaths': 0,
+                                      'new_hospitalised': 0})
+            else:
+                records.append({'row_id': row_id, 'new_infections': infections, 'new_deaths': deaths,
+                                'new_hospitalised': hospitalised,
+                                'new_infections_by_date': dutch_cases_stat_dict.get(reported_date)})
+
+    update_statement = DutchStatistics.__table__.update() \
+        .where(DutchStatistics.id == bindparam('row_id')) \
+        .values(infections=bindparam('new_infections'),
+                deaths=bindparam('new_deaths'),
+                hospitalised=bindparam('new_hospitalised'))
+    update_with_cases_statement = update_statement.values(infections_by_date=bindparam('new_infections_by_date'))
+    with metrics.phase('update'):
+        for statement, records in ((update_statement, first_records),
+                                   (update_statement, province_records),
+                                   (update_with_cases_statement, municipality_records)):
+            for batch in util.batched(records, batch_size):
+                session.execute(statement, batch)
+            metrics.add_rows(len(records))
+
+        # Every cases file restates the cases of earlier dates, so older counts are corrected as well
+        if since:
+            update_restated_infections_by_date(session, dutch_cases_stat_dict, since)
+
+    with metrics.phase('commit'):
+        session.commit()
     session.close()
 
 
-def calculate_dutch_daily_statistics():
+def select_daily_differences(session, region_filter, since=None):
+    """
+    Selects the difference of the cumulative numbers with the previous record of the same region,
+    for the records of the regions matching the filter
+    """
+    window = {'partition_by': DutchStatistics.region_id, 'order_by': DutchStatistics.id}
+    query = session.query(DutchStatistics.id,
+                          DutchStatistics.reported_date,
+                          func.lag(DutchStatistics.id).over(**window),
+                          DutchStatistics.cumulative_infections -
+                          func.lag(DutchStatistics.cumulative_infections).over(**window),
+                          DutchStatistics.cumulative_deaths -
+                          func.lag(DutchStatistics.cumulative_deaths).over(**window),
+                          DutchStatistics.cumulative_hospitalised -
+                          func.lag(DutchStatistics.cumulative_hospitalised).over(**window)) \
+        .filter(DutchStatistics.region_id.in_(select(DutchRegions.id).where(region_filter)))
+    if since:
+        # The day before is needed to calculate the differences, but is not recalculated itself
+        query = query.filter(DutchStatistics.reported_date >= since - datetime.timedelta(days=1))
+    return query.all()
+
+
+def get_cases_by_statistic_date(session):
+    dutch_cases_stats = session.query(DutchCaseCounts.statistic_date,
+                                      func.sum(DutchCaseCounts.cases)).group_by(
+                                      DutchCaseCounts.statistic_date).order_by(
+                                      DutchCaseCounts.statistic_date).all()
+
+    return {stat[0]: stat[1] for stat in dutch_cases_stats}
+
+
+def calculate_dutch_daily_statistics_per_record(since=None):
     session = database_session()
-    dutch_cumu_stats = session.query(DutchStatistics).order_by(DutchStatistics.municipality).order_by(
-            DutchStatistics.id).all()
-
-    dutch_cases_stats = session.query(DutchIndividualCases.statistic_date,
-                                      func.count(DutchIndividualCases.id)).group_by(
-                                      DutchIndividualCases.statistic_date).order_by(
-                                      DutchIndividualCases.statistic_date).all()
+    municipalities = dict(session.query(DutchRegions.id, DutchRegions.municipality))
+    query = session.query(DutchStatistics).order_by(DutchStatistics.region_id).order_by(DutchStatistics.id)
+    if since:
+        # The day before is needed to calculate the differences, but is not recalculated itself
+        query = query.filter(DutchStatistics.reported_date >= since - datetime.timedelta(days=1))
+    dutch_cumu_stats = query.all()
 
-    dutch_cases_stat_dict = {stat[0]: stat[1] for stat in dutch_cases_stats}
+    dutch_cases_stat_dict = get_cases_by_statistic_date(session)
 
     index = 0
     for record in dutch_cumu_stats:
         yesterday_record = dutch_cumu_stats[index - 1]
-        if index > 0 and record.municipality is not None and record.municipality == yesterday_record.municipality:
+        if since and record.reported_date < since:
+            pass
+        elif index > 0 and municipalities.get(record.region_id) is not None \
+                and record.region_id == yesterday_record.region_id:
             record.infections_by_date = dutch_cases_stat_dict.get(record.reported_date)
             record.infections = record.cumulative_infections - yesterday_record.cumulative_infections
             record.deaths = record.cumulative_deaths - yesterday_record.cumulative_deaths
@@ -104,14 +475,20 @@ def calculate_dutch_daily_statistics():
             record.hospitalised = 0
         index += 1
 
-    no_municipality_records = session.query(DutchStatistics).filter_by(municipality=None).order_by(
-            DutchStatistics.province).order_by(
-            DutchStatistics.id).all()
+    query = session.query(DutchStatistics).filter(
+            DutchStatistics.region_id.in_(select(DutchRegions.id).where(DutchRegions.municipality.is_(None)))).order_by(
+            DutchStatistics.region_id).order_by(
+            DutchStatistics.id)
+    if since:
+        query = query.filter(DutchStatistics.reported_date >= since - datetime.timedelta(days=1))
+    no_municipality_records = query.all()
 
     index = 0
     for record in no_municipality_records:
         yesterday_record = no_municipality_records[index - 1]
-        if index > 0 and record.province == yesterday_record.province:
+        if since and record.reported_date < since:
+            pass
+        elif index > 0 and record.region_id == yesterday_record.region_id:
             record.infections = record.cumulative_infections - yesterday_record.cumulative_infections
             record.deaths = record.cumulative_deaths - yesterday_record.cumulative_deaths
             record.hospitalised = record.cumulative_hospitalised - yesterday_record.cumulative_hospitalised
@@ -121,24 +498,139 @@ def calculate_dutch_daily_statistics():
             record.hospitalised = 0
         index += 1
 
+    # Every cases file restates the cases of earlier dates, so older counts are corrected as well
+    if since:
+        update_restated_infections_by_date(session, dutch_cases_stat_dict, since)
+
     session.commit()
     session.close()
 
 
-def sum_dutch_total_infections(municipality, province):
+def update_restated_infections_by_date(session, dutch_cases_stat_dict, before):
+    """
+    Sets infections_by_date of the statistics reported before the date to the cases of the current cases file.
+    Only municipality records after the first of their municipality have it, like a full calculation sets it,
+    and dates the file no longer contains are reset to NULL.
+    """
+    municipality_records = DutchStatistics.region_id.in_(select(DutchRegions.id)
+                                                         .where(DutchRegions.municipality.isnot(None)))
+    restated_dates = [row[0] for row in session.query(DutchStatistics.reported_date).distinct()
+                      .filter(municipality_records, DutchStatistics.reported_date < before)]
+    update_statement = DutchStatistics.__table__.update() \
+        .where(DutchStatistics.reported_date == bindparam('statistic_date')) \
+        .where(municipality_records) \
+        .where(DutchStatistics.infections_by_date.is_distinct_from(bindparam('no_cases'))) \
+        .values(infections_by_date=bindparam('no_cases'))
+    if restated_dates:
+        session.execute(update_statement, [{'statistic_date': statistic_date,
+                                            'no_cases': dutch_cases_stat_dict.get(statistic_date)}
+                                           for statistic_date in restated_dates])
+
+    # Excluding the first records in the statement above would evaluate the subquery once per date
+    first_record_ids = select(func.min(DutchStatistics.id)).group_by(DutchStatistics.region_id).correlate(None)
+    session.execute(DutchStatistics.__table__.update()
+                    .where(DutchStatistics.id.in_(first_record_ids))
+                    .where(DutchStatistics.reported_date < before)
+                    .where(DutchStatistics.infections_by_date.isnot(None))
+                    .values(infections_by_date=None))
+
+
+@metrics.instrumented_stage('daily_totals')
+def build_daily_totals(since=None):
+    """
+    Aggregates DutchStatistics into the national, province and municipality totals per day that are read when plotting
+
+    Parameters
+    ----------
+    since: datetime.date, optional
+        only rebuild the totals reported on or after this date, used by incremental refreshes.
+        Defaults to rebuilding all totals
+    """
     session = database_session()
-    query = session.query(DutchStatistics.reported_date,
-                          func.sum(DutchStatistics.infections),
-                          func.sum(DutchStatistics.hospitalised),
-                          func.sum(DutchStatistics.deaths),
-                          DutchStatistics.hospitalised_nice_proven) \
-        .group_by(DutchStatistics.reported_date) \
-        .order_by(DutchStatistics.reported_date.desc())
+    total_columns = [func.sum(DutchStatistics.infections),
+                     func.sum(DutchStatistics.hospitalised),
+                     func.sum(DutchStatistics.deaths),
+                     func.max(DutchStatistics.hospitalised_nice_proven)]
+
+    national_totals = select(DutchStatistics.reported_date, *total_columns,
+                             func.max(DutchStatistics.infections_by_date),
+                             func.max(DutchStatistics.prevalence_avg),
+                             func.max(DutchStatistics.reproduction_no)) \
+        .group_by(DutchStatistics.reported_date)
+    province_totals = select(DutchRegions.province, DutchStatistics.reported_date, *total_columns) \
+        .join_from(DutchStatistics, DutchRegions, DutchStatistics.region_id == DutchRegions.id) \
+        .filter(DutchRegions.province.isnot(None)) \
+        .group_by(DutchRegions.province, DutchStatistics.reported_date)
+    municipality_totals = select(DutchStatistics.region_id, DutchStatistics.reported_date, *total_columns) \
+        .filter(DutchStatistics.region_id.in_(select(DutchRegions.id).where(DutchRegions.municipality.isnot(None)))) \
+        .group_by(DutchStatistics.region_id, DutchStatistics.reported_date)
+
+    for totals_model, totals_select, columns in (
+            (DutchDailyTotals, national_totals,
+             ['reported_date', 'infections', 'hospitalised', 'deaths', 'hospitalised_nice_proven',
+              'infections_by_date', 'prevalence_avg', 'reproduction_no']),
+            (DutchProvinceDailyTotals, province_totals,
+             ['province', 'reported_date', 'infections', 'hospitalised', 'deaths', 'hospitalised_nice_proven']),
+            (DutchMunicipalityDailyTotals, municipality_totals,
+             ['region_id', 'reported_date', 'infections', 'hospitalised', 'deaths', 'hospitalised_nice_proven'])):
+        delete_query = session.query(totals_model)
+        if since:
+            delete_query = delete_query.filter(totals_model.reported_date >= since)
+            totals_select = totals_select.filter(DutchStatistics.reported_date >= since)
+        with metrics.phase('aggregate'):
+            delete_query.delete(synchronize_session=False)
+            result = session.execute(totals_model.__table__.insert().from_select(columns, totals_select))
+        metrics.add_rows(result.rowcount)
+
+    # The cases of earlier dates are restated by every cases file, see update_restated_infections_by_date,
+    # so those totals are aggregated again from the statistics
+    if since:
+        restated_infections = select(func.max(DutchStatistics.infections_by_date)) \
+            .where(DutchStatistics.reported_date == DutchDailyTotals.reported_date) \
+            .scalar_subquery()
+        session.execute(DutchDailyTotals.__table__.update()
+                        .where(DutchDailyTotals.reported_date < since)
+                        .values(infections_by_date=restated_infections))
+
+    with metrics.phase('commit'):
+        session.commit()
+    session.close()
 
-    if municipality:
-        query = query.filter_by(municipality=municipality)
 
-    if province:
+def get_first_new_date(high_water_marks, sources):
+    """
+    Returns the day after the oldest high-water mark of the sources, which is the first date affected by a refresh.
+    Sources that revise recent days start REVISED_DAYS earlier.
+    None means all dates are affected, because one of the sources has not been stored before.
+    """
+    first_new_dates = [high_water_marks.get(source) for source in sources]
+    if not first_new_dates or None in first_new_dates:
+        return None
+    return min(high_water_mark - datetime.timedelta(days=REVISED_DAYS.get(source, 0))
+               for source, high_water_mark in zip(sources, first_new_dates)) + datetime.timedelta(days=1)
+
+
+@query_cache.cached_query
+def sum_dutch_total_infections(municipality, province):
+    session = database_session()
+    if municipality:
+        totals_model = DutchMunicipalityDailyTotals
+    elif province:
+        totals_model = DutchProvinceDailyTotals
+    else:
+        totals_model = DutchDailyTotals
+
+    query = session.query(totals_model.reported_date,
+                          totals_model.infections,
+                          totals_model.hospitalised,
+                          totals_model.deaths,
+                          totals_model.hospitalised_nice_proven) \
+        .order_by(totals_model.reported_date.desc())
+
+    # Municipalities are looked up once, the totals are filtered on the id of the region
+    if municipality:
+        query = query.filter_by(region_id=get_municipality_region_id(session, municipality))
+    elif province:
         query = query.filter_by(province=province)
 
     dutch_totals = query.all()
@@ -147,15 +639,86 @@ def sum_dutch_total_infections(municipality, province):
     return dutch_totals
 
 
+@query_cache.cached_query
+def get_region_series(municipalities=(), provinces=(), national=False, start_date=None, end_date=None,
+                      columns=REGION_METRICS):
+    """
+    Fetches the daily totals of several regions with one query and aligns them on the same dates
+
+    Parameters
+    ----------
+    municipalities: list of str, optional
+        names of the municipalities
+    provinces: list of str, optional
+        names of the provinces
+    national: boolean, optional
+        adds the national totals as region ('national', '')
+    start_date: datetime.date, optional
+        first date, defaults to the first date with data
+    end_date: datetime.date, optional
+        last date, defaults to the last date with data
+    columns: tuple of str, optional
+        columns of the totals to fetch
+
+    :return:
+    dict with the days in ascending order as 'dates', the (region_type, region) tuples in the order they were given
+    as 'regions' and per column a float array of regions by dates. Days without data are NaN.
+    """
+    regions = [('municipality', municipality) for municipality in municipalities] + \
+              [('province', province) for province in provinces] + ([('national', '')] if national else [])
+
+    region_selects = []
+    for region_type, totals_model, region_column, region_names in (
+            ('municipality', DutchMunicipalityDailyTotals, DutchRegions.municipality, municipalities),
+            ('province', DutchProvinceDailyTotals, DutchProvinceDailyTotals.province, provinces),
+            ('national', DutchDailyTotals, literal(''), [''] if national else [])):
+        if not region_names:
+            continue
+        region_select = select(literal(region_type), region_column, totals_model.reported_date,
+                               *[getattr(totals_model, column) for column in columns])
+        if totals_model is DutchMunicipalityDailyTotals:
+            region_select = region_select.join_from(totals_model, DutchRegions,
+                                                    DutchRegions.id == totals_model.region_id)
+        if totals_model is not DutchDailyTotals:
+            region_select = region_select.where(region_column.in_(region_names))
+        if start_date:
+            region_select = region_select.where(totals_model.reported_date >= start_date)
+        if end_date:
+            region_select = region_select.where(totals_model.reported_date <= end_date)
+        region_selects.append(region_select)
+
+    rows = []
+    if region_selects:
+        session = database_session()
+        rows = session.execute(union_all(*region_selects)).all()
+        session.close()
+
+    first_date = start_date or min((row[2] for row in rows), default=None)
+    last_date = end_date or max((row[2] for row in rows), default=None)
+    dates = np.arange(first_date, last_date + datetime.timedelta(days=1), dtype='datetime64[D]') \
+        if first_date and last_date else np.array([], dtype='datetime64[D]')
+
+    region_indexes = {region: index for index, region in enumerate(regions)}
+    row_indexes = np.array([region_indexes[(row[0], row[1])] for row in rows], dtype=np.int64)
+    date_indexes = np.array([(row[2] - first_date).days for row in rows], dtype=np.int64)
+    region_series = {'dates': dates, 'regions': regions}
+    for index, column in enumerate(columns, start=3):
+        values = np.full((len(regions), len(dates)), np.nan)
+        # None becomes NaN in a float array
+        values[row_indexes, date_indexes] = np.array([row[index] for row in rows], dtype=np.float64)
+        region_series[column] = values
+    return region_series
+
+
+@query_cache.cached_query
 def get_infections_by_date():
     session = database_session()
-    query = session.query(DutchStatistics.reported_date,
-                          DutchStatistics.infections_by_date,
-                          func.sum(DutchStatistics.hospitalised),
-                          func.sum(DutchStatistics.deaths),
-                          DutchStatistics.hospitalised_nice_proven) \
-        .group_by(DutchStatistics.reported_date) \
-        .order_by(DutchStatistics.reported_date.desc())
+    query = session.query(DutchDailyTotals.reported_date,
+                          DutchDailyTotals.infections_by_date,
+                          DutchDailyTotals.hospitalised,
+                          DutchDailyTotals.deaths,
+                          DutchDailyTotals.hospitalised_nice_proven) \
+        .order_by(DutchDailyTotals.reported_date.desc())
 
     dutch_totals = query.all()
 
@@ -163,29 +726,115 @@ def get_infections_by_date():
     return dutch_totals
 
 
-
+@query_cache.cached_query
 def get_daily_prevalence_numbers():
     session = database_session()
-    query = session.query(DutchStatistics.reported_date,
-                          DutchStatistics.prevalence_avg,
-                          func.sum(DutchStatistics.hospitalised),
-                          func.sum(DutchStatistics.deaths),
-                          DutchStatistics.hospitalised_nice_proven) \
-        .group_by(DutchStatistics.reported_date) \
-        .order_by(DutchStatistics.reported_date.desc())
+    query = session.query(DutchDailyTotals.reported_date,
+                          DutchDailyTotals.prevalence_avg,
+                          DutchDailyTotals.hospitalised,
+                          DutchDailyTotals.deaths,
+                          DutchDailyTotals.hospitalised_nice_proven) \
+        .order_by(DutchDailyTotals.reported_date.desc())
     average_prevalence = query.all()
 
     session.close()
     return average_prevalence
 
 
+@query_cache.cached_query
 def get_daily_reproduction_number():
     session = database_session()
-    query = session.query(DutchStatistics.reported_date,
-                          DutchStatistics.reproduction_no) \
-        .group_by(DutchStatistics.reported_date) \
-        .order_by(DutchStatistics.reported_date.desc())
+    query = session.query(DutchDailyTotals.reported_date,
+                          DutchDailyTotals.reproduction_no) \
+        .order_by(DutchDailyTotals.reported_date.desc())
     reproduction_numbers = query.all()
 
     session.close()
     return reproduction_numbers
+
+
+@query_cache.cached_query
+def get_regional_reproduction_numbers(municipality, province):
+    """Returns the Re per day calculated at refresh for a municipality, a province or the nation when both are None"""
+    session = database_session()
+    if municipality:
+        region_type, region = 'municipality', municipality
+    elif province:
+        region_type, region = 'province', province
+    else:
+        region_type, region = 'national', ''
+
+    query = session.query(DutchReproductionNumbers.reported_date,
+                          DutchReproductionNumbers.reproduction_no) \
+        .filter_by(region_type=region_type, region=region) \
+        .order_by(DutchReproductionNumbers.reported_date.desc())
+    reproduction_numbers = query.all()
+
+    session.close()
+    return reproduction_numbers
+
+
+@query_cache.cached_query
+def get_forecasts(region_type, region=None):
+    """Returns the trends fitted at refresh for a region per metric, see forecast.calculate_forecasts"""
+    session = database_session()
+    forecasts = {forecast.metric: forecast.attributes() for forecast in
+                 session.query(DutchForecasts).filter_by(region_type=region_type, region=region or '')}
+    session.close()
+    return forecasts
+
+
+@query_cache.cached_query
+def get_growth_factors(metric='infections', region_type=None, limit=None):
+    """
+    Returns the regions ranked by the daily growth factor of the metric, fastest growing first
+
+    Parameters
+    ----------
+    metric: str, optional
+        one of REGION_METRICS
+    region_type: str, optional
+        national, province or municipality, defaults to all regions
+    limit: int, optional
+        maximum number of regions
+
+    :return:
+    list of rows with the region type, region, last fitted date, growth factor, growth rate and its standard error
+    """
+    session = database_session()
+    query = session.query(DutchForecasts.region_type, DutchForecasts.region, DutchForecasts.fitted_to,
+                          DutchForecasts.growth_factor, DutchForecasts.growth_rate, DutchForecasts.growth_rate_error) \
+        .filter(DutchForecasts.metric == metric, DutchForecasts.growth_factor.isnot(None))
+    if region_type:
+        query = query.filter(DutchForecasts.region_type == region_type)
+    growth_factors = query.order_by(DutchForecasts.growth_factor.desc(), DutchForecasts.region).limit(limit).all()
+    session.close()
+    return growth_factors
+
+
+@query_cache.cached_query
+def get_cases_by_age_group():
+    """Returns the cases, hospitalised cases and deceased cases per date of first symptoms and age group"""
+    return get_case_breakdown(DutchCaseCounts.age_group)
+
+
+@query_cache.cached_query
+def get_cases_by_province():
+    """Returns the cases, hospitalised cases and deceased cases per date of first symptoms and province"""
+    return get_case_breakdown(DutchCaseCounts.province)
+
+
+def get_case_breakdown(dimension):
+    """Sums the case counts per date of first symptoms and a column of DutchCaseCounts, newest first"""
+    session = database_session()
+    query = session.query(DutchCaseCounts.statistic_date,
+                          dimension,
+                          func.sum(DutchCaseCounts.cases),
+                          func.sum(case((DutchCaseCounts.hospitalised.is_(True), DutchCaseCounts.cases), else_=0)),
+                          func.sum(case((DutchCaseCounts.deceased.is_(True), DutchCaseCounts.cases), else_=0))) \
+        .group_by(DutchCaseCounts.statistic_date, dimension) \
+        .order_by(DutchCaseCounts.statistic_date.desc(), dimension)
+    case_breakdown = query.all()
+
+    session.close()
+    return case_breakdown
@@ -0,0 +1,111 @@
+"""
+Linear and exponential trends of the most recent days of every metric of every region, fitted at the end of a refresh.
+
+The windows of all series are stacked into one array and fitted at once with the closed form weighted least squares
+solution, which replaces a curve_fit per plotted series. Plots evaluate the stored trends on the days they draw,
+see graph_plotter.fit_trends, and dutch_statistics.get_growth_factors ranks the regions by their growth.
+"""
+from config import Config
+from database import database_session
+from database.data_model import DutchForecasts
+import numpy as np
+import reproduction
+import metrics
+import series_cache
+import util
+
+FORECAST_METRICS = series_cache.REGION_METRICS
+
+
+def fit_trends(windows):
+    """
+    Fits a linear and an exponential trend to every row of windows, in one pass over all rows
+
+    Parameters
+    ----------
+    windows: array-like
+        one row per series with the values of the window newest first, NaN where a day is missing
+
+    :return:
+    dict with an array per parameter, named like the columns of DutchForecasts, with a value per row.
+    The trends are a function of the day in the window, 1 for its oldest day. NaN where less than 3 days can be fitted
+    """
+    windows = np.asarray(windows, dtype=np.float64)
+    x = reproduction.window_x_values(windows.shape[-1])
+    valid = np.isfinite(windows)
+    linear = reproduction.weighted_least_squares(np.where(valid, windows, 0.0), x, valid.astype(np.float64))
+
+    # The logarithms are weighted with the squared values like reproduction.log_linear_exponents does, which
+    # approximates the least squares fit of the exponential on the values themselves
+    positive = valid & (windows > 0)
+    exponential = reproduction.weighted_least_squares(np.log(np.where(positive, windows, 1.0)), x,
+                                                      np.where(positive, windows, 0.0) ** 2)
+    scale = np.exp(exponential[0])
+    return {'linear_intercept': linear[0], 'linear_intercept_error': linear[1],
+            'linear_slope': linear[2], 'linear_slope_error': linear[3],
+            'scale': scale, 'scale_error': scale * exponential[1],
+            'growth_rate': exponential[2], 'growth_rate_error': exponential[3],
+            'growth_factor': np.exp(exponential[2])}
+
+
+@metrics.instrumented_stage('forecast')
+def calculate_forecasts(window=Config.FORECAST_WINDOW, build_id=None, batch_size=Config.INGEST_BATCH_SIZE):
+    """
+    Fits the trends of the last days of every metric of the nation and every province and municipality
+    in the series cache and stores them in DutchForecasts
+
+    Parameters
+    ----------
+    window: int, optional
+        number of days to fit, defaults to Config.FORECAST_WINDOW
+    build_id: str, optional
+        build of the series cache to fit, defaults to the current build
+
+    :return:
+    number of forecasts stored
+    """
+    build_id = build_id or series_cache.get_current_build()
+    if not build_id:
+        return 0
+
+    regions = [('national', None)]
+    for region_type in ('province', 'municipality'):
+        regions.extend((region_type, region) for region in series_cache.list_regions(region_type, build_id))
+
+    windows = np.full((len(regions), len(FORECAST_METRICS), window), np.nan)
+    fitted_to = []
+    for region_index, (region_type, region) in enumerate(regions):
+        series = series_cache.load_series(region_type, region, columns=FORECAST_METRICS, build_id=build_id)
+        if not len(series):
+            fitted_to.append(None)
+            continue
+        # Every day is placed by its distance to the last day, so missing days stay NaN
+        days_back = (series.dates[-1] - series.dates).astype(np.int64)
+        in_window = days_back < window
+        for metric_index, column in enumerate(series.columns):
+            windows[region_index, metric_index, days_back[in_window]] = column[in_window]
+        fitted_to.append(series.dates[-1].item())
+
+    trends = fit_trends(windows.reshape(-1, window))
+    rows = []
+    for region_index, (region_type, region) in enumerate(regions):
+        if fitted_to[region_index] is None:
+            continue
+        for metric_index, metric in enumerate(FORECAST_METRICS):
+            row_index = region_index * len(FORECAST_METRICS) + metric_index
+            row = {'region_type': region_type, 'region': region or '', 'metric': metric,
+                   'fitted_to': fitted_to[region_index], 'window': window}
+            for parameter, values in trends.items():
+                value = values[row_index].item()
+                row[parameter] = None if np.isnan(value) else value
+            rows.append(row)
+
+    session = database_session()
+    session.query(DutchForecasts).delete(synchronize_session=False)
+    insert_statement = DutchForecasts.__table__.insert()
+    for batch in util.batched(rows, batch_size):
+        session.execute(insert_statement, batch)
+    metrics.add_rows(len(rows))
+    session.commit()
+    session.close()
+    return len(rows)
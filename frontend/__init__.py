@@ -6,4 +6,4 @@ app = Flask(__name__)
 app.config.from_object(FlaskConfig)
 
 
-from frontend import routes
+from frontend import routes, api
@@ -0,0 +1,168 @@
+"""
+JSON endpoints returning the series the plot views draw, so clients can render the charts themselves.
+
+The endpoints take the same parameters as the plot forms as query arguments. Responses carry an ETag derived from
+the data version and the arguments, so repeated requests are answered with 304 without calculating anything.
+Arguments left out of the query take the defaults of the form, a date range without data returns empty series.
+"""
+from frontend import app, forms
+from flask import request, jsonify, make_response
+from wtforms import BooleanField
+from config import Config
+import matplotlib.dates as mdates
+import numpy as np
+import dutch_statistics
+import graph_plotter
+import series_cache
+import hashlib
+import gzip
+import json
+import util
+
+
+@app.route('/api/statistics', methods=['GET'])
+def statistics_api():
+    form = query_form(forms.SelectionForm)
+    if not form.validate():
+        return jsonify(errors=form.errors), 400
+
+    def statistics():
+        data_set = series_cache.sum_dutch_total_infections(municipality=form.municipality.data,
+                                                           province=form.province.data)
+        if not has_dates(data_set, form):
+            return {'dates': [], 'predicted_dates': [], 'series': {}, 'curves': {}, 'linear_regression': None}
+
+        series = graph_plotter.statistics_series(
+                data_set=data_set,
+                start_date=form.start_date.data,
+                end_date=form.end_date.data,
+                no_days_to_predict=form.no_days_to_predict.data or 0,
+                linear_regres=form.linear_regres.data,
+                exp_curve=form.exp_curve.data,
+                plot_cases=form.plot_cases.data,
+                plot_nice_hospitalised=form.plot_nice_hospitalised.data,
+                plot_rivm_hospitalised=form.plot_rivm_hospitalised.data,
+                plot_deaths=form.plot_deaths.data)
+        return {'dates': to_iso_dates(series['dates']),
+                'predicted_dates': to_iso_dates(series['predicted_dates']),
+                'series': {name: to_json_values(values) for name, values in series['series'].items()},
+                'curves': {name: curve and {key: to_json_values(value) for key, value in curve.items()}
+                           for name, curve in series['curves'].items()},
+                'linear_regression': to_json_values(series.get('linear_regression'))}
+
+    return cached_json_response(statistics)
+
+
+@app.route('/api/reproduction', methods=['GET'])
+def reproduction_api():
+    form = query_form(forms.ReproductionPlotForm)
+    if not form.validate():
+        return jsonify(errors=form.errors), 400
+
+    def reproduction_numbers():
+        # Re of a region is read from the numbers calculated at refresh, like the reproduction plotter does
+        if form.municipality.data or form.province.data:
+            dates, columns = graph_plotter.select_date_range(
+                    dutch_statistics.get_regional_reproduction_numbers(municipality=form.municipality.data,
+                                                                       province=form.province.data),
+                    form.start_date.data, form.end_date.data)
+            return {'dates': [reported_date.isoformat() for reported_date in dates],
+                    'reproduction_no': to_json_values(columns[0] if columns else [])}
+
+        data_set = series_cache.get_infections_by_date()
+        if not has_dates(data_set, form):
+            return {'dates': [], 'reproduction_no': [], 'reproduction_no_moving_avg': [], 'reproduction_no_rivm': [],
+                    'reproduction_no_bands': {}}
+
+        series = graph_plotter.reproduction_series(
+                data_set=data_set,
+                incubation_time=form.incubation_time.data,
+                generational_interval=form.generational_interval.data,
+                generational_interval_stdev=form.generational_interval_stdev.data,
+                start_date=form.start_date.data,
+                end_date=form.end_date.data,
+                uncertainty=form.uncertainty.data)
+        return {'dates': to_iso_dates(series['dates']),
+                'reproduction_no': to_json_values(series['reproduction_no']),
+                'reproduction_no_moving_avg': to_json_values(series['reproduction_no_moving_avg']),
+                'reproduction_no_rivm': to_json_values(series['reproduction_no_rivm']),
+                'reproduction_no_bands': {name: to_json_values(band) for name, band in
+                                          series.get('reproduction_no_bands', {}).items()}}
+
+    return cached_json_response(reproduction_numbers)
+
+
+@app.route('/api/growth_factors', methods=['GET'])
+def growth_factors_api():
+    form = query_form(forms.GrowthFactorForm)
+    if not form.validate():
+        return jsonify(errors=form.errors), 400
+
+    def growth_factors():
+        regions = []
+        for region_type, region, fitted_to, growth_factor, growth_rate, growth_rate_error in \
+                dutch_statistics.get_growth_factors(metric=form.metric.data, region_type=form.region_type.data,
+                                                    limit=form.limit.data):
+            # The trends are fitted at refresh, see forecast, the bounds follow from the error of the growth rate
+            error = np.nan if growth_rate_error is None else growth_rate_error
+            regions.append({'region_type': region_type, 'region': region, 'fitted_to': fitted_to.isoformat(),
+                            'growth_factor': growth_factor, 'low': to_json_values(np.exp(growth_rate - error)),
+                            'high': to_json_values(np.exp(growth_rate + error))})
+        return {'regions': regions}
+
+    return cached_json_response(growth_factors)
+
+
+def query_form(form_class):
+    """
+    Fills the form from the query arguments. A browser leaves unchecked boxes out of a submitted form,
+    but a boolean argument left out of a query gets the default of its field
+    """
+    form = form_class(formdata=request.args, meta={'csrf': False})
+    for field in form:
+        if isinstance(field, BooleanField) and field.name not in request.args:
+            field.data = field.default
+    return form
+
+
+def has_dates(data_set, form):
+    """Whether the data set has rows within the date range of the form, the series can not be calculated otherwise"""
+    dates = graph_plotter.select_date_range(data_set, form.start_date.data, form.end_date.data)[0]
+    return len(dates) > 0
+
+
+def cached_json_response(calculate_payload):
+    """
+    Answers with 304 when the client has the current version, otherwise calculates the payload
+    and returns it as JSON, gzip compressed when the client accepts it
+    """
+    etag = hashlib.sha256((str(util.get_data_version()) + request.full_path).encode()).hexdigest()[:32]
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        body = json.dumps(calculate_payload(), separators=(',', ':')).encode()
+        if 'gzip' in request.accept_encodings:
+            body = gzip.compress(body)
+            response = make_response(body)
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = make_response(body)
+        response.mimetype = 'application/json'
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=' + str(Config.API_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def to_iso_dates(matplotlib_dates):
+    return [plot_date.date().isoformat() for plot_date in mdates.num2date(np.asarray(matplotlib_dates))]
+
+
+def to_json_values(values):
+    """Converts numbers to plain floats and missing numbers to None, which JSON can represent"""
+    if values is None:
+        return None
+    if np.isscalar(values):
+        return None if np.isnan(values) else float(values)
+    return [None if value is None or np.isnan(value) else float(value) for value in np.asarray(values, dtype=object)]
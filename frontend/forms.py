@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, DateField, IntegerField, SubmitField, BooleanField, FloatField
+from wtforms import StringField, DateField, IntegerField, SubmitField, BooleanField, FloatField, SelectField
 from wtforms.validators import Optional
 import datetime
 
@@ -20,13 +20,26 @@ class SelectionForm(FlaskForm):
 
 
 class ReproductionPlotForm(FlaskForm):
+    municipality = StringField('Municipality', [Optional()], default=None)
+    province = StringField('Province', [Optional()], default=None)
     start_date = DateField('StartDate', [Optional()], default=datetime.date(2020, 6, 12))
     end_date = DateField('EndDate', [Optional()], default=datetime.date.today() - datetime.timedelta(days=5))
     incubation_time = FloatField('IncubationTime', [Optional()], default=4)
     generational_interval = FloatField('GenerationalInterval', [Optional()], default=3.86)
     generational_interval_stdev = FloatField('GenerationalIntervalStDev', [Optional()], default=2.65)
+    uncertainty = BooleanField('Uncertainty', [Optional()], default=False)
     submit = SubmitField('Plot!', [Optional()])
 
 
+class GrowthFactorForm(FlaskForm):
+    metric = SelectField('Metric', [Optional()], default='infections',
+                         choices=[(metric, metric) for metric in
+                                  ['infections', 'hospitalised', 'deaths', 'hospitalised_nice_proven']])
+    region_type = SelectField('RegionType', [Optional()], default='municipality',
+                              choices=[(region_type, region_type) for region_type in
+                                       ['national', 'province', 'municipality']])
+    limit = IntegerField('Limit', [Optional()], default=None)
+
+
 class UpdateStatsForm(FlaskForm):
     submit = SubmitField('Update Stats', [Optional()])
@@ -1,8 +1,15 @@
 from frontend import app, forms
-from flask import render_template, redirect, url_for, session, request
+from flask import render_template, redirect, url_for, session, request, jsonify, Response
+from config import Config
 import graph_plotter
+import render_pool
+import render_cache
+import query_cache
+import metrics
+import util
+import series_cache
 import dutch_statistics
-import main
+import refresh_jobs
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -13,8 +20,8 @@ def index():
         session['image_name'] = 'test.png'
 
     if form.validate_on_submit():
-        data_set = dutch_statistics.sum_dutch_total_infections(municipality=form.municipality.data,
-                                                               province=form.province.data)
+        data_set = series_cache.sum_dutch_total_infections(municipality=form.municipality.data,
+                                                           province=form.province.data)
 
         session['image_name'] = graph_plotter.plot_statistics(
                 data_set=data_set,
@@ -37,21 +44,68 @@ def reproduction_plotter():
     if not session.get('reproduction_image'):
         session['reproduction_image'] = 'Daily R.png'
 
-    if form.validate_on_submit():
+    # Re of a region is read from the numbers calculated at refresh
+    if form.validate_on_submit() and (form.municipality.data or form.province.data):
+        session['reproduction_image'] = graph_plotter.plot_regional_reproduction_no(
+                data_set=dutch_statistics.get_regional_reproduction_numbers(municipality=form.municipality.data,
+                                                                            province=form.province.data),
+                start_date=form.start_date.data,
+                end_date=form.end_date.data,
+                region_name=form.municipality.data or form.province.data)
+    elif form.validate_on_submit():
         session['reproduction_image'] = graph_plotter.plot_reproduction_no(
-                data_set=dutch_statistics.get_infections_by_date(),
+                data_set=series_cache.get_infections_by_date(),
                 incubation_time=form.incubation_time.data,
                 generational_interval=form.generational_interval.data,
                 generational_interval_stdev=form.generational_interval_stdev.data,
                 start_date=form.start_date.data,
                 end_date=form.end_date.data,
-                no_days_to_predict=7)
+                no_days_to_predict=7,
+                uncertainty=form.uncertainty.data)
 
     return render_template('reproduction_plotter.html', form=form, image_name=session.get('reproduction_image'))
 
 
 @app.route('/update_stats', methods=['GET'])
 def update_database():
-    main.refresh_dutch_statistics()
+    # The refresh runs in the background, the page polls its progress
+    refresh_jobs.start_refresh(full_rebuild=request.args.get('full_rebuild') == '1',
+                               profile=request.args.get('profile') == '1')
     form = forms.SelectionForm()
-    return render_template('show_plots.html', form=form, image_name=session.get('image_name'))
+    return render_template('show_plots.html', form=form, image_name=session.get('image_name', 'test.png'),
+                           refresh_status=refresh_jobs.get_status())
+
+
+@app.route('/update_stats/status', methods=['GET'])
+def update_status():
+    return jsonify(refresh_jobs.get_status())
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    render_statistics = render_cache.get_statistics()
+    text = metrics.prometheus_text()
+    text += metrics.format_metric('covid_render_cache_lookups_total', 'counter', 'Lookups in the render cache',
+                                  [({'result': 'hit'}, render_statistics['hits']),
+                                   ({'result': 'miss'}, render_statistics['misses'])])
+    text += metrics.format_metric('covid_render_cache_evictions_total', 'counter',
+                                  'Plots removed from the render cache', [({}, render_statistics['evictions'])])
+    query_statistics = query_cache.get_statistics()
+    text += metrics.format_metric('covid_query_cache_lookups_total', 'counter', 'Lookups in the query cache',
+                                  [({'result': 'hit'}, query_statistics['hits']),
+                                   ({'result': 'disk_hit'}, query_statistics['disk_hits']),
+                                   ({'result': 'miss'}, query_statistics['misses'])])
+    text += metrics.format_metric('covid_query_cache_evictions_total', 'counter',
+                                  'Results removed from the query cache', [({}, query_statistics['evictions'])])
+    text += metrics.format_metric('covid_query_cache_bytes', 'gauge', 'Size of the results in the query cache',
+                                  [({}, query_statistics['bytes'])])
+    text += metrics.format_metric('covid_data_version', 'gauge', 'Number of refreshes that changed the data',
+                                  [({}, util.get_data_version())])
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+@app.errorhandler(render_pool.RenderPoolBusy)
+@app.errorhandler(render_pool.RenderTimeout)
+def render_unavailable(error):
+    # Refuse the request rather than queue more plots, the client can retry once the pool has caught up
+    return str(error), 503, {'Retry-After': str(Config.RENDER_QUEUE_TIMEOUT)}
@@ -1,10 +1,16 @@
+from config import Config
 from datetime import date
-from scipy import stats, optimize
+import tempfile
 import time
+import os
 import dutch_statistics
+import forecast
+import render_cache
+import reproduction
+import series_cache
+from matplotlib.figure import Figure
 import matplotlib.ticker as ticker
 import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import matplotlib
@@ -13,10 +19,15 @@ import random
 # Prevent GUI from being triggered which causes crashes
 matplotlib.use('agg')
 
+# Names of the plotted series and the metrics of their trends in DutchForecasts
+FORECAST_NAMES = {'cases': 'infections', 'hospitalised_rivm': 'hospitalised',
+                  'hospitalised_nice': 'hospitalised_nice_proven', 'deaths': 'deaths'}
 
+
+@render_cache.cached_render('case_plot')
 def plot_statistics(data_set, start_date=date.min, end_date=date.max, no_days_to_predict=0, linear_regres=True,
                     exp_curve=True, plot_cases=True, plot_nice_hospitalised=False, plot_rivm_hospitalised=False,
-                    plot_deaths=False):
+                    plot_deaths=False, level_of_detail=True, image_name=None):
     """
     Parameters
     ----------
@@ -32,14 +43,17 @@ def plot_statistics(data_set, start_date=date.min, end_date=date.max, no_days_to
         defaults to true; add a linear regression line up to days to predict
     exp_curve: boolean, optional
         defaults to true; plots an exponential curve on the dataset
+    level_of_detail: boolean, optional
+        defaults to true; picks the date ticks by the plotted span and draws long series downsampled to
+        Config.PLOT_MAX_POINTS, so long date ranges render about as fast as short ones. The trends are always fitted
+        on every day. False draws every day with a tick per day
+    image_name: str, optional
+        file name of the plot, set by the render cache
 
     :return:
     Plots a graph with measured cases and optionally adds statistical prediction
     """
 
-    #  Clears the plot
-    plt.clf()
-
     if no_days_to_predict > 0 and not exp_curve and not linear_regres:
         msg = 'Choose either exponential and/or linear prediction when using no_days_to_predict'
         raise RuntimeError(msg)
@@ -49,51 +63,64 @@ def plot_statistics(data_set, start_date=date.min, end_date=date.max, no_days_to
                                                                                                     end_date,
                                                                                                     no_days_to_predict)
 
+    # Every plot draws on its own figure, so concurrent renders never share pyplot state
+    fig = Figure()
+    ax = fig.subplots()
+    trends = fit_trends(data_set, dates, {'cases': cases, 'hospitalised_rivm': hospitalised,
+                                          'hospitalised_nice': hospitalised_nice, 'deaths': deaths})
+
     # Adds linear regression line to the plot
     if linear_regres:
-        # Perform regression and calculate expected cases
-        slope, y0, r, p, stderr = stats.linregress(dates, cases)
-        cases_expected = [y0 + slope * date for date in predicted_dates]
-        plt.plot(predicted_dates, cases_expected, color='green', label='linear regression')
+        # Evaluate the linear trend of the cases
+        cases_expected = linear_regression(trends['cases'], dates, predicted_dates)
+        ax.plot(predicted_dates, cases_expected, color='green', label='linear regression')
 
     # Add an exponential curve to the plot
     if exp_curve:
         if plot_cases:
-            add_curve_to_plot(dates=dates, predicted_dates=predicted_dates, cases=cases, color='blue')
+            add_curve_to_plot(ax, trends['cases'], dates=dates, predicted_dates=predicted_dates, color='blue')
         if plot_rivm_hospitalised:
-            add_curve_to_plot(dates=dates, predicted_dates=predicted_dates, cases=hospitalised, color='teal')
+            add_curve_to_plot(ax, trends['hospitalised_rivm'], dates=dates, predicted_dates=predicted_dates,
+                              color='teal')
         if plot_nice_hospitalised:
-            add_curve_to_plot(dates=dates, predicted_dates=predicted_dates, cases=hospitalised_nice, color='purple')
+            add_curve_to_plot(ax, trends['hospitalised_nice'], dates=dates, predicted_dates=predicted_dates,
+                              color='purple')
         if plot_deaths:
-            add_curve_to_plot(dates=dates, predicted_dates=predicted_dates, cases=deaths, color='brown')
+            add_curve_to_plot(ax, trends['deaths'], dates=dates, predicted_dates=predicted_dates, color='brown')
 
     # Plot final results
-    plt.title('Cases over Time')
+    ax.set_title('Cases over Time')
+    max_points = Config.PLOT_MAX_POINTS if level_of_detail else None
     if plot_cases:
-        plt.plot(dates, cases, color='red', label='positive tests')
+        ax.plot(*downsample(dates, cases, max_points), color='red', label='positive tests')
     if plot_rivm_hospitalised:
-        plt.plot(dates, hospitalised, color='orange', label='hospitalised - RIVM')
+        ax.plot(*downsample(dates, hospitalised, max_points), color='orange', label='hospitalised - RIVM')
     if plot_nice_hospitalised:
-        plt.plot(dates, hospitalised_nice, color='purple', label='hospitalised - NICE')
+        ax.plot(*downsample(dates, hospitalised_nice, max_points), color='purple', label='hospitalised - NICE')
     if plot_deaths:
-        plt.plot(dates, deaths, color='grey', label='deaths')
-
-    # Tweak the output
-    fig = plt.gcf()
-    ax = plt.gca()
-
-    # Convert dates to legible format and show grid on day level
-    days = mdates.DayLocator()
-    fmt = mdates.DateFormatter('%Y-%m-%d')
-    ax.xaxis.set_minor_locator(days)
-    ax.xaxis.set_major_formatter(fmt)
-    ax.xaxis.set_minor_formatter(fmt)
-    fig.autofmt_xdate(rotation=45, which='both')
-    plt.grid(True, which='both')
+        ax.plot(*downsample(dates, deaths, max_points), color='grey', label='deaths')
+
+    # An open start date starts the plot at the first plotted day rather than in the year 1
+    left = max(mdates.date2num(start_date), dates[-1]) if level_of_detail else start_date
+    if level_of_detail:
+        set_date_ticks(fig, ax, predicted_dates[0] - left)
+    else:
+        # Convert dates to legible format and show grid on day level
+        days = mdates.DayLocator()
+        fmt = mdates.DateFormatter('%Y-%m-%d')
+        ax.xaxis.set_minor_locator(days)
+        ax.xaxis.set_major_formatter(fmt)
+        ax.xaxis.set_minor_formatter(fmt)
+        fig.autofmt_xdate(rotation=45, which='both')
+    ax.grid(True, which='both')
 
     # Set ticks on y axis
-    ax.yaxis.set_major_locator(ticker.MultipleLocator(1000))
-    ax.yaxis.set_minor_locator(ticker.MultipleLocator(250))
+    if level_of_detail:
+        ax.yaxis.set_major_locator(ticker.MaxNLocator(nbins=10, integer=True))
+        ax.yaxis.set_minor_locator(ticker.AutoMinorLocator())
+    else:
+        ax.yaxis.set_major_locator(ticker.MultipleLocator(1000))
+        ax.yaxis.set_minor_locator(ticker.MultipleLocator(250))
 
     # ax.yaxis.set_major_locator(ticker.MultipleLocator(25))
 
@@ -108,16 +135,76 @@ def plot_statistics(data_set, start_date=date.min, end_date=date.max, no_days_to
         ax.annotate(str(hospitalised_nice[0]), xy=(dates[0], hospitalised_nice[0]))
 
     # Other tweaks for the graph
-    plt.xlim(left=start_date, right=predicted_dates[0])
-    plt.ylim(bottom=0)
+    ax.set_xlim(left=left, right=predicted_dates[0])
+    ax.set_ylim(bottom=0)
     fig.set_size_inches(10, 8)
-    plt.legend(bbox_to_anchor=(1, 1), loc='upper left')
+    ax.legend(bbox_to_anchor=(1, 1), loc='upper left')
 
     # Store the image
-    random_image_name = 'case_plot' + str(time.time_ns()) + '.png'
-    fig.savefig('frontend/static/' + random_image_name, bbox_inches='tight')
-    plt.close()
-    return random_image_name
+    image_name = image_name or 'case_plot' + str(time.time_ns()) + '.png'
+    save_figure(fig, image_name)
+    return image_name
+
+
+def set_date_ticks(fig, ax, span_days):
+    """Labels every day of a short span, longer spans get about ten labelled ticks at whole weeks, months or years"""
+    fmt = mdates.DateFormatter('%Y-%m-%d')
+    ax.xaxis.set_major_formatter(fmt)
+    if span_days <= Config.PLOT_MAX_DAY_TICKS:
+        ax.xaxis.set_minor_locator(mdates.DayLocator())
+        ax.xaxis.set_minor_formatter(fmt)
+        fig.autofmt_xdate(rotation=45, which='both')
+        return
+
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator(minticks=4, maxticks=10))
+    if span_days <= 6 * Config.PLOT_MAX_DAY_TICKS:
+        ax.xaxis.set_minor_locator(mdates.WeekdayLocator(byweekday=mdates.MO))
+    else:
+        ax.xaxis.set_minor_locator(mdates.MonthLocator())
+    ax.xaxis.set_minor_formatter(ticker.NullFormatter())
+    fig.autofmt_xdate(rotation=45, which='major')
+
+
+def downsample(dates, values, max_points):
+    """Returns the dates and values of the points downsample_indices keeps, all points without max_points"""
+    if not max_points or len(dates) <= max_points:
+        return dates, values
+    values = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    indices = downsample_indices(np.asarray(dates, dtype=np.float64), values, max_points)
+    return np.asarray(dates)[indices], values[indices]
+
+
+def downsample_indices(x, y, no_points):
+    """
+    Selects no_points points that keep the shape of the line with the largest triangle three buckets algorithm.
+    The first and the last point are kept, the others are divided over equal buckets and from every bucket the point
+    is kept that forms the largest triangle with the point kept from the previous bucket and the average of the next.
+
+    :return:
+    numpy array with the indices of the kept points, in order
+    """
+    no_values = len(x)
+    if no_points >= no_values or no_points < 3:
+        return np.arange(no_values)
+
+    bucket_edges = np.linspace(1, no_values - 1, no_points - 1).astype(np.int64)
+    indices = np.empty(no_points, dtype=np.int64)
+    indices[0], indices[-1] = 0, no_values - 1
+    previous = 0
+    for bucket in range(no_points - 2):
+        start, end = bucket_edges[bucket], bucket_edges[bucket + 1]
+        next_end = bucket_edges[bucket + 2] if bucket + 2 < len(bucket_edges) else no_values
+        next_y = y[end:next_end]
+        next_y = next_y[np.isfinite(next_y)]
+        average_x = x[end:next_end].mean()
+        average_y = next_y.mean() if len(next_y) else y[previous]
+
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (average_y - y[previous]))
+        # Missing values are only kept when the whole bucket is missing, which keeps the gap in the line
+        previous = start + np.argmax(np.where(np.isnan(areas), -1.0, areas))
+        indices[bucket + 1] = previous
+    return indices
 
 
 def cases_per_municipality(data_set, start_date):
@@ -134,10 +221,16 @@ def cases_per_municipality(data_set, start_date):
     """
 
 
+@render_cache.cached_render('Daily_R_')
 def plot_reproduction_no(data_set, incubation_time=5.2, generational_interval=3.9, generational_interval_stdev=3.9,
                          start_date=date.min,
                          end_date=date.max,
-                         no_days_to_predict=0):
+                         no_days_to_predict=0,
+                         fit_method=reproduction.LOG_LINEAR,
+                         uncertainty=False,
+                         samples=Config.REPRODUCTION_SAMPLES,
+                         seed=0,
+                         image_name=None):
     """
     Parameters
     ----------
@@ -153,48 +246,28 @@ def plot_reproduction_no(data_set, incubation_time=5.2, generational_interval=3.
         defaults to infinity; date to end the plot, useful for date ranges
     no_days_to_predict: int, optional
         number of dates to predict in the future
+    fit_method: str, optional
+        defaults to the vectorized log-linear fit; use reproduction.CURVE_FIT to fit every day with curve_fit
+    uncertainty: boolean, optional
+        adds the 50% and 95% credible bands of Re, see reproduction.reproduction_number_bands
+    samples: int, optional
+        number of Monte Carlo samples of the bands, defaults to Config.REPRODUCTION_SAMPLES
+    seed: int, optional
+        seed of the samples, the same seed draws the same bands
+    image_name: str, optional
+        file name of the plot, set by the render cache
 
     :return:
     Plots Re as it changes over time
     """
 
-    #  Clears the plot
-    plt.clf()
-
-    dates, cases, hospitalised, deaths, hospitalised_nice, predicted_dates = prepare_data_for_graph(data_set,
-                                                                                                    start_date,
-                                                                                                    end_date,
-                                                                                                    no_days_to_predict)
-
-    rep_no_list = []
-    rounded_incubation_time = round(incubation_time)
-    index = 0
-    while index <= len(dates) - (rounded_incubation_time + 1):
-        # calculate growth rate
-        calculate_to = index + rounded_incubation_time
-        popt, pcov, perr = curve_fit_cases(dates[index:calculate_to], cases[index:calculate_to])
-
-        # Calculate reproduction number and add to plot, formula: R=exp(rTc)
-        # r = growth_rate
-        # Tc = generational_interval
-        growth_rate = (exponent(1, popt[0], popt[1]) / exponent(0, popt[0], popt[1])) - 1
-        reproduction_no = round(np.exp((growth_rate * generational_interval) -
-                                       (0.5 * (growth_rate ** 2) * (generational_interval_stdev ** 2))), 2)
-
-        rep_no_list.append(reproduction_no)
-        index += 1
-
-    # Calculate the moving average
-    window_size = 21
-    window_offset = window_size-2
-    rep_no_series = pd.Series(rep_no_list)
-    windows = rep_no_series.rolling(window=window_size, win_type='kaiser')
-    rep_no_list_moving_avg = windows.mean(beta=25)
-    rep_no_list_moving_avg = rep_no_list_moving_avg[11:]
+    series = reproduction_series(data_set, incubation_time, generational_interval, generational_interval_stdev,
+                                 start_date, end_date, no_days_to_predict, fit_method, uncertainty, samples, seed)
+    dates = series['dates']
 
     # Tweak the output
-    fig = plt.gcf()
-    ax = plt.gca()
+    fig = Figure()
+    ax = fig.subplots()
 
     # Convert dates to legible format and show grid on day level
     days = mdates.DayLocator()
@@ -206,21 +279,18 @@ def plot_reproduction_no(data_set, incubation_time=5.2, generational_interval=3.
 
     fig.autofmt_xdate(rotation=45, which='both')
 
-    plt.ylim(bottom=0.5, top=2)
-    plt.grid(True, which='both')
-
-    # Add the RIVM reproduction numbers
-    rivm_stats = dutch_statistics.get_daily_reproduction_number()
-    rivm_rep_no_list = []
-    for stat in rivm_stats:
-        if end_date >= stat[0] >= start_date:
-            rivm_rep_no_list.append(stat[1])
-    rivm_rep_no_list = rivm_rep_no_list[rounded_incubation_time:]
-
-    end_date_index = len(dates) - rounded_incubation_time
-    plt.plot(dates[0:end_date_index], rep_no_list, color='orange', label='Daily Re')
-    plt.plot(dates[0:end_date_index], rivm_rep_no_list, color='red', label='Daily Re - RIVM')
-    plt.plot(dates[0:end_date_index - 11], rep_no_list_moving_avg, color='blue', label='Daily Re - 5 Day Moving Avg')
+    ax.set_ylim(bottom=0.5, top=2)
+    ax.grid(True, which='both')
+
+    if uncertainty:
+        bands = series['reproduction_no_bands']
+        ax.fill_between(dates, bands['low'], bands['high'], color='orange', alpha=0.15, label='Daily Re - 95% band')
+        ax.fill_between(dates, bands['inner_low'], bands['inner_high'], color='orange', alpha=0.3,
+                        label='Daily Re - 50% band')
+    ax.plot(dates, series['reproduction_no'], color='orange', label='Daily Re')
+    ax.plot(dates, series['reproduction_no_rivm'], color='red', label='Daily Re - RIVM')
+    ax.plot(dates[0:len(series['reproduction_no_moving_avg'])], series['reproduction_no_moving_avg'], color='blue',
+            label='Daily Re - 5 Day Moving Avg')
     # for rep_date, rep_no in zip(dates[0:end_date_index], rep_no_list_moving_avg):
     #     ax.annotate(round(rep_no, 2), xy=(rep_date, rep_no + 0.1), horizontalalignment='center',
     #                 verticalalignment='bottom', rotation=45)
@@ -229,19 +299,207 @@ def plot_reproduction_no(data_set, incubation_time=5.2, generational_interval=3.
     ax.yaxis.set_major_locator(ticker.MultipleLocator(0.1))
 
     fig.set_size_inches(14, 10)
-    plt.legend(bbox_to_anchor=(1, 1), loc='upper left')
+    ax.legend(bbox_to_anchor=(1, 1), loc='upper left')
 
     # Plot the optimum as line and the rest as area
-    filename = 'Daily_R_' + str(time.time_ns()) + '.png'
-    fig.savefig('frontend/static/' + filename, bbox_inches='tight')
-    return filename
+    image_name = image_name or 'Daily_R_' + str(time.time_ns()) + '.png'
+    save_figure(fig, image_name)
+    return image_name
+
+
+@render_cache.cached_render('Daily_R_')
+def plot_regional_reproduction_no(data_set, start_date=date.min, end_date=date.max, region_name='Netherlands',
+                                  image_name=None):
+    """
+    Parameters
+    ----------
+    data_set: list of DutchReproductionNumbers
+        Re per day as calculated at refresh, see dutch_statistics.get_regional_reproduction_numbers
+    start_date: datetime.date, optional
+        date to start plotting the data e.g datetime.date(2020, 7, 30)
+    end_date: datetime.date, optional
+        defaults to infinity; date to end the plot, useful for date ranges
+    region_name: str, optional
+        name of the region shown in the title
+    image_name: str, optional
+        file name of the plot, set by the render cache
+
+    :return:
+    Plots the stored Re of a region as it changes over time
+    """
+
+    dates, columns = select_date_range(data_set, start_date, end_date)
+    dates = mdates.date2num(dates)
+    rep_no_list = np.array(columns[0] if columns else [], dtype=np.float64)
+    rep_no_moving_avg = pd.Series(rep_no_list[::-1]).rolling(window=7, min_periods=1).mean()[::-1]
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.set_title('Daily Re - ' + region_name)
+    ax.plot(dates, rep_no_list, color='orange', label='Daily Re')
+    ax.plot(dates, rep_no_moving_avg, color='blue', label='Daily Re - 7 Day Moving Avg')
+
+    # Tweak the output
+    fmt = mdates.DateFormatter('%Y-%m-%d')
+    ax.xaxis.set_major_formatter(fmt)
+    ax.xaxis.set_major_locator(ticker.MultipleLocator(7))
+    ax.yaxis.set_major_locator(ticker.MultipleLocator(0.1))
+    fig.autofmt_xdate(rotation=45, which='both')
+    ax.set_ylim(bottom=0.5, top=2)
+    ax.grid(True, which='both')
+    fig.set_size_inches(14, 10)
+    ax.legend(bbox_to_anchor=(1, 1), loc='upper left')
+
+    image_name = image_name or 'Daily_R_' + str(time.time_ns()) + '.png'
+    save_figure(fig, image_name)
+    return image_name
+
+
+@render_cache.cached_render('region_plot')
+def plot_region_comparison(data_set, metric='infections', moving_average=7, per_region_max=False, image_name=None):
+    """
+    Parameters
+    ----------
+    data_set: dict
+        aligned daily series of several regions, see dutch_statistics.get_region_series
+    metric: str, optional
+        defaults to infections; the metric of the totals to compare
+    moving_average: int, optional
+        defaults to 7; number of days to average, 1 plots the daily values
+    per_region_max: boolean, optional
+        scales every region to its own maximum, useful to compare the trend of regions that differ in size
+    image_name: str, optional
+        file name of the plot, set by the render cache
+
+    :return:
+    Plots the metric of every region as a line on the same axes
+    """
+
+    dates = mdates.date2num(data_set['dates'])
+    values = pd.DataFrame(data_set[metric].T).rolling(window=moving_average, min_periods=1).mean().to_numpy().T
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.set_title(metric.capitalize().replace('_', ' ') + ' per region')
+    for (region_type, region), region_values in zip(data_set['regions'], values):
+        if per_region_max and np.nanmax(region_values, initial=0) > 0:
+            region_values = region_values / np.nanmax(region_values)
+        ax.plot(dates, region_values, label=region or 'Netherlands')
+
+    fmt = mdates.DateFormatter('%Y-%m-%d')
+    ax.xaxis.set_major_formatter(fmt)
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator())
+    fig.autofmt_xdate(rotation=45, which='both')
+    ax.set_ylim(bottom=0)
+    ax.grid(True, which='both')
+    fig.set_size_inches(14, 10)
+    ax.legend(bbox_to_anchor=(1, 1), loc='upper left')
+
+    image_name = image_name or 'region_plot' + str(time.time_ns()) + '.png'
+    save_figure(fig, image_name)
+    return image_name
+
+
+def save_figure(fig, image_name):
+    """
+    Stores the figure in the plot folder, or at image_name when it is an absolute path.
+    The image is written to a temporary file that replaces the image once it is complete, so the render cache never
+    finds a partly written image, also when a render fails or times out.
+    """
+    image_path = os.path.join(Config.PLOT_DIR, image_name)
+    temporary_file, temporary_path = tempfile.mkstemp(dir=os.path.dirname(image_path) or '.',
+                                                      prefix=render_cache.TEMPORARY_PREFIX, suffix='.png')
+    try:
+        with os.fdopen(temporary_file, mode='wb') as image_file:
+            fig.savefig(image_file, format='png', bbox_inches='tight')
+        # mkstemp only lets the owner read the file, images are served by the web server
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, image_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def reproduction_series(data_set, incubation_time=5.2, generational_interval=3.9, generational_interval_stdev=3.9,
+                        start_date=date.min, end_date=date.max, no_days_to_predict=0,
+                        fit_method=reproduction.LOG_LINEAR, uncertainty=False, samples=Config.REPRODUCTION_SAMPLES,
+                        seed=0):
+    """
+    Calculates the series plot_reproduction_no draws, see plot_reproduction_no for the parameters
+
+    :return:
+    dict with the dates as matplotlib.dates, the calculated Re, its moving average and the Re of the RIVM,
+    newest first. With uncertainty also the bands of Re per quantile of reproduction.BAND_QUANTILES
+    """
+    dates, cases, hospitalised, deaths, hospitalised_nice, predicted_dates = prepare_data_for_graph(data_set,
+                                                                                                    start_date,
+                                                                                                    end_date,
+                                                                                                    no_days_to_predict)
+
+    rounded_incubation_time = round(incubation_time)
+    rep_no_list = list(reproduction.daily_reproduction_numbers(cases, incubation_time, generational_interval,
+                                                               generational_interval_stdev, method=fit_method))
+
+    # Calculate the moving average
+    window_size = 21
+    rep_no_series = pd.Series(rep_no_list, dtype=np.float64)
+    windows = rep_no_series.rolling(window=window_size, win_type='kaiser')
+    rep_no_list_moving_avg = windows.mean(beta=25)
+    rep_no_list_moving_avg = rep_no_list_moving_avg[11:]
+
+    # Add the RIVM reproduction numbers
+    rivm_stats = series_cache.get_daily_reproduction_number()
+    rivm_dates, rivm_columns = select_date_range(rivm_stats, start_date, end_date)
+    rivm_rep_no_list = list(rivm_columns[0][rounded_incubation_time:])
+
+    end_date_index = len(dates) - rounded_incubation_time
+    series = {'dates': dates[0:end_date_index],
+              'reproduction_no': rep_no_list,
+              'reproduction_no_moving_avg': list(rep_no_list_moving_avg),
+              'reproduction_no_rivm': rivm_rep_no_list}
+    if uncertainty:
+        series['reproduction_no_bands'] = reproduction.reproduction_number_bands(
+                cases, incubation_time, generational_interval, generational_interval_stdev, samples=samples, seed=seed)
+    return series
+
+
+def statistics_series(data_set, start_date=date.min, end_date=date.max, no_days_to_predict=0, linear_regres=True,
+                      exp_curve=True, plot_cases=True, plot_nice_hospitalised=False, plot_rivm_hospitalised=False,
+                      plot_deaths=False):
+    """
+    Calculates the series plot_statistics draws, see plot_statistics for the parameters
+
+    :return:
+    dict with the dates and predicted dates as matplotlib.dates, the selected series and when requested
+    the linear regression and the exponential curve of every selected series, newest first
+    """
+    dates, cases, hospitalised, deaths, hospitalised_nice, predicted_dates = prepare_data_for_graph(data_set,
+                                                                                                    start_date,
+                                                                                                    end_date,
+                                                                                                    no_days_to_predict)
+    selected_series = {'cases': (plot_cases, cases),
+                       'hospitalised_rivm': (plot_rivm_hospitalised, hospitalised),
+                       'hospitalised_nice': (plot_nice_hospitalised, hospitalised_nice),
+                       'deaths': (plot_deaths, deaths)}
+
+    trends = fit_trends(data_set, dates, {name: values for name, (selected, values) in selected_series.items()})
+
+    statistics = {'dates': dates, 'predicted_dates': predicted_dates, 'series': {}, 'curves': {}}
+    for name, (selected, values) in selected_series.items():
+        if selected:
+            statistics['series'][name] = values
+            if exp_curve:
+                statistics['curves'][name] = exponential_curve(trends[name], dates, predicted_dates)
+    if linear_regres:
+        statistics['linear_regression'] = linear_regression(trends['cases'], dates, predicted_dates)
+    return statistics
 
 
 def prepare_data_for_graph(data_set, start_date=date.min, end_date=date.max, no_days_to_predict=0):
     """
     Parameters
     ----------
-    data_set: list of DutchStatistics
+    data_set: list of DutchStatistics or series_cache.TimeSeries
         pass data set containing statistics to plot
     start_date: datetime.date, optional
         date to start plotting the data e.g datetime.date(2020, 7, 30)
@@ -260,24 +518,8 @@ def prepare_data_for_graph(data_set, start_date=date.min, end_date=date.max, no_
 
     """
 
-    # None value should default to max
-    if not end_date:
-        end_date = date.max
-
-    # Convert the data set for use in the plotter
-    statistics = data_set
-    dates = []
-    cases = []
-    hospitalised = []
-    deaths = []
-    hospitalised_nice = []
-    for stat in statistics:
-        if end_date >= stat[0] >= start_date:
-            dates.append(stat[0])
-            cases.append(stat[1])
-            hospitalised.append(stat[2])
-            deaths.append(stat[3])
-            hospitalised_nice.append(stat[4])
+    dates, columns = select_date_range(data_set, start_date, end_date)
+    cases, hospitalised, deaths, hospitalised_nice = columns
 
     # Convert dates to integers for easy calculations
     dates = mdates.date2num(dates)
@@ -293,36 +535,99 @@ def prepare_data_for_graph(data_set, start_date=date.min, end_date=date.max, no_
     return dates, cases, hospitalised, deaths, hospitalised_nice, predicted_dates
 
 
-def curve_fit_cases(dates, cases):
-    # convert for calculation
-    calc_range = np.linspace(start=1, stop=len(dates), num=len(dates))
-    calc_range = np.flip(calc_range)
+def select_date_range(data_set, start_date=date.min, end_date=date.max):
+    """
+    Returns the dates and a list per column of the rows within the date range, newest first.
+    A TimeSeries is sliced with a binary search on its dates, query results are filtered row by row.
+    """
 
-    # Determine best fit for curve and add to plot, include standard deviation
-    popt, pcov = optimize.curve_fit(exponent, calc_range, cases)
-    perr = np.sqrt(np.diag(pcov))
+    # None value should default to max
+    if not end_date:
+        end_date = date.max
 
-    return popt, pcov, perr
+    if isinstance(data_set, series_cache.TimeSeries):
+        start_index, end_index = data_set.date_range(start_date, end_date)
+        dates = data_set.dates[start_index:end_index][::-1]
+        return dates, [column[start_index:end_index][::-1] for column in data_set.columns]
+
+    rows = [stat for stat in data_set if end_date >= stat[0] >= start_date]
+    no_columns = len(rows[0]) - 1 if rows else len(data_set[0]) - 1 if data_set else 0
+    return [row[0] for row in rows], [[row[index] for row in rows] for index in range(1, no_columns + 1)]
 
 
 def exponent(x, a, b):
     return a * np.exp(x * b)
 
 
-def add_curve_to_plot(dates, predicted_dates, cases, color):
-    popt, pcov, perr = curve_fit_cases(dates, cases)
+def fit_trends(data_set, dates, series):
+    """
+    Returns the trend parameters of every series on the last Config.FORECAST_WINDOW plotted days, see forecast.
+    A plot of the latest days of a region uses the trends fitted at refresh, other plots fit all series in one batch.
+
+    Parameters
+    ----------
+    data_set: list of DutchStatistics or series_cache.TimeSeries
+        the plotted data set
+    dates: list matplotlib.dates
+        the plotted dates, newest first
+    series: dict
+        the plotted values per name of prepare_data_for_graph, newest first
+
+    :return:
+    dict with the parameters of the trends per name of the series, including the number of fitted days as window
+    """
+    window = min(len(dates), Config.FORECAST_WINDOW)
+    region = getattr(data_set, 'region', None)
+    if window == Config.FORECAST_WINDOW and region and data_set.column_names == forecast.FORECAST_METRICS:
+        stored_trends = dutch_statistics.get_forecasts(*region)
+        last_date = mdates.num2date(dates[0]).date()
+        trends = [stored_trends.get(FORECAST_NAMES[name]) for name in series]
+        if all(trend and trend['fitted_to'] == last_date and trend['window'] == window for trend in trends):
+            return {name: {parameter: np.nan if value is None else value for parameter, value in trend.items()}
+                    for name, trend in zip(series, trends)}
+
+    windows = [[np.nan if value is None else value for value in values[:window]] for values in series.values()]
+    fitted_trends = forecast.fit_trends(np.array(windows, dtype=np.float64).reshape(len(series), window))
+    return {name: dict({parameter: values[index] for parameter, values in fitted_trends.items()}, window=window)
+            for index, name in enumerate(series)}
+
+
+def window_days(trend, dates, predicted_dates):
+    """Returns the day within the fitted window of every predicted date, NaN for the days before the window"""
+    days = trend['window'] - (dates[0] - np.asarray(predicted_dates, dtype=np.float64))
+    return np.where(days >= 1, days, np.nan)
+
+
+def linear_regression(trend, dates, predicted_dates):
+    """Returns the expected cases on the predicted dates according to the linear trend of the cases"""
+    return trend['linear_intercept'] + trend['linear_slope'] * window_days(trend, dates, predicted_dates)
+
+
+def exponential_curve(trend, dates, predicted_dates):
+    """
+    Evaluates the exponential trend on the predicted dates within and after the fitted window
+
+    :return:
+    dict with the optimum, low and high prediction and the growth factor,
+    None when the fit is too close to linearity to plot
+    """
+    scale, growth_rate = trend['scale'], trend['growth_rate']
+
+    # If the scale is too close to linearity, the plot fails, so skip it
+    if not 0.999 <= scale >= 1.001:
+        return None
 
-    # If the popt is too close to linearity, the plot fails, so skip it
-    if 0.999 <= popt[0] >= 1.001:
-        predict_range = np.linspace(start=1, stop=len(predicted_dates), num=len(predicted_dates))
-        predict_range = np.flip(predict_range)
+    predict_range = window_days(trend, dates, predicted_dates)
+    scale_error, growth_rate_error = trend['scale_error'], trend['growth_rate_error']
+    return {'low': exponent(predict_range, scale - scale_error, growth_rate - growth_rate_error),
+            'optimum': exponent(predict_range, scale, growth_rate),
+            'high': exponent(predict_range, scale + scale_error, growth_rate + growth_rate_error),
+            'growth_factor': round(exponent(1, scale, growth_rate) / exponent(0, scale, growth_rate), 2)}
 
-        prediction_low = exponent(np.array(predict_range), popt[0] - perr[0], popt[1] - perr[1])
-        prediction_optimum = exponent(np.array(predict_range), popt[0], popt[1])
-        prediction_high = exponent(np.array(predict_range), popt[0] + perr[0], popt[1] + perr[1])
 
-        # Calculate reproduction number and add to plot
-        growth_factor = round(exponent(1, popt[0], popt[1]) / exponent(0, popt[0], popt[1]), 2)
+def add_curve_to_plot(ax, trend, dates, predicted_dates, color):
+    curve = exponential_curve(trend, dates, predicted_dates)
+    if curve:
         # Plot the optimum as line and the rest as area
-        plt.plot(predicted_dates, prediction_optimum, color=color, label='growth factor - ' + str(growth_factor))
-        plt.gca().fill_between(predicted_dates, prediction_low, prediction_high, alpha=0.2, color=color)
+        ax.plot(predicted_dates, curve['optimum'], color=color, label='growth factor - ' + str(curve['growth_factor']))
+        ax.fill_between(predicted_dates, curve['low'], curve['high'], alpha=0.2, color=color)
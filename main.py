@@ -1,21 +1,113 @@
-from frontend import app
+from database import migrations, shadow
 import dutch_statistics as dutch
-import graph_plotter
+import forecast
+import metrics
+import reproduction
+import series_cache
 import datetime
+import pipeline
 import util
 
 
-def refresh_dutch_statistics():
-    util.refresh_data_files()
-    dutch.get_rivm_stats()
-    dutch.get_nice_stats()
-    dutch.get_individual_cases_stats()
-    dutch.calculate_dutch_daily_statistics()
+# Stages of a refresh, run by the pipeline as soon as their files are downloaded and the stages they depend on are
+# written. Rewriting the RIVM statistics clears the NICE figures, so the NICE stage also runs for a new RIVM file.
+REFRESH_PIPELINE = [
+    pipeline.Stage('rivm', files=['RIVM_CUMULATIVE', 'RIVM_PREVALENCE', 'RIVM_REPRODUCTION'],
+                   parse=dutch.parse_rivm_files,
+                   parse_arguments=lambda refresh: {
+                       'high_water_mark': refresh.high_water_marks.get('RIVM_CUMULATIVE')},
+                   write=lambda refresh, parsed_files: dutch.get_rivm_stats(incremental=refresh.incremental,
+                                                                            parsed_files=parsed_files)),
+    pipeline.Stage('nice', files=['RIVM_CUMULATIVE', 'NICE_DAILY_INTAKE', 'NICE_CUMULATIVE_INTAKE'],
+                   depends_on=['rivm'],
+                   parse=dutch.parse_nice_files,
+                   write=lambda refresh, parsed_files: dutch.get_nice_stats(incremental=refresh.incremental,
+                                                                            parsed_files=parsed_files)),
+    pipeline.Stage('cases', files=['RIVM_CASES'],
+                   parse=dutch.parse_cases_file,
+                   parse_arguments=lambda refresh: {'high_water_mark': refresh.high_water_marks.get('RIVM_CASES')},
+                   write=lambda refresh, parsed_file: dutch.get_individual_cases_stats(
+                           incremental=refresh.incremental, parsed_file=parsed_file)),
+    pipeline.Stage('daily_statistics', files=['RIVM_CUMULATIVE', 'RIVM_CASES'], depends_on=['rivm', 'cases'],
+                   write=lambda refresh, parsed: dutch.calculate_dutch_daily_statistics(
+                           since=dutch.get_first_new_date(refresh.high_water_marks, ['RIVM_CUMULATIVE']))),
+    pipeline.Stage('totals', files=util.get_endpoints(), depends_on=['nice', 'daily_statistics'],
+                   write=lambda refresh, parsed: build_totals(since=dutch.get_first_new_date(
+                           refresh.high_water_marks, refresh.changed_files - {'RIVM_CASES'} | {'RIVM_CUMULATIVE'}))),
+    pipeline.Stage('forecast', files=util.get_endpoints(), depends_on=['totals'],
+                   write=lambda refresh, parsed: forecast.calculate_forecasts(build_id=refresh.results['totals'])),
+]
+REFRESH_STAGES = ['download'] + [stage.name for stage in REFRESH_PIPELINE] + ['publish']
+
+
+def __getattr__(name):
+    # Flask finds the app here, see FlaskConfig.FLASK_APP, the refresh does not need Flask and matplotlib loaded
+    if name == 'app':
+        from frontend import app
+        return app
+    raise AttributeError("module 'main' has no attribute " + repr(name))
+
+
+def refresh_dutch_statistics(full_rebuild=False, progress=None, download=True, profile=False):
+    """
+    Downloads the latest data files and stores the new statistics.
+    By default only changed data files and report dates newer than the stored ones are processed,
+    use full_rebuild to recreate all statistics from the data files.
+    Without download the data files already present are processed, which needs no network.
+    progress is called with the name of the stage and running, done or skipped as it goes.
+    With profile the refresh runs under cProfile and the statistics are stored in Config.PROFILE_DIR.
+    The stages run concurrently where they can, see pipeline, and build in a copy of the database that replaces it
+    at the end, see database.shadow.
+    """
+    if profile:
+        return metrics.profile_call(refresh_dutch_statistics, full_rebuild=full_rebuild, progress=progress,
+                                    download=download)
+
+    progress = progress or (lambda stage, state: None)
+    high_water_marks = {} if full_rebuild else dutch.get_high_water_marks()
+    if not high_water_marks.get('RIVM_CUMULATIVE'):
+        # It is unknown which reports a database without high-water marks has, like one upgraded by migrations
+        full_rebuild, high_water_marks = True, {}
+    refresh = pipeline.Refresh(full_rebuild, high_water_marks)
+    changed_files = pipeline.run(REFRESH_PIPELINE, refresh, download=download, progress=progress)
+
+    if changed_files:
+        progress('publish', 'running')
+        publish_data(refresh.results.get('totals'))
+        progress('publish', 'done')
+    else:
+        progress('publish', 'skipped')
+    util.mark_data_files_processed(changed_files)
+
+
+def build_totals(since):
+    """Builds the totals and the series cache they are read from once published, returns the id of the series build"""
+    dutch.build_daily_totals(since=since)
+    build_id = series_cache.write_series_cache(activate=False)
+    reproduction.calculate_regional_reproduction_numbers(since=since, build_id=build_id)
+    return build_id
+
+
+def publish_data(build_id):
+    """Switches to the series build of the new database and bumps the data version, which invalidates the caches"""
+    if build_id:
+        series_cache.activate_build(build_id)
+    util.bump_data_version()
+
+
+def upgrade_database():
+    """Upgrades a database created with an older data model, the totals are built again when their layout changed"""
+    if migrations.migrate():
+        with shadow.shadow_build():
+            build_id = build_totals(since=None)
+            forecast.calculate_forecasts(build_id=build_id)
+        publish_data(build_id)
 
 
 def quick_caller(municipality=None, province=None):
+    import graph_plotter
     return graph_plotter.plot_statistics(
-            data_set=dutch.sum_dutch_total_infections(municipality=municipality, province=province),
+            data_set=series_cache.sum_dutch_total_infections(municipality=municipality, province=province),
             start_date=datetime.date(2020, 7, 6),
             no_days_to_predict=7,
             linear_regres=True,
@@ -23,9 +115,7 @@ def quick_caller(municipality=None, province=None):
 
 
 def quick_caller2():
-    graph_plotter.plot_reproduction_no(data_set=dutch.sum_dutch_total_infections(None, None),
-                                       incubation_time=5,
-                                       generational_interval=3.95,
-                                       start_date=datetime.date(2020, 10, 1),
-                                       end_date=datetime.date(2020, 10, 30),
-                                       no_days_to_predict=7)
+    import graph_plotter
+    graph_plotter.plot_regional_reproduction_no(data_set=dutch.get_regional_reproduction_numbers(None, None),
+                                                start_date=datetime.date(2020, 10, 1),
+                                                end_date=datetime.date(2020, 10, 30))
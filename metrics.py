@@ -0,0 +1,236 @@
+"""
+Instrumentation of the refresh stages and the plot renders, exposed in the Prometheus text format on /metrics.
+
+A stage records its wall time, the rows it processed, the bytes it read and the memory it used. Code running within
+a stage adds to it with add_rows, add_bytes_read, add_failed_downloads and phase, which do nothing outside a stage.
+"""
+from config import Config
+import contextlib
+import functools
+import threading
+import tracemalloc
+import resource
+import datetime
+import cProfile
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+metrics_lock = threading.Lock()
+stage_metrics = {}
+render_metrics = {}
+RENDER_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# The stage running in the current thread
+running = threading.local()
+# Stages of a refresh run at the same time, so the traced stages share one trace, see start_tracing
+tracing_lock = threading.Lock()
+traced_stages = 0
+
+
+def instrumented_stage(stage):
+    """Decorates a function that is measured as the given stage every time it runs"""
+
+    def decorator(stage_function):
+        @functools.wraps(stage_function)
+        def run(*args, **kwargs):
+            with measure_stage(stage):
+                return stage_function(*args, **kwargs)
+
+        return run
+
+    return decorator
+
+
+@contextlib.contextmanager
+def measure_stage(stage):
+    """
+    Measures the code within as a stage. The peak memory is traced with tracemalloc when
+    Config.METRICS_TRACE_MEMORY is set, which slows the stage down, otherwise only the resident memory is recorded.
+    The traced peak of stages that overlap includes the memory of each other.
+    """
+    outer_stage = getattr(running, 'stage', None)
+    record = {'rows': 0, 'bytes_read': 0, 'phases': {}}
+    running.stage = record
+    trace_memory = Config.METRICS_TRACE_MEMORY and start_tracing()
+    failed = False
+    start_time = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record['seconds'] = time.perf_counter() - start_time
+        if trace_memory:
+            record['traced_peak_bytes'] = stop_tracing()
+        # ru_maxrss is in kilobytes on Linux
+        record['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        running.stage = outer_stage
+        store_stage(stage, record, failed)
+
+
+def start_tracing():
+    """
+    Starts tracing memory for a stage. The trace is started by the first traced stage and stopped by the last,
+    so a stage never stops the trace of a stage running in another thread.
+
+    :return:
+    False when memory is traced outside of the stages, like by the benchmarks, the stage is not traced then
+    """
+    global traced_stages
+    with tracing_lock:
+        if not traced_stages:
+            if tracemalloc.is_tracing():
+                return False
+            tracemalloc.start()
+        traced_stages += 1
+        return True
+
+
+def stop_tracing():
+    """Returns the peak of the trace since the first of the running traced stages started"""
+    global traced_stages
+    with tracing_lock:
+        peak = tracemalloc.get_traced_memory()[1]
+        traced_stages -= 1
+        if not traced_stages:
+            tracemalloc.stop()
+        return peak
+
+
+def store_stage(stage, record, failed=False):
+    """Stores the record of a run of the stage, also used for records measured in another process"""
+    with metrics_lock:
+        previous = stage_metrics.get(stage, {})
+        record['runs'] = previous.get('runs', 0) + 1
+        record['failures'] = previous.get('failures', 0) + failed
+        record['finished_at'] = time.time()
+        stage_metrics[stage] = record
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Adds the time spent within to the named phase of the running stage, like parsing or committing"""
+    record = getattr(running, 'stage', None)
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record['phases'][name] = record['phases'].get(name, 0) + time.perf_counter() - start_time
+
+
+def timed_iteration(iterable, name):
+    """Yields the items of the iterable, the time spent producing them is added to the named phase"""
+    iterator = iter(iterable)
+    while True:
+        with phase(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def add_rows(no_rows):
+    record = getattr(running, 'stage', None)
+    if record is not None:
+        record['rows'] += no_rows
+
+
+def add_bytes_read(no_bytes):
+    record = getattr(running, 'stage', None)
+    if record is not None:
+        record['bytes_read'] += no_bytes
+
+
+def add_failed_downloads(no_files):
+    record = getattr(running, 'stage', None)
+    if record is not None:
+        record['failed_downloads'] = record.get('failed_downloads', 0) + no_files
+
+
+def record_render(plot, cache_result, seconds):
+    """Records the latency of a plot request, cache_result is hit or miss"""
+    with metrics_lock:
+        histogram = render_metrics.setdefault((plot, cache_result), {'buckets': [0] * len(RENDER_LATENCY_BUCKETS),
+                                                                     'count': 0, 'sum': 0.0})
+        for index, upper_bound in enumerate(RENDER_LATENCY_BUCKETS):
+            if seconds <= upper_bound:
+                histogram['buckets'][index] += 1
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+
+
+def profile_call(function, *args, **kwargs):
+    """Runs the function under cProfile and writes the statistics to Config.PROFILE_DIR for pstats or snakeviz"""
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    file_name = function.__name__ + datetime.datetime.now().strftime('-%Y%m%d-%H%M%S') + '.prof'
+    path = os.path.join(Config.PROFILE_DIR, file_name)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(path)
+        logger.info('Stored profile of %s in %s', function.__name__, path)
+
+
+def format_metric(name, metric_type, description, samples):
+    """Formats samples, a list of label dicts and values, in the Prometheus text format"""
+    return '# HELP ' + name + ' ' + description + '\n# TYPE ' + name + ' ' + metric_type + '\n' + \
+        format_samples(name, samples)
+
+
+def format_samples(name, samples):
+    lines = []
+    for labels, value in samples:
+        label_text = ','.join('%s="%s"' % (label, str(label_value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for label, label_value in labels.items())
+        lines.append(name + ('{' + label_text + '}' if label_text else '') + ' ' + repr(float(value)))
+    return ''.join(line + '\n' for line in lines)
+
+
+def prometheus_text():
+    with metrics_lock:
+        stages = {stage: dict(record, phases=dict(record['phases'])) for stage, record in stage_metrics.items()}
+        renders = {key: dict(histogram, buckets=list(histogram['buckets']))
+                   for key, histogram in render_metrics.items()}
+
+    text = ''
+    for field, name, metric_type, description in (
+            ('seconds', 'covid_refresh_stage_seconds', 'gauge', 'Wall time of the last run of the stage'),
+            ('rows', 'covid_refresh_stage_rows', 'gauge', 'Rows processed by the last run of the stage'),
+            ('bytes_read', 'covid_refresh_stage_bytes_read', 'gauge', 'Bytes read by the last run of the stage'),
+            ('failed_downloads', 'covid_refresh_stage_failed_downloads', 'gauge',
+             'Data files the last run of the stage failed to download'),
+            ('max_rss_bytes', 'covid_refresh_stage_max_rss_bytes', 'gauge',
+             'Peak resident memory of the process at the end of the last run of the stage'),
+            ('traced_peak_bytes', 'covid_refresh_stage_traced_peak_bytes', 'gauge',
+             'Peak memory allocated by the last run of the stage, when traced'),
+            ('finished_at', 'covid_refresh_stage_last_run_timestamp_seconds', 'gauge',
+             'Time the last run of the stage ended'),
+            ('runs', 'covid_refresh_stage_runs_total', 'counter', 'Runs of the stage'),
+            ('failures', 'covid_refresh_stage_failures_total', 'counter', 'Runs of the stage that failed')):
+        samples = [({'stage': stage}, record[field]) for stage, record in sorted(stages.items()) if field in record]
+        if samples:
+            text += format_metric(name, metric_type, description, samples)
+
+    phase_samples = [({'stage': stage, 'phase': phase_name}, seconds) for stage, record in sorted(stages.items())
+                     for phase_name, seconds in sorted(record['phases'].items())]
+    if phase_samples:
+        text += format_metric('covid_refresh_phase_seconds', 'gauge',
+                              'Wall time of a phase within the last run of the stage', phase_samples)
+
+    if renders:
+        text += '# HELP covid_render_seconds Latency of plot requests\n# TYPE covid_render_seconds histogram\n'
+        bucket_names = [repr(float(upper_bound)) for upper_bound in RENDER_LATENCY_BUCKETS] + ['+Inf']
+        for (plot, cache_result), histogram in sorted(renders.items()):
+            labels = {'plot': plot, 'cache': cache_result}
+            text += format_samples('covid_render_seconds_bucket',
+                                   [(dict(labels, le=bucket_name), count) for bucket_name, count in
+                                    zip(bucket_names, histogram['buckets'] + [histogram['count']])])
+            text += format_samples('covid_render_seconds_sum', [(labels, histogram['sum'])])
+            text += format_samples('covid_render_seconds_count', [(labels, histogram['count'])])
+    return text
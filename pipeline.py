@@ -0,0 +1,162 @@
+"""
+Runs the stages of a refresh as a graph instead of one after the other, see main.REFRESH_PIPELINE.
+
+Every stage declares the data files it depends on and the stages that have to be written before it.
+Once the files of a stage have been downloaded, the CPU heavy decoding of the stage runs in a pool of processes,
+while other files are still downloading and other stages are decoding or writing. All database writes go through
+a single writer thread, so SQLite never has two writers, and are made to the shadow database of the refresh.
+The refresh takes as long as its slowest chain of downloads, decoding and writes rather than the sum of the stages.
+"""
+from config import Config
+from database import shadow, writing_to
+import concurrent.futures
+import contextlib
+import metrics
+import util
+import os
+
+
+class Stage(object):
+    """
+    A step of the refresh
+
+    Parameters
+    ----------
+    name: str
+        name of the stage, used in the progress and the metrics
+    files: list of str
+        data files whose change makes the stage run, the stage starts once they are all downloaded
+    write: function
+        called with the refresh and the result of parse, writes to the database
+    depends_on: list of str, optional
+        stages that have to be written before this stage writes
+    parse: function, optional
+        called in a parse worker with the keyword arguments returned by parse_arguments, must be picklable
+    parse_arguments: function, optional
+        called with the refresh, returns the keyword arguments of parse
+    """
+
+    def __init__(self, name, files, write, depends_on=(), parse=None, parse_arguments=None):
+        self.name = name
+        self.files = set(files)
+        self.write = write
+        self.depends_on = set(depends_on)
+        self.parse = parse
+        self.parse_arguments = parse_arguments or (lambda refresh: {})
+
+
+class Refresh(object):
+    """State of a running refresh that the stages use to decide what to do"""
+
+    def __init__(self, full_rebuild, high_water_marks):
+        self.full_rebuild = full_rebuild
+        self.incremental = not full_rebuild
+        self.high_water_marks = high_water_marks
+        # Files whose refresh finished and the ones among them with content that has not been processed yet
+        self.known_files = set()
+        self.changed_files = set()
+        # What the write of every stage returned
+        self.results = {}
+
+
+def run(stages, refresh, download=True, progress=None):
+    """
+    Downloads the data files and runs the stages that depend on changed files.
+    A file that fails to download is not changed, its stages use the previous download. The failed files are
+    reported in the progress of the download, a full rebuild fails when one of them was never downloaded.
+
+    :return:
+    set with the names of the data files that were processed
+    """
+    progress = progress or (lambda stage, state: None)
+    download_state = util.read_download_state()
+    stage_states = {stage.name: 'waiting' for stage in stages}
+    parsed = {}
+    futures = {}
+    failed_files = []
+
+    with contextlib.ExitStack() as shadow_build, contextlib.ExitStack() as download_stage:
+        download_stage.enter_context(metrics.measure_stage('download'))
+        progress('download', 'running')
+        with create_parse_pool() as parse_pool, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=10) as download_pool, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer') as writer:
+            for filename, pending_refresh in util.start_data_file_refreshes(download_pool, download).items():
+                futures[pending_refresh] = ('download', filename)
+
+            shadow_engine = None
+            while True:
+                for stage in stages:
+                    if stage_states[stage.name] not in ('waiting', 'parsed') or not stage.files <= refresh.known_files:
+                        continue
+                    if not refresh.full_rebuild and not stage.files & refresh.changed_files:
+                        stage_states[stage.name] = 'skipped'
+                        progress(stage.name, 'skipped')
+                    elif stage_states[stage.name] == 'waiting' and stage.parse:
+                        stage_states[stage.name] = 'parsing'
+                        progress(stage.name, 'running')
+                        futures[parse_pool.submit(parse_in_worker, stage.name, stage.parse,
+                                                  stage.parse_arguments(refresh))] = ('parse', stage.name)
+                    elif all(stage_states[name] in ('written', 'skipped') for name in stage.depends_on):
+                        if shadow_engine is None:
+                            # The copy is only made once a stage has something to write
+                            shadow_engine = shadow_build.enter_context(shadow.shadow_build())
+                        if stage_states[stage.name] == 'waiting':
+                            progress(stage.name, 'running')
+                        stage_states[stage.name] = 'writing'
+                        futures[writer.submit(write_in_writer, shadow_engine, stage.write, refresh,
+                                              parsed.pop(stage.name, None))] = ('write', stage.name)
+
+                if not futures:
+                    break
+                finished_futures, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for finished_future in finished_futures:
+                    step, name = futures.pop(finished_future)
+                    result = finished_future.result()
+                    if step == 'download':
+                        if result['status'] == 'failed':
+                            failed_files.append(name)
+                        if refresh.full_rebuild and not os.path.exists(util.data_file_path(name)):
+                            raise RuntimeError('A full rebuild needs ' + name + ', which was never downloaded')
+                        if util.record_data_file(download_state, name, result):
+                            refresh.changed_files.add(name)
+                        refresh.known_files.add(name)
+                        if refresh.known_files >= set(util.get_endpoints()):
+                            util.write_download_state(download_state)
+                            download_stage.close()
+                            progress('download', 'done, failed: ' + ', '.join(sorted(failed_files)) if failed_files
+                                     else 'done')
+                    elif step == 'parse':
+                        parsed[name], parse_record = result
+                        # Records measured in a worker process are not in the metrics of this process yet
+                        if isinstance(parse_pool, concurrent.futures.ProcessPoolExecutor):
+                            metrics.store_stage(name + '_parse', parse_record)
+                        stage_states[name] = 'parsed'
+                    else:
+                        refresh.results[name] = result
+                        stage_states[name] = 'written'
+                        progress(name, 'done')
+
+            unfinished_stages = [name for name, state in stage_states.items() if state not in ('written', 'skipped')]
+            if unfinished_stages:
+                raise RuntimeError('Stages with unknown dependencies: ' + ', '.join(unfinished_stages))
+
+    return set(util.get_endpoints()) if refresh.full_rebuild else refresh.changed_files
+
+
+def create_parse_pool():
+    """Decoding runs in processes, with Config.PARSE_WORKERS below 1 in a thread of the refreshing process"""
+    if Config.PARSE_WORKERS < 1:
+        return concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='parser')
+    return util.create_process_pool(Config.PARSE_WORKERS, preload=['pipeline', 'dutch_statistics'])
+
+
+def parse_in_worker(stage_name, parse, arguments):
+    with metrics.measure_stage(stage_name + '_parse') as record:
+        result = parse(**arguments)
+    return result, record
+
+
+def write_in_writer(shadow_engine, write, refresh, parsed_result):
+    with writing_to(shadow_engine):
+        return write(refresh, parsed_result)
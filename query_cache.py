@@ -0,0 +1,167 @@
+"""
+Cache of the results of the dutch_statistics readers, keyed by the reader, its arguments and the data version.
+
+The results stay valid until a refresh bumps the data version, the least recently used results are dropped once
+the cache exceeds Config.QUERY_CACHE_MAX_BYTES. With Config.QUERY_CACHE_DIR set the results are also stored on disk,
+so every process of a server shares them. Every caller gets its own copy of the lists and dicts of a cached result,
+the numpy arrays in it are shared and made read-only, see share.
+"""
+from config import Config
+import numpy as np
+import collections
+import functools
+import threading
+import hashlib
+import inspect
+import pickle
+import shutil
+import util
+import os
+
+cache_lock = threading.Lock()
+cached_results = collections.OrderedDict()
+cache_state = {'data_version': None, 'bytes': 0}
+cache_statistics = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def cached_query(query_function):
+    """Decorates a reader, its result is returned from the cache while the data version does not change"""
+    signature = inspect.signature(query_function)
+
+    @functools.wraps(query_function)
+    def query(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        # The version is read before the query, so a result is never stored under a newer version than its data
+        data_version = util.get_data_version()
+        key = query_key(query_function, arguments.arguments)
+
+        result = get_from_memory(data_version, key)
+        if result is not None:
+            return share(result[0])
+
+        result = read_from_disk(data_version, key)
+        if result is not None:
+            count('disk_hits')
+            store_in_memory(data_version, key, result)
+            return share(result[0])
+
+        count('misses')
+        result = (query_function(*args, **kwargs),)
+        pickled_result = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        write_to_disk(data_version, key, pickled_result)
+        store_in_memory(data_version, key, result, len(pickled_result))
+        return share(result[0])
+
+    return query
+
+
+def share(result):
+    """
+    Returns a copy of the lists and dicts of a cached result for a caller, which may change them.
+    Arrays can be large, they are made read-only instead of copied.
+    """
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+        return result
+    if isinstance(result, dict):
+        return {name: share(value) for name, value in result.items()}
+    if isinstance(result, list):
+        return [share(value) for value in result]
+    return result
+
+
+def query_key(query_function, arguments):
+    return hashlib.sha256((query_function.__module__ + '.' + query_function.__qualname__ + repr(
+            sorted(arguments.items()))).encode()).hexdigest()
+
+
+def get_from_memory(data_version, key):
+    """Returns the result wrapped in a tuple, so a reader returning None is cached as well"""
+    with cache_lock:
+        if cache_state['data_version'] != data_version:
+            return None
+        entry = cached_results.get(key)
+        if entry is None:
+            return None
+        cached_results.move_to_end(key)
+        cache_statistics['hits'] += 1
+        return entry[0]
+
+
+def store_in_memory(data_version, key, result, size=None):
+    size = size or len(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+    with cache_lock:
+        if cache_state['data_version'] is not None and data_version < cache_state['data_version']:
+            # The data changed while the query ran
+            return
+        if cache_state['data_version'] != data_version:
+            # Results of older versions are never looked up again
+            cached_results.clear()
+            cache_state.update(data_version=data_version, bytes=0)
+        if size > Config.QUERY_CACHE_MAX_BYTES:
+            return
+        if key in cached_results:
+            cache_state['bytes'] -= cached_results.pop(key)[1]
+        cached_results[key] = (result, size)
+        cache_state['bytes'] += size
+        while cache_state['bytes'] > Config.QUERY_CACHE_MAX_BYTES:
+            cache_state['bytes'] -= cached_results.popitem(last=False)[1][1]
+            cache_statistics['evictions'] += 1
+
+
+def version_directory(data_version):
+    return os.path.join(Config.QUERY_CACHE_DIR, str(data_version))
+
+
+def read_from_disk(data_version, key):
+    if not Config.QUERY_CACHE_DIR:
+        return None
+    try:
+        with open(os.path.join(version_directory(data_version), key + '.pickle'), mode='rb') as result_file:
+            return pickle.load(result_file)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def write_to_disk(data_version, key, pickled_result):
+    """Writes the result for other processes, the results of other versions are removed"""
+    if not Config.QUERY_CACHE_DIR:
+        return
+    directory = version_directory(data_version)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+        # A process that still works with an older version must not remove the results of a newer one
+        for other_directory in os.listdir(Config.QUERY_CACHE_DIR):
+            if other_directory.isdigit() and int(other_directory) < data_version:
+                shutil.rmtree(os.path.join(Config.QUERY_CACHE_DIR, other_directory), ignore_errors=True)
+
+    # Every process writes its own temporary file, readers only ever see complete files
+    path = os.path.join(directory, key + '.pickle')
+    temporary_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(temporary_path, mode='wb') as result_file:
+            result_file.write(pickled_result)
+        os.replace(temporary_path, path)
+    except OSError:
+        # The directory was removed by a process with a newer version, the result is outdated anyway
+        pass
+
+
+def clear():
+    with cache_lock:
+        cached_results.clear()
+        cache_state.update(data_version=None, bytes=0)
+
+
+def count(statistic):
+    with cache_lock:
+        cache_statistics[statistic] += 1
+
+
+def get_statistics():
+    with cache_lock:
+        statistics = dict(cache_statistics, entries=len(cached_results), bytes=cache_state['bytes'])
+    lookups = statistics['hits'] + statistics['disk_hits'] + statistics['misses']
+    statistics['hit_rate'] = (statistics['hits'] + statistics['disk_hits']) / lookups if lookups else 0
+    return statistics
@@ -0,0 +1,63 @@
+"""
+Runs refresh_dutch_statistics as a background job, so web requests do not wait for it.
+
+Only one refresh runs at a time per process, starting a refresh while one is running does nothing.
+The progress of every stage is kept in a status that can be polled.
+"""
+import traceback
+import threading
+import datetime
+import main
+
+job_lock = threading.Lock()
+status_lock = threading.Lock()
+job_status = {'state': 'idle', 'stages': {}}
+
+
+def start_refresh(full_rebuild=False, profile=False):
+    """
+    Starts a refresh in a background thread, returns False when a refresh is already running.
+    With profile the refresh is run under cProfile, see main.refresh_dutch_statistics
+    """
+    if not job_lock.acquire(blocking=False):
+        return False
+
+    with status_lock:
+        job_status.clear()
+        job_status.update(state='running', full_rebuild=full_rebuild, profile=profile, current_stage=None, error=None,
+                          started_at=datetime.datetime.now().isoformat(timespec='seconds'), finished_at=None,
+                          stages={stage: 'pending' for stage in main.REFRESH_STAGES})
+
+    threading.Thread(target=run_refresh, args=(full_rebuild, profile), name='refresh_dutch_statistics',
+                     daemon=True).start()
+    return True
+
+
+def run_refresh(full_rebuild, profile):
+    try:
+        main.refresh_dutch_statistics(full_rebuild=full_rebuild, progress=report_progress, profile=profile)
+        finish('finished')
+    except Exception:
+        finish('failed', traceback.format_exc(limit=5))
+    finally:
+        job_lock.release()
+
+
+def report_progress(stage, state):
+    with status_lock:
+        job_status['stages'][stage] = state
+        if state == 'running':
+            job_status['current_stage'] = stage
+
+
+def finish(state, error=None):
+    with status_lock:
+        job_status.update(state=state, current_stage=None, error=error,
+                          finished_at=datetime.datetime.now().isoformat(timespec='seconds'))
+
+
+def get_status():
+    with status_lock:
+        status = dict(job_status)
+        status['stages'] = dict(job_status.get('stages', {}))
+    return status
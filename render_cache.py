@@ -0,0 +1,169 @@
+"""
+Cache of rendered plots, keyed by a hash of the plot parameters, the plotted data and the data version.
+
+A plot that was rendered before is served from the plot folder without calling matplotlib, concurrent requests for a
+plot that is not in the folder yet share a single render.
+The least recently used plots are removed once the folder exceeds the configured number of files or bytes.
+"""
+from config import Config
+import concurrent.futures
+import functools
+import threading
+import render_pool
+import metrics
+import hashlib
+import inspect
+import json
+import util
+import time
+import os
+
+statistics_lock = threading.Lock()
+render_statistics = {'hits': 0, 'misses': 0, 'evictions': 0}
+# Images being rendered, requests for the same image wait for the render instead of rendering it again
+rendering_lock = threading.Lock()
+pending_renders = {}
+
+# Plots made by graph_plotter start with one of these prefixes, other files in the folder are never evicted
+PLOT_PREFIXES = ('case_plot', 'Daily_R_', 'region_plot')
+# Images are written under this prefix and renamed once complete, see graph_plotter.save_figure
+TEMPORARY_PREFIX = '.render-'
+
+
+def cached_render(prefix):
+    """
+    Decorates a plot function that takes a data_set and stores the image under the image_name it is given.
+    Returns the name of the cached image when the same plot was rendered for the current data version before,
+    otherwise the plot is rendered by the render pool.
+    """
+
+    def decorator(plot_function):
+        signature = inspect.signature(plot_function)
+
+        @functools.wraps(plot_function)
+        def render(*args, **kwargs):
+            start_time = time.perf_counter()
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            image_name = prefix + render_key(arguments.arguments) + '.png'
+            image_path = os.path.join(Config.PLOT_DIR, image_name)
+
+            # Images only get their name once they are complete, see graph_plotter.save_figure
+            if os.path.exists(image_path):
+                # Touch the image, so the eviction treats it as recently used
+                os.utime(image_path)
+                count('hits')
+                metrics.record_render(plot_function.__name__, 'hit', time.perf_counter() - start_time)
+                return image_name
+
+            # The worker may have another plot folder, so it is given the full path
+            arguments.arguments['image_name'] = os.path.abspath(image_path)
+            if render_once(image_name, lambda: render_pool.render(plot_function, arguments.arguments)):
+                count('misses')
+                evict()
+                metrics.record_render(plot_function.__name__, 'miss', time.perf_counter() - start_time)
+            else:
+                count('hits')
+                metrics.record_render(plot_function.__name__, 'hit', time.perf_counter() - start_time)
+            return image_name
+
+        return render
+
+    return decorator
+
+
+def render_once(image_name, render):
+    """
+    Calls render unless the image is being rendered already, then waits for that render and shares its image or
+    its error. Returns whether render was called.
+    """
+    with rendering_lock:
+        pending_render = pending_renders.get(image_name)
+        first_request = pending_render is None
+        if first_request:
+            pending_render = pending_renders[image_name] = concurrent.futures.Future()
+    if not first_request:
+        pending_render.result()
+        return False
+
+    try:
+        render()
+        pending_render.set_result(image_name)
+    except BaseException as error:
+        pending_render.set_exception(error)
+        raise
+    finally:
+        with rendering_lock:
+            del pending_renders[image_name]
+    return True
+
+
+def render_key(arguments):
+    parameters = {name: value for name, value in arguments.items() if name not in ('data_set', 'image_name')}
+    render_hash = hashlib.sha256()
+    render_hash.update(str(util.get_data_version()).encode())
+    render_hash.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+    render_hash.update(data_fingerprint(arguments.get('data_set')).encode())
+    return render_hash.hexdigest()[:32]
+
+
+def data_fingerprint(data_set):
+    """Series from the series cache are identified by their key, other data sets by their content"""
+    key = getattr(data_set, 'key', None)
+    if key:
+        return key
+    if isinstance(data_set, dict):
+        # Arrays are hashed by their bytes, their repr leaves out the middle of long arrays
+        content_hash = hashlib.sha256()
+        for name, value in sorted(data_set.items()):
+            content_hash.update(name.encode())
+            content_hash.update(value.tobytes() if hasattr(value, 'tobytes') else repr(value).encode())
+        return content_hash.hexdigest()
+    return hashlib.sha256(repr(list(data_set or [])).encode()).hexdigest()
+
+
+def evict():
+    """Removes the least recently used plots until the folder is within the configured limits"""
+    plots = []
+    for entry in os.scandir(Config.PLOT_DIR):
+        if entry.is_file() and entry.name.startswith(TEMPORARY_PREFIX):
+            remove_abandoned_image(entry)
+        elif entry.is_file() and entry.name.startswith(PLOT_PREFIXES):
+            plot_stat = entry.stat()
+            plots.append((plot_stat.st_mtime, plot_stat.st_size, entry.path))
+    plots.sort()
+
+    no_files = len(plots)
+    no_bytes = sum(plot[1] for plot in plots)
+    for modified_time, size, path in plots:
+        if no_files <= Config.RENDER_CACHE_MAX_FILES and no_bytes <= Config.RENDER_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            count('evictions')
+        except FileNotFoundError:
+            pass
+        no_files -= 1
+        no_bytes -= size
+
+
+def remove_abandoned_image(entry):
+    """Removes a temporary image left behind by a killed worker, images still being written are more recent"""
+    try:
+        if entry.stat().st_mtime < time.time() - 2 * Config.RENDER_TIMEOUT:
+            os.remove(entry.path)
+    except FileNotFoundError:
+        pass
+
+
+def count(statistic):
+    with statistics_lock:
+        render_statistics[statistic] += 1
+
+
+def get_statistics():
+    with statistics_lock:
+        statistics = dict(render_statistics)
+    lookups = statistics['hits'] + statistics['misses']
+    statistics['hit_rate'] = statistics['hits'] / lookups if lookups else 0
+    return statistics
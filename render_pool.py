@@ -0,0 +1,80 @@
+"""
+Pool of worker processes that render the plots, so concurrent requests never draw on the same matplotlib state.
+
+Plot functions are submitted by module and name with their arguments. The number of jobs waiting or running is bounded:
+a request waits a short while for a free slot and is refused with RenderPoolBusy when none frees up, and a request
+stops waiting for a render that takes longer than the configured timeout with RenderTimeout.
+"""
+from config import Config
+from concurrent.futures.process import BrokenProcessPool
+import concurrent.futures
+import threading
+import importlib
+import inspect
+import util
+
+pool_lock = threading.Lock()
+executor = None
+job_slots = threading.BoundedSemaphore(max(1, Config.RENDER_QUEUE_SIZE))
+
+
+class RenderPoolBusy(RuntimeError):
+    pass
+
+
+class RenderTimeout(RuntimeError):
+    pass
+
+
+def render(plot_function, arguments):
+    """
+    Runs the plot function with the keyword arguments in a worker process and returns its result.
+    Renders in the calling process when the pool has no workers.
+    """
+    if Config.RENDER_WORKERS < 1:
+        return plot_function(**arguments)
+
+    if not job_slots.acquire(timeout=Config.RENDER_QUEUE_TIMEOUT):
+        raise RenderPoolBusy('All ' + str(Config.RENDER_QUEUE_SIZE) + ' render slots are taken, try again later')
+
+    try:
+        future = get_executor().submit(render_in_worker, plot_function.__module__, plot_function.__name__, arguments)
+    except BaseException:
+        job_slots.release()
+        raise
+
+    # The slot is freed when the job ends, a job that timed out keeps its slot until the worker is done with it
+    future.add_done_callback(lambda done: job_slots.release())
+    try:
+        return future.result(timeout=Config.RENDER_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise RenderTimeout('Rendering ' + plot_function.__name__ + ' took longer than ' +
+                            str(Config.RENDER_TIMEOUT) + ' seconds')
+    except BrokenProcessPool:
+        # A worker died, start a fresh pool for the next job
+        reset_executor()
+        raise
+
+
+def get_executor():
+    global executor
+    with pool_lock:
+        if executor is None:
+            # The pool is started from a request thread, so its workers are not forked, see util.create_process_pool
+            executor = util.create_process_pool(Config.RENDER_WORKERS, preload=['graph_plotter'])
+        return executor
+
+
+def reset_executor():
+    global executor
+    with pool_lock:
+        if executor is not None:
+            executor.shutdown(wait=False)
+        executor = None
+
+
+def render_in_worker(module_name, function_name, arguments):
+    """Runs in a worker process, plot functions are looked up undecorated so the render cache is not consulted twice"""
+    plot_function = inspect.unwrap(getattr(importlib.import_module(module_name), function_name))
+    return plot_function(**arguments)
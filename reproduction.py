@@ -0,0 +1,260 @@
+"""
+Growth rate and reproduction number (Re) engine.
+
+The growth rate of every window of days is fitted at once with a weighted log-linear least squares fit over a
+strided view of the cases, instead of one nonlinear curve fit per day.
+At refresh the Re of every region is calculated in a pool of processes and stored in DutchReproductionNumbers.
+"""
+from config import Config
+from database import database_session
+from database.data_model import DutchReproductionNumbers
+from numpy.lib.stride_tricks import sliding_window_view
+import numpy as np
+import contextlib
+import itertools
+import metrics
+import series_cache
+import util
+
+LOG_LINEAR = 'log_linear'
+CURVE_FIT = 'curve_fit'
+# Quantiles of the credible bands of Re, see reproduction_number_bands
+BAND_QUANTILES = {'low': 0.025, 'inner_low': 0.25, 'median': 0.5, 'inner_high': 0.75, 'high': 0.975}
+
+
+def exponent(x, a, b):
+    return a * np.exp(x * b)
+
+
+def window_x_values(window_size):
+    # Cases are ordered newest first, so the newest day of a window gets the highest x
+    return np.arange(window_size, 0, -1, dtype=np.float64)
+
+
+def growth_rates(cases, window_size, method=LOG_LINEAR):
+    """
+    Parameters
+    ----------
+    cases: array-like
+        daily cases, newest first
+    window_size: int
+        number of days per fit
+    method: str, optional
+        log_linear fits all windows in one vectorized pass, curve_fit fits every window with
+        scipy.optimize.curve_fit like the plotter used to, which is useful to validate the results
+
+    :return:
+    numpy array with the daily growth rate of every window cases[i:i + window_size],
+    for all windows that are followed by at least one more day. NaN where no fit is possible
+    """
+    cases = np.asarray(cases, dtype=np.float64)
+    no_windows = max(len(cases) - window_size, 0)
+    if method == CURVE_FIT:
+        return np.array([curve_fit_growth_rate(cases[index:index + window_size]) for index in range(no_windows)])
+    if method != LOG_LINEAR:
+        raise ValueError('Unknown growth rate method ' + str(method))
+    if no_windows == 0:
+        return np.empty(0)
+
+    windows = sliding_window_view(cases, window_size)[:no_windows]
+    return np.exp(log_linear_exponents(windows, window_x_values(window_size))) - 1
+
+
+def log_linear_exponents(windows, x):
+    """
+    Fits log(y) = log(a) + b * x to every row of windows and returns b.
+    The squared values are used as weights, which makes the fit approximate the least squares fit of a * exp(b * x)
+    on the values themselves. Days without positive cases get no weight.
+    """
+    valid = np.isfinite(windows) & (windows > 0)
+    weights = np.where(valid, windows, 0.0) ** 2
+    log_values = np.log(np.where(valid, windows, 1.0))
+
+    weight_sum = weights.sum(axis=-1)
+    x_sum = (weights * x).sum(axis=-1)
+    log_sum = (weights * log_values).sum(axis=-1)
+    x_squared_sum = (weights * x ** 2).sum(axis=-1)
+    x_log_sum = (weights * x * log_values).sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponents = (weight_sum * x_log_sum - x_sum * log_sum) / (weight_sum * x_squared_sum - x_sum ** 2)
+    return np.where(valid.sum(axis=-1) >= 2, exponents, np.nan)
+
+
+def weighted_least_squares(values, x, weights):
+    """
+    Fits values = intercept + slope * x to every row, returns the intercepts, their standard errors, the slopes
+    and their standard errors. The errors are scaled with the residuals, like scipy.optimize.curve_fit does.
+    """
+    no_values = (weights > 0).sum(axis=-1)
+    weight_sum = weights.sum(axis=-1)
+    x_sum = (weights * x).sum(axis=-1)
+    x_squared_sum = (weights * x ** 2).sum(axis=-1)
+    value_sum = (weights * values).sum(axis=-1)
+    x_value_sum = (weights * x * values).sum(axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        determinant = weight_sum * x_squared_sum - x_sum ** 2
+        slope = (weight_sum * x_value_sum - x_sum * value_sum) / determinant
+        intercept = (x_squared_sum * value_sum - x_sum * x_value_sum) / determinant
+        residuals = values - intercept[..., np.newaxis] - slope[..., np.newaxis] * x
+        residual_variance = (weights * residuals ** 2).sum(axis=-1) / (no_values - 2)
+        intercept_error = np.sqrt(residual_variance * x_squared_sum / determinant)
+        slope_error = np.sqrt(residual_variance * weight_sum / determinant)
+
+    fitted = no_values >= 3
+    return tuple(np.where(fitted, parameter, np.nan) for parameter in (intercept, intercept_error, slope, slope_error))
+
+
+def curve_fit_growth_rate(window):
+    # Only used to validate the log linear fit, scipy takes long to import
+    from scipy import optimize
+    try:
+        popt, pcov = optimize.curve_fit(exponent, window_x_values(len(window)), window)
+    except (RuntimeError, ValueError):
+        return np.nan
+    return exponent(1, popt[0], popt[1]) / exponent(0, popt[0], popt[1]) - 1
+
+
+def reproduction_numbers(growth_rate, generational_interval, generational_interval_stdev):
+    """
+    Converts growth rates to reproduction numbers, formula: R = exp(rTc - 0.5 * r^2 * stdev(Tc)^2)
+    r = growth_rate
+    Tc = generational_interval
+    """
+    return np.round(np.exp((growth_rate * generational_interval) -
+                           (0.5 * (growth_rate ** 2) * (generational_interval_stdev ** 2))), 2)
+
+
+def daily_reproduction_numbers(cases, incubation_time, generational_interval, generational_interval_stdev,
+                               method=LOG_LINEAR):
+    """Returns Re for every window of round(incubation_time) days of the cases, newest first"""
+    return reproduction_numbers(growth_rates(cases, round(incubation_time), method),
+                                generational_interval, generational_interval_stdev)
+
+
+def reproduction_number_bands(cases, incubation_time, generational_interval, generational_interval_stdev,
+                              generational_interval_error=Config.REPRODUCTION_GENERATIONAL_INTERVAL_ERROR,
+                              generational_interval_stdev_error=Config.REPRODUCTION_GENERATIONAL_INTERVAL_STDEV_ERROR,
+                              samples=Config.REPRODUCTION_SAMPLES, seed=None):
+    """
+    Credible bands of the Re of daily_reproduction_numbers, from Monte Carlo samples of the growth rate of every day
+    and of the generational interval. All samples are calculated at once as an array of samples by days.
+
+    Parameters
+    ----------
+    cases: array-like
+        daily cases, newest first
+    generational_interval_error: float, optional
+        standard error of the mean generational interval
+    generational_interval_stdev_error: float, optional
+        standard error of the standard deviation of the generational interval
+    samples: int, optional
+        number of samples, defaults to Config.REPRODUCTION_SAMPLES
+    seed: int, optional
+        seed of the random generator, the same seed gives the same bands
+
+    :return:
+    dict with an array of Re per quantile of BAND_QUANTILES, newest first. NaN where no fit is possible
+    """
+    window_size = round(incubation_time)
+    cases = np.asarray(cases, dtype=np.float64)
+    no_windows = max(len(cases) - window_size, 0)
+    if no_windows == 0:
+        return {name: np.empty(0) for name in BAND_QUANTILES}
+
+    # The growth rate of every day is drawn around the log linear fit with the standard error of the fit
+    windows = sliding_window_view(cases, window_size)[:no_windows]
+    valid = np.isfinite(windows) & (windows > 0)
+    exponents, exponent_errors = weighted_least_squares(np.log(np.where(valid, windows, 1.0)),
+                                                        window_x_values(window_size),
+                                                        np.where(valid, windows, 0.0) ** 2)[2:]
+    random = np.random.default_rng(seed)
+    growth_rate_samples = np.exp(exponents + exponent_errors * random.standard_normal((samples, no_windows))) - 1
+
+    # One generational interval per sample, shared by all days of the sample
+    interval_samples = np.maximum(random.normal(generational_interval, generational_interval_error, (samples, 1)), 0)
+    interval_stdev_samples = np.maximum(random.normal(generational_interval_stdev, generational_interval_stdev_error,
+                                                      (samples, 1)), 0)
+
+    reproduction_number_samples = reproduction_numbers(growth_rate_samples, interval_samples, interval_stdev_samples)
+    bands = np.quantile(reproduction_number_samples, list(BAND_QUANTILES.values()), axis=0)
+    return dict(zip(BAND_QUANTILES, bands))
+
+
+@metrics.instrumented_stage('reproduction')
+def calculate_regional_reproduction_numbers(since=None, method=LOG_LINEAR, max_workers=Config.REPRODUCTION_WORKERS,
+                                            batch_size=Config.INGEST_BATCH_SIZE, build_id=None):
+    """
+    Calculates the daily Re of the nation and every province and municipality from the series cache
+    and stores it in DutchReproductionNumbers. The regions are spread over a pool of processes,
+    which map the series themselves, only the results are sent back to be written.
+
+    Parameters
+    ----------
+    since: datetime.date, optional
+        only replace the reproduction numbers on or after this date, defaults to replacing all
+    method: str, optional
+        growth rate method, see growth_rates
+    max_workers: int, optional
+        number of processes, defaults to Config.REPRODUCTION_WORKERS. Below 1 the regions are calculated in this
+        process
+    build_id: str, optional
+        build of the series cache to calculate from, defaults to the current build
+
+    :return:
+    number of reproduction numbers stored
+    """
+    build_id = build_id or series_cache.get_current_build()
+    if not build_id:
+        return 0
+
+    jobs = [(build_id, 'national', None, method, since)]
+    for region_type in ('province', 'municipality'):
+        jobs.extend((build_id, region_type, region, method, since)
+                    for region in series_cache.list_regions(region_type, build_id))
+
+    session = database_session()
+    delete_query = session.query(DutchReproductionNumbers)
+    if since:
+        delete_query = delete_query.filter(DutchReproductionNumbers.reported_date >= since)
+    delete_query.delete(synchronize_session=False)
+
+    insert_statement = DutchReproductionNumbers.__table__.insert()
+    no_rows = 0
+    with contextlib.ExitStack() as pool:
+        if max_workers < 1:
+            region_rows = map(calculate_region, jobs)
+        else:
+            # The refresh runs this in its writer thread, so the workers are not forked, see util.create_process_pool
+            executor = pool.enter_context(util.create_process_pool(max_workers, preload=['reproduction']))
+            # Every worker gets a few chunks of regions, so the jobs and their rows are pickled in few messages
+            region_rows = executor.map(calculate_region, jobs, chunksize=max(1, len(jobs) // (max_workers * 4)))
+        for batch in util.batched(itertools.chain.from_iterable(region_rows), batch_size):
+            session.execute(insert_statement, batch)
+            no_rows += len(batch)
+    metrics.add_rows(no_rows)
+
+    session.commit()
+    session.close()
+    return no_rows
+
+
+def calculate_region(job):
+    """Runs in a worker process, returns the rows to store for one region"""
+    build_id, region_type, region, method, since = job
+    series = series_cache.load_series(region_type, region, columns=('infections',), build_id=build_id)
+    dates = series.dates[::-1]
+    growth_rate = growth_rates(series.columns[0][::-1], round(Config.REPRODUCTION_INCUBATION_TIME), method)
+    rep_no_list = reproduction_numbers(growth_rate, Config.REPRODUCTION_GENERATIONAL_INTERVAL,
+                                       Config.REPRODUCTION_GENERATIONAL_INTERVAL_STDEV)
+
+    rows = []
+    for reported_date, region_growth_rate, reproduction_no in zip(dates.tolist(), growth_rate.tolist(),
+                                                                   rep_no_list.tolist()):
+        if since and reported_date < since:
+            break
+        rows.append({'region_type': region_type, 'region': region or '', 'reported_date': reported_date,
+                     'growth_rate': None if np.isnan(region_growth_rate) else region_growth_rate,
+                     'reproduction_no': None if np.isnan(reproduction_no) else reproduction_no})
+    return rows
@@ -0,0 +1,187 @@
+"""
+Columnar cache of the daily totals, written at the end of a refresh so plots can be made without the database.
+
+Every region gets a directory with a dates.npy file holding the days in ascending order and one .npy file
+per metric. The files are memory-mapped when loaded, so loading a series does not copy or parse any data.
+"""
+from config import Config
+from database import database_session
+from database.data_model import DutchDailyTotals, DutchProvinceDailyTotals, DutchMunicipalityDailyTotals, DutchRegions
+from urllib.parse import quote, unquote
+import dutch_statistics
+import metrics
+import numpy as np
+import itertools
+import shutil
+import time
+import os
+
+CURRENT_BUILD_FILE = 'CURRENT'
+REGION_METRICS = dutch_statistics.REGION_METRICS
+NATIONAL_METRICS = REGION_METRICS + ('infections_by_date', 'prevalence_avg', 'reproduction_no')
+
+
+class TimeSeries(object):
+    """
+    Daily series of a region with the dates in ascending order and one array per column.
+    Iterating over a series yields rows like the dutch_statistics queries do: the date and the columns, newest first.
+    """
+
+    def __init__(self, dates, columns, key=None, region=None, column_names=None):
+        self.dates = dates
+        self.columns = columns
+        # Identifies the build, region and metrics the series was loaded from
+        self.key = key
+        # Region type and name of the region, the name is None for the nation, and the metrics of the columns
+        self.region = region
+        self.column_names = column_names
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __iter__(self):
+        for index in range(len(self.dates) - 1, -1, -1):
+            values = (column[index].item() for column in self.columns)
+            # Missing values are stored as NaN, the queries return None
+            yield (self.dates[index].item(),) + tuple(None if value != value else value for value in values)
+
+    def date_range(self, start_date, end_date):
+        """Returns the start and end index of the dates within the range with a binary search"""
+        start_index = np.searchsorted(self.dates, np.datetime64(start_date, 'D'), side='left')
+        end_index = np.searchsorted(self.dates, np.datetime64(end_date, 'D'), side='right')
+        return start_index, end_index
+
+
+@metrics.instrumented_stage('series_cache')
+def write_series_cache(activate=True):
+    """
+    Writes the daily totals of all regions to a new build directory and returns its id.
+    The build becomes the current build, unless activate is false, then activate_build does that later.
+    """
+    build_id = str(time.time_ns())
+    build_directory = os.path.join(Config.SERIES_CACHE_DIR, build_id)
+    session = database_session()
+
+    national_totals = session.query(DutchDailyTotals.reported_date,
+                                    *[getattr(DutchDailyTotals, metric) for metric in NATIONAL_METRICS]) \
+        .order_by(DutchDailyTotals.reported_date).all()
+    write_region(os.path.join(build_directory, 'national'), national_totals, NATIONAL_METRICS)
+
+    # Municipality totals are stored per region id, the cache is organised by name
+    for region_type, totals_model, region_column in (
+            ('province', DutchProvinceDailyTotals, DutchProvinceDailyTotals.province),
+            ('municipality', DutchMunicipalityDailyTotals, DutchRegions.municipality)):
+        region_totals = session.query(region_column, totals_model.reported_date,
+                                      *[getattr(totals_model, metric) for metric in REGION_METRICS]) \
+            .order_by(region_column, totals_model.reported_date)
+        if totals_model is DutchMunicipalityDailyTotals:
+            region_totals = region_totals.join(DutchRegions, DutchRegions.id == totals_model.region_id)
+        for region, rows in itertools.groupby(region_totals, key=lambda row: row[0]):
+            write_region(region_directory(build_directory, region_type, region), [row[1:] for row in rows],
+                         REGION_METRICS)
+    session.close()
+
+    if activate:
+        activate_build(build_id)
+    return build_id
+
+
+def activate_build(build_id):
+    # Switch to the new build in one step, readers that still map the old files keep them until they are done
+    current_build_path = os.path.join(Config.SERIES_CACHE_DIR, CURRENT_BUILD_FILE)
+    with open(current_build_path + '.tmp', mode='w') as current_build_file:
+        current_build_file.write(build_id)
+    os.replace(current_build_path + '.tmp', current_build_path)
+
+    for directory in os.listdir(Config.SERIES_CACHE_DIR):
+        if directory not in (build_id, CURRENT_BUILD_FILE):
+            shutil.rmtree(os.path.join(Config.SERIES_CACHE_DIR, directory), ignore_errors=True)
+    return build_id
+
+
+def write_region(directory, rows, columns):
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'dates.npy'), np.array([row[0] for row in rows], dtype='datetime64[D]'))
+    for index, column_name in enumerate(columns, start=1):
+        values = [row[index] for row in rows]
+        # Counts stay integers unless values are missing, which are stored as NaN
+        if all(isinstance(value, int) for value in values):
+            column = np.array(values, dtype=np.int64)
+        else:
+            column = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        np.save(os.path.join(directory, column_name + '.npy'), column)
+
+
+def region_directory(build_directory, region_type, region=None):
+    if region_type == 'national':
+        return os.path.join(build_directory, 'national')
+    return os.path.join(build_directory, region_type, quote(region, safe=''))
+
+
+def list_regions(region_type, build_id=None):
+    """Returns the names of all provinces or municipalities in the cache"""
+    build_id = build_id or get_current_build()
+    if not build_id:
+        return []
+    directory = os.path.join(Config.SERIES_CACHE_DIR, build_id, region_type)
+    return sorted(unquote(region) for region in os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def get_current_build():
+    try:
+        with open(os.path.join(Config.SERIES_CACHE_DIR, CURRENT_BUILD_FILE)) as current_build_file:
+            return current_build_file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def load_series(region_type, region=None, columns=REGION_METRICS, build_id=None):
+    """
+    Memory-maps the series of a region, returns None when no cache has been written yet
+
+    Parameters
+    ----------
+    region_type: str
+        national, province or municipality
+    region: str, optional
+        name of the province or municipality
+    columns: tuple of str, optional
+        the columns of the series, in order
+    """
+    build_id = build_id or get_current_build()
+    if not build_id:
+        return None
+
+    directory = region_directory(os.path.join(Config.SERIES_CACHE_DIR, build_id), region_type, region)
+    columns = tuple(columns)
+    key = '/'.join([build_id, region_type, region or '', ','.join(columns)])
+    if not os.path.isdir(directory):
+        return TimeSeries(np.array([], dtype='datetime64[D]'), [np.array([]) for _ in columns], key,
+                          (region_type, region), columns)
+    return TimeSeries(np.load(os.path.join(directory, 'dates.npy'), mmap_mode='r'),
+                      [np.load(os.path.join(directory, column + '.npy'), mmap_mode='r') for column in columns], key,
+                      (region_type, region), columns)
+
+
+def sum_dutch_total_infections(municipality, province):
+    """Cached counterpart of dutch_statistics.sum_dutch_total_infections"""
+    if municipality:
+        series = load_series('municipality', municipality)
+    elif province:
+        series = load_series('province', province)
+    else:
+        series = load_series('national')
+    return series if series is not None else dutch_statistics.sum_dutch_total_infections(municipality, province)
+
+
+def get_infections_by_date():
+    """Cached counterpart of dutch_statistics.get_infections_by_date"""
+    series = load_series('national', columns=('infections_by_date', 'hospitalised', 'deaths',
+                                              'hospitalised_nice_proven'))
+    return series if series is not None else dutch_statistics.get_infections_by_date()
+
+
+def get_daily_reproduction_number():
+    """Cached counterpart of dutch_statistics.get_daily_reproduction_number"""
+    series = load_series('national', columns=('reproduction_no',))
+    return series if series is not None else dutch_statistics.get_daily_reproduction_number()
@@ -0,0 +1,35 @@
+"""
+The database and the data folders are configured on import, so they point to a scratch folder before the tests
+import the modules under test. Everything runs in the test process, without parse, Re or render workers.
+"""
+import os
+import shutil
+import tempfile
+
+work_directory = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(work_directory, 'test.db')
+os.environ['DATA_FILES_DIR'] = os.path.join(work_directory, 'data_files')
+os.environ['SERIES_CACHE_DIR'] = os.path.join(work_directory, 'series')
+os.environ['PARSE_WORKERS'] = '0'
+os.environ['RENDER_WORKERS'] = '0'
+os.environ['REPRODUCTION_WORKERS'] = '0'
+
+import pytest
+from benchmarks import synthetic_data
+from config import Config
+from database import util as database_util
+import main
+
+
+@pytest.fixture
+def refreshed_data():
+    """Synthetic data files and a database with a full rebuild of them"""
+    synthetic_data.generate(Config.DATA_FILES_DIR, no_municipalities=6, no_days=40, cases_per_day=40)
+    database_util.create_data_model()
+    Config.PLOT_DIR = work_directory
+    main.refresh_dutch_statistics(full_rebuild=True, download=False)
+    return Config.DATA_FILES_DIR
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(work_directory, ignore_errors=True)
@@ -0,0 +1,38 @@
+import pytest
+from benchmarks import synthetic_data
+from frontend import app
+
+
+@pytest.fixture
+def client(refreshed_data):
+    return app.test_client()
+
+
+def test_statistics_without_flags_use_form_defaults(client):
+    response = client.get('/api/statistics?start_date=' + synthetic_data.START_DATE.isoformat())
+
+    assert response.status_code == 200
+    statistics = response.get_json()
+    assert list(statistics['series']) == ['cases']
+    assert len(statistics['series']['cases']) == len(statistics['dates']) > 0
+    assert list(statistics['curves']) == ['cases']
+    assert statistics['linear_regression'] is None
+
+
+def test_statistics_flags_override_defaults(client):
+    response = client.get('/api/statistics?start_date=%s&plot_deaths=y&linear_regres=y&exp_curve='
+                          % synthetic_data.START_DATE.isoformat())
+
+    statistics = response.get_json()
+    assert list(statistics['series']) == ['cases', 'deaths']
+    assert statistics['curves'] == {}
+    assert len(statistics['linear_regression']) == len(statistics['predicted_dates'])
+
+
+@pytest.mark.parametrize('query', ['/api/statistics?start_date=2030-01-01', '/api/statistics?municipality=Unknown',
+                                   '/api/reproduction?start_date=2030-01-01'])
+def test_date_range_without_data_is_empty(client, query):
+    response = client.get(query)
+
+    assert response.status_code == 200
+    assert response.get_json()['dates'] == []
@@ -0,0 +1,31 @@
+import csv
+import os
+import pytest
+from benchmarks import synthetic_data
+from config import Config
+import cli
+
+
+def test_plot_writes_output_file(refreshed_data, tmp_path, monkeypatch):
+    # Relative to the working directory, which need not contain the plot folder
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Config, 'PLOT_DIR', 'missing/plot/folder')
+    cli.main(['plot', '--province', synthetic_data.PROVINCES[0], '--start-date',
+              synthetic_data.START_DATE.isoformat(), '--output', 'plot.png'])
+
+    assert (tmp_path / 'plot.png').read_bytes().startswith(b'\x89PNG')
+    assert os.listdir(tmp_path) == ['plot.png']
+
+
+def test_plot_without_statistics_in_range_exits(refreshed_data, tmp_path):
+    with pytest.raises(SystemExit, match='No statistics'):
+        cli.main(['plot', '--start-date', '2030-01-01', '--output', str(tmp_path / 'plot.png')])
+
+
+def test_export_writes_csv(refreshed_data, tmp_path):
+    output = tmp_path / 'export.csv'
+    cli.main(['export', '--province', synthetic_data.PROVINCES[0], '--output', str(output)])
+
+    rows = list(csv.DictReader(output.open()))
+    assert rows and set(rows[0]) == {'region_type', 'region', 'date', 'infections', 'hospitalised', 'deaths',
+                                     'hospitalised_nice_proven'}
@@ -0,0 +1,15 @@
+import pytest
+from database import ReadOnlyDatabaseError, database_session, engine, writing_to
+from database.data_model import DutchStatistics
+import dutch_statistics
+
+
+def test_writes_outside_writing_to_raise_read_only_error(refreshed_data):
+    with pytest.raises(ReadOnlyDatabaseError):
+        dutch_statistics.get_rivm_stats()
+
+    with writing_to(engine):
+        no_rows = dutch_statistics.get_rivm_stats()
+    session = database_session()
+    assert session.query(DutchStatistics).count() == no_rows
+    session.close()
@@ -0,0 +1,115 @@
+import hashlib
+import http.server
+import os
+import socket
+import threading
+import pytest
+from config import Endpoints
+import callouts
+import main
+import metrics
+import util
+
+CONTENT = b'[{"Date": "2021-03-01"}]'
+ETAG = '"version-1"'
+LAST_MODIFIED = 'Mon, 01 Mar 2021 10:00:00 GMT'
+
+
+class DataFileHandler(http.server.BaseHTTPRequestHandler):
+    """Serves CONTENT like the data endpoints do, answering 304 when the client already has it"""
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == ETAG or self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        self.send_header('Content-Length', str(len(CONTENT)))
+        self.end_headers()
+        self.wfile.write(CONTENT)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    data_server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), DataFileHandler)
+    data_server.requests = []
+    thread = threading.Thread(target=data_server.serve_forever, daemon=True)
+    thread.start()
+    yield data_server
+    data_server.shutdown()
+    data_server.server_close()
+
+
+def url(data_server):
+    return 'http://127.0.0.1:%d/data.json' % data_server.server_address[1]
+
+
+def closed_port_url():
+    with socket.socket() as unused_socket:
+        unused_socket.bind(('127.0.0.1', 0))
+        return 'http://127.0.0.1:%d/data.json' % unused_socket.getsockname()[1]
+
+
+def test_download_writes_file(server, tmp_path):
+    path = str(tmp_path / 'data.json')
+    result = callouts.download_covid_stats(url(server), path)
+
+    assert result == {'status': 'modified', 'etag': ETAG, 'last_modified': LAST_MODIFIED,
+                      'sha256': hashlib.sha256(CONTENT).hexdigest()}
+    assert open(path, mode='rb').read() == CONTENT
+    assert list(tmp_path.iterdir()) == [tmp_path / 'data.json']
+
+
+@pytest.mark.parametrize('etag, last_modified', [(ETAG, None), (None, LAST_MODIFIED), (ETAG, LAST_MODIFIED)])
+def test_unchanged_download_keeps_file(server, tmp_path, etag, last_modified):
+    path = tmp_path / 'data.json'
+    path.write_bytes(b'previous')
+    result = callouts.download_covid_stats(url(server), str(path), etag=etag, last_modified=last_modified)
+
+    assert result == {'status': 'not_modified', 'etag': etag, 'last_modified': last_modified}
+    assert server.requests[0].get('If-None-Match') == etag
+    assert server.requests[0].get('If-Modified-Since') == last_modified
+    assert path.read_bytes() == b'previous'
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_failed_download_keeps_file(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_bytes(b'previous')
+    result = callouts.download_covid_stats(closed_port_url(), str(path), etag=ETAG)
+
+    assert result == {'status': 'failed'}
+    assert path.read_bytes() == b'previous'
+    assert list(tmp_path.iterdir()) == [path]
+
+
+@pytest.fixture
+def unreachable_endpoints(monkeypatch):
+    endpoints = util.get_endpoints()
+    for filename in endpoints:
+        monkeypatch.setattr(Endpoints, filename, closed_port_url())
+    return sorted(endpoints)
+
+
+def test_refresh_reports_failed_downloads(refreshed_data, unreachable_endpoints, caplog):
+    states = {}
+    main.refresh_dutch_statistics(progress=states.__setitem__)
+
+    assert states['download'] == 'done, failed: ' + ', '.join(unreachable_endpoints)
+    assert states['publish'] == 'skipped'
+    assert metrics.stage_metrics['download']['failed_downloads'] == len(unreachable_endpoints)
+    assert 'covid_refresh_stage_failed_downloads{stage="download"} 6.0' in metrics.prometheus_text()
+    assert len([record for record in caplog.records if record.levelname == 'WARNING' and
+                record.name == 'callouts']) == len(unreachable_endpoints)
+
+
+def test_full_rebuild_fails_without_data_file(refreshed_data, unreachable_endpoints):
+    os.remove(util.data_file_path('RIVM_CASES'))
+    with pytest.raises(RuntimeError, match='RIVM_CASES'):
+        main.refresh_dutch_statistics(full_rebuild=True)
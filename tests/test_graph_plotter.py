@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from benchmarks import synthetic_data
+from config import Config
+import forecast
+import graph_plotter
+import series_cache
+
+NO_DAYS_TO_PREDICT = 7
+
+
+@pytest.fixture
+def live_fits(monkeypatch):
+    """Records the number of series of every trend fitted while plotting"""
+    fitted_series = []
+    fit_trends = forecast.fit_trends
+
+    def record_fit(windows):
+        fitted_series.append(len(windows))
+        return fit_trends(windows)
+
+    monkeypatch.setattr(forecast, 'fit_trends', record_fit)
+    return fitted_series
+
+
+def plotted_statistics(**arguments):
+    return graph_plotter.statistics_series(series_cache.sum_dutch_total_infections(None, None),
+                                           start_date=synthetic_data.START_DATE, no_days_to_predict=NO_DAYS_TO_PREDICT,
+                                           plot_deaths=True, **arguments)
+
+
+def assert_curve_covers_window(statistics, window):
+    # The predicted days come first, then the plotted days newest first
+    covered_days = NO_DAYS_TO_PREDICT + window
+    for values in [statistics['linear_regression']] + [curve['optimum'] for curve in statistics['curves'].values()]:
+        assert len(values) == len(statistics['predicted_dates'])
+        assert np.isfinite(values[:covered_days]).all()
+        assert np.isnan(values[covered_days:]).all()
+
+
+def test_latest_days_use_stored_forecasts(refreshed_data, live_fits, monkeypatch):
+    stored = plotted_statistics()
+    assert live_fits == []
+    assert_curve_covers_window(stored, Config.FORECAST_WINDOW)
+
+    # A live fit of the same days finds the stored trends
+    data_set = series_cache.sum_dutch_total_infections(None, None)
+    monkeypatch.setattr(data_set, 'region', None)
+    live = graph_plotter.statistics_series(data_set, start_date=synthetic_data.START_DATE,
+                                           no_days_to_predict=NO_DAYS_TO_PREDICT, plot_deaths=True)
+    assert live_fits == [4]
+    np.testing.assert_allclose(live['linear_regression'], stored['linear_regression'])
+    for name, curve in stored['curves'].items():
+        np.testing.assert_allclose(live['curves'][name]['optimum'], curve['optimum'])
+
+
+def test_other_windows_are_fitted_live(refreshed_data, live_fits, monkeypatch):
+    # The plot ends before the last day the trends were fitted to
+    end_date = series_cache.sum_dutch_total_infections(None, None).dates[-2].item()
+    assert_curve_covers_window(plotted_statistics(end_date=end_date), Config.FORECAST_WINDOW)
+    assert live_fits == [4]
+
+    # The plot asks for another window than the refresh fitted
+    monkeypatch.setattr(Config, 'FORECAST_WINDOW', Config.FORECAST_WINDOW - 4)
+    assert_curve_covers_window(plotted_statistics(), Config.FORECAST_WINDOW)
+    assert live_fits == [4, 4]
@@ -0,0 +1,108 @@
+import datetime
+import json
+from benchmarks import synthetic_data
+from database import database_session, engine, writing_to
+from database.data_model import DataSourceState, DutchStatistics, DutchDailyTotals
+import main
+import util
+
+NICE_COLUMNS = ['hospitalised_nice_proven', 'hospitalised_nice_suspected', 'cumulative_hospitalised_nice']
+
+
+def read_nice_files():
+    return {filename: util.load_data_file(filename) for filename in ('NICE_DAILY_INTAKE', 'NICE_CUMULATIVE_INTAKE')}
+
+
+def write_nice_files(nice_files):
+    for filename, content in nice_files.items():
+        with open(util.data_file_path(filename), mode='w') as nice_file:
+            json.dump(content, nice_file)
+
+
+def nice_figures():
+    session = database_session()
+    statistics = sorted((record.reported_date, record.region_id) + tuple(getattr(record, column) for column in
+                                                                          NICE_COLUMNS)
+                        for record in session.query(DutchStatistics))
+    totals = sorted((record.reported_date, record.hospitalised_nice_proven)
+                    for record in session.query(DutchDailyTotals))
+    session.close()
+    return statistics, totals
+
+
+def test_incremental_nice_refresh_matches_full_rebuild(refreshed_data):
+    nice_files = read_nice_files()
+    # NICE lags three more days behind RIVM than usual
+    write_nice_files({'NICE_DAILY_INTAKE': [intake[:-3] for intake in nice_files['NICE_DAILY_INTAKE']],
+                      'NICE_CUMULATIVE_INTAKE': nice_files['NICE_CUMULATIVE_INTAKE'][:-3]})
+    main.refresh_dutch_statistics(full_rebuild=True, download=False)
+
+    # NICE catches up and revises the intake of a recent day
+    nice_files['NICE_DAILY_INTAKE'][0][-6]['value'] += 5
+    for intake_count in nice_files['NICE_CUMULATIVE_INTAKE'][-6:]:
+        intake_count['value'] += 5
+    write_nice_files(nice_files)
+    main.refresh_dutch_statistics(download=False)
+    incremental_figures = nice_figures()
+
+    main.refresh_dutch_statistics(full_rebuild=True, download=False)
+    assert incremental_figures == nice_figures()
+    newest_intake_count = nice_files['NICE_CUMULATIVE_INTAKE'][-1]
+    assert [cumulative for reported_date, _, _, _, cumulative in incremental_figures[0]
+            if reported_date.isoformat() == newest_intake_count['date']][0] == newest_intake_count['value']
+
+
+def infections_by_date():
+    session = database_session()
+    statistics = sorted((record.reported_date, record.region_id, record.infections_by_date)
+                        for record in session.query(DutchStatistics))
+    totals = sorted((record.reported_date, record.infections_by_date) for record in session.query(DutchDailyTotals))
+    session.close()
+    return statistics, totals
+
+
+def test_incremental_cases_refresh_matches_full_rebuild(refreshed_data):
+    rivm_cases = list(util.iterate_json_array(util.data_file_path('RIVM_CASES')))
+    dropped_date = sorted({case['Date_statistics'] for case in rivm_cases})[5]
+    # The next cases file no longer has cases on one of the days
+    next_file_date = datetime.date.fromisoformat(rivm_cases[0]['Date_file'][0:10]) + datetime.timedelta(days=1)
+    synthetic_data.write_json_array(util.data_file_path('RIVM_CASES'),
+                                    (dict(case, Date_file=next_file_date.isoformat() + ' 10:00:00')
+                                     for case in rivm_cases if case['Date_statistics'] != dropped_date))
+    main.refresh_dutch_statistics(download=False)
+    incremental_figures = infections_by_date()
+
+    main.refresh_dutch_statistics(full_rebuild=True, download=False)
+    assert incremental_figures == infections_by_date()
+    assert dict(incremental_figures[1])[datetime.date.fromisoformat(dropped_date)] is None
+
+
+def statistics_rows():
+    session = database_session()
+    rows = sorted((record.reported_date, record.region_id, record.cumulative_infections)
+                  for record in session.query(DutchStatistics))
+    session.close()
+    return rows
+
+
+def test_refresh_without_high_water_marks_replaces_statistics(refreshed_data):
+    rivm_cumulative = util.load_data_file('RIVM_CUMULATIVE')
+    newest_date = max(record['Date_of_report'] for record in rivm_cumulative)
+    next_date = (datetime.date.fromisoformat(newest_date[0:10]) + datetime.timedelta(days=1)).isoformat()
+    # A new day is reported to a database whose high-water marks are unknown, like one upgraded by migrations
+    synthetic_data.write_json_array(util.data_file_path('RIVM_CUMULATIVE'), rivm_cumulative + [
+            dict(record, Date_of_report=next_date + newest_date[10:]) for record in rivm_cumulative
+            if record['Date_of_report'] == newest_date])
+    with writing_to(engine):
+        session = database_session()
+        session.query(DataSourceState).delete()
+        session.commit()
+        session.close()
+    main.refresh_dutch_statistics(download=False)
+    refreshed_rows = statistics_rows()
+
+    assert len(refreshed_rows) == len({(reported_date, region_id) for reported_date, region_id, _ in refreshed_rows})
+    assert len(refreshed_rows) == len(rivm_cumulative) + len([record for record in rivm_cumulative
+                                                               if record['Date_of_report'] == newest_date])
+    main.refresh_dutch_statistics(full_rebuild=True, download=False)
+    assert refreshed_rows == statistics_rows()
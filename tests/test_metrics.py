@@ -0,0 +1,34 @@
+import threading
+import tracemalloc
+from config import Config
+import metrics
+
+
+def test_overlapping_stages_share_the_trace(monkeypatch):
+    monkeypatch.setattr(Config, 'METRICS_TRACE_MEMORY', True)
+    first_started = threading.Event()
+    second_started = threading.Event()
+    first_finished = threading.Event()
+
+    def second_stage():
+        first_started.wait()
+        with metrics.measure_stage('test_second'):
+            second_started.set()
+            first_finished.wait()
+            # Allocated after the first stage stopped, which must not have stopped this trace
+            memory = bytearray(1024 * 1024)
+            del memory
+
+    thread = threading.Thread(target=second_stage)
+    thread.start()
+    with metrics.measure_stage('test_first'):
+        first_started.set()
+        second_started.wait()
+        memory = bytearray(1024 * 1024)
+        del memory
+    first_finished.set()
+    thread.join()
+
+    assert metrics.stage_metrics['test_first']['traced_peak_bytes'] >= 1024 * 1024
+    assert metrics.stage_metrics['test_second']['traced_peak_bytes'] >= 1024 * 1024
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,90 @@
+import datetime
+import pytest
+from sqlalchemy import Boolean, Column, Date, Float, Integer, MetaData, String, Table, inspect, select
+from database import data_model, database_session, engine, writing_to
+from database.data_model import DutchStatistics, DutchRegions, DutchCaseCounts, DutchDailyTotals, \
+    DutchReproductionNumbers
+import dutch_statistics
+import main
+
+STATISTICS_COLUMNS = [column.name for column in DutchStatistics.__table__.columns
+                      if column.name not in ('id', 'region_id', 'reported_date')]
+CASE_COUNT_COLUMNS = [column.name for column in DutchCaseCounts.__table__.columns]
+
+
+def pre_017_tables():
+    """The layout the tables had before the regions were normalised and the dates became day numbers"""
+    metadata = MetaData()
+    Table('DutchStatistics', metadata, Column('id', Integer, primary_key=True, autoincrement=True),
+          Column('province', String, index=True), Column('municipality', String, index=True),
+          Column('city', String, index=True), Column('reported_date', Date, index=True),
+          *[Column(name, Integer) for name in STATISTICS_COLUMNS])
+    Table('DutchCaseCounts', metadata, Column('id', Integer, primary_key=True, autoincrement=True),
+          Column('reported_date', Date), Column('statistic_date', Date, index=True), Column('province', String),
+          Column('municipal_health_service', String), Column('age_group', String), Column('sex', String),
+          Column('hospitalised', Boolean), Column('deceased', Boolean), Column('cases', Integer))
+    Table('DutchDailyTotals', metadata, Column('reported_date', Date, primary_key=True),
+          Column('infections', Integer))
+    Table('DutchReproductionNumbers', metadata, Column('region_type', String, primary_key=True),
+          Column('region', String, primary_key=True), Column('reported_date', Date, primary_key=True),
+          Column('growth_rate', Float), Column('reproduction_no', Float))
+    Table('DataSourceState', metadata, Column('source', String, primary_key=True),
+          Column('high_water_mark', Date))
+    return metadata
+
+
+def stored_rows():
+    session = database_session()
+    statistics = sorted((record.id, region.province, region.municipality, record.reported_date) +
+                        tuple(getattr(record, name) for name in STATISTICS_COLUMNS)
+                        for record, region in session.query(DutchStatistics, DutchRegions).join(DutchRegions))
+    case_counts = sorted(tuple(getattr(record, name) for name in CASE_COUNT_COLUMNS)
+                         for record in session.query(DutchCaseCounts))
+    totals = sorted((record.reported_date, record.infections, record.hospitalised, record.deaths)
+                    for record in session.query(DutchDailyTotals))
+    reproduction_numbers = sorted((record.region_type, record.region, record.reported_date, record.reproduction_no)
+                                  for record in session.query(DutchReproductionNumbers))
+    session.close()
+    return statistics, case_counts, totals, reproduction_numbers
+
+
+def test_upgrade_converts_pre_017_database(refreshed_data):
+    statistics, case_counts, totals, reproduction_numbers = stored_rows()
+    data_model.Base.metadata.drop_all(bind=engine)
+    legacy_metadata = pre_017_tables()
+    legacy_metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(legacy_metadata.tables['DutchStatistics'].insert(), [
+                dict(zip(['id', 'province', 'municipality', 'reported_date'] + STATISTICS_COLUMNS, row))
+                for row in statistics])
+        connection.execute(legacy_metadata.tables['DutchCaseCounts'].insert(),
+                           [dict(zip(CASE_COUNT_COLUMNS, row)) for row in case_counts])
+        connection.execute(legacy_metadata.tables['DutchReproductionNumbers'].insert(),
+                           [{'region_type': 'national', 'region': '', 'reported_date': datetime.date(2020, 3, 1)}])
+        # Dates used to be stored as text
+        assert connection.exec_driver_sql('SELECT reported_date FROM "DutchStatistics" WHERE id = ?',
+                                          (statistics[0][0],)).scalar() == statistics[0][3].isoformat()
+
+    main.upgrade_database()
+
+    assert stored_rows() == (statistics, case_counts, totals, reproduction_numbers)
+    inspector = inspect(engine)
+    for table_name in ('DutchStatistics', 'DutchCaseCounts', 'DutchDailyTotals', 'DutchReproductionNumbers'):
+        assert isinstance(next(column['type'] for column in inspector.get_columns(table_name)
+                               if column['name'] == 'reported_date'), Integer)
+    assert 'DutchStatistics_old' not in inspector.get_table_names()
+
+
+def test_municipality_in_two_provinces_is_refused(refreshed_data):
+    with writing_to(engine):
+        session = database_session()
+        session.add(DutchRegions(province='Utrecht', municipality='Gemeente 0'))
+        session.commit()
+        session.close()
+
+    session = database_session()
+    with pytest.raises(ValueError, match='Gemeente 0'):
+        dutch_statistics.get_municipality_region_id(session, 'Gemeente 0')
+    assert dutch_statistics.get_municipality_region_id(session, 'Gemeente 1') is not None
+    assert dutch_statistics.get_municipality_region_id(session, 'Unknown') is None
+    session.close()
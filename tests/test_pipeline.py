@@ -0,0 +1,29 @@
+from config import Config
+from database import database_session
+from database.data_model import DutchStatistics, DutchDailyTotals
+import main
+import metrics
+import pipeline
+
+
+def stored_statistics():
+    session = database_session()
+    statistics = sorted((record.reported_date, record.region_id, record.cumulative_infections,
+                         record.hospitalised_nice_proven) for record in session.query(DutchStatistics))
+    totals = sorted((record.reported_date, record.infections, record.hospitalised)
+                    for record in session.query(DutchDailyTotals))
+    session.close()
+    return statistics, totals
+
+
+def test_refresh_with_parse_workers(refreshed_data, monkeypatch):
+    parsed_in_thread = stored_statistics()
+    monkeypatch.setattr(Config, 'PARSE_WORKERS', 2)
+    with pipeline.create_parse_pool() as parse_pool:
+        assert parse_pool._mp_context.get_start_method() != 'fork'
+
+    metrics.stage_metrics.pop('rivm_parse', None)
+    main.refresh_dutch_statistics(full_rebuild=True, download=False)
+    assert stored_statistics() == parsed_in_thread
+    # The records of the workers are sent back to the refreshing process
+    assert metrics.stage_metrics['rivm_parse']['bytes_read'] > 0
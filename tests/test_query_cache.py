@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pytest
+from config import Config
+import query_cache
+import util
+
+query_calls = []
+
+
+@query_cache.cached_query
+def read_series(region):
+    query_calls.append(region)
+    return {'dates': np.arange(3), 'regions': [region], 'values': np.ones((1, 3))}
+
+
+@pytest.fixture
+def empty_cache(monkeypatch):
+    os.makedirs(Config.DATA_FILES_DIR, exist_ok=True)
+    monkeypatch.setattr(Config, 'QUERY_CACHE_DIR', None)
+    query_cache.clear()
+    query_calls.clear()
+    yield
+    query_cache.clear()
+
+
+def test_cached_result_cannot_be_changed_by_a_caller(empty_cache):
+    result = read_series('Utrecht')
+    with pytest.raises(ValueError):
+        result['values'][0, 0] = 5
+    result['regions'].append('Zeeland')
+    result['dates'] = None
+
+    cached_result = read_series('Utrecht')
+    assert query_calls == ['Utrecht']
+    assert cached_result['regions'] == ['Utrecht']
+    assert cached_result['values'].tolist() == [[1, 1, 1]]
+    assert cached_result['dates'].tolist() == [0, 1, 2]
+
+
+def test_results_are_shared_on_disk(empty_cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'QUERY_CACHE_DIR', str(tmp_path))
+    statistics = query_cache.get_statistics()
+    read_series('Utrecht')
+    assert len(os.listdir(tmp_path / str(util.get_data_version()))) == 1
+
+    # Another process has nothing in memory, it reads the result the first process stored
+    query_cache.clear()
+    result = read_series('Utrecht')
+    assert query_calls == ['Utrecht']
+    assert result['values'].tolist() == [[1, 1, 1]] and not result['values'].flags.writeable
+    assert query_cache.get_statistics()['disk_hits'] == statistics['disk_hits'] + 1
+    assert query_cache.get_statistics()['misses'] == statistics['misses'] + 1
+
+    # A corrupt file is a miss
+    query_cache.clear()
+    for result_file in (tmp_path / str(util.get_data_version())).iterdir():
+        result_file.write_bytes(b'partial')
+    read_series('Utrecht')
+    assert query_calls == ['Utrecht', 'Utrecht']
+
+
+def test_new_data_version_invalidates_results(empty_cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'QUERY_CACHE_DIR', str(tmp_path))
+    read_series('Utrecht')
+    old_version = util.get_data_version()
+    util.bump_data_version()
+
+    read_series('Utrecht')
+    assert query_calls == ['Utrecht', 'Utrecht']
+    read_series('Utrecht')
+    assert query_calls == ['Utrecht', 'Utrecht']
+    # The results of the old version are removed from the disk
+    assert os.listdir(tmp_path) == [str(old_version + 1)]
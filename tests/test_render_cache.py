@@ -0,0 +1,54 @@
+import concurrent.futures
+import os
+import pytest
+from benchmarks import synthetic_data
+from config import Config
+from matplotlib.figure import Figure
+import graph_plotter
+import render_cache
+import render_pool
+import series_cache
+
+
+def test_save_figure_replaces_image(tmp_path):
+    fig = Figure()
+    fig.subplots().plot([1, 2, 3])
+    image_path = tmp_path / 'case_plot_test.png'
+    image_path.write_bytes(b'previous')
+    graph_plotter.save_figure(fig, str(image_path))
+
+    assert image_path.read_bytes().startswith(b'\x89PNG')
+    assert os.listdir(tmp_path) == ['case_plot_test.png']
+
+
+def test_failed_save_leaves_no_image(tmp_path, monkeypatch):
+    fig = Figure()
+
+    def fail_to_save(image_file, **kwargs):
+        image_file.write(b'\x89PNG partial')
+        raise RuntimeError('render failed')
+
+    monkeypatch.setattr(fig, 'savefig', fail_to_save)
+    with pytest.raises(RuntimeError):
+        graph_plotter.save_figure(fig, str(tmp_path / 'case_plot_test.png'))
+    assert os.listdir(tmp_path) == []
+
+
+def test_concurrent_requests_share_one_render_in_the_pool(refreshed_data, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'PLOT_DIR', str(tmp_path))
+    monkeypatch.setattr(Config, 'RENDER_WORKERS', 2)
+    render_pool.reset_executor()
+    data_set = series_cache.sum_dutch_total_infections(None, None)
+    statistics = render_cache.get_statistics()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=6) as requests:
+            image_names = list(requests.map(lambda request: graph_plotter.plot_statistics(
+                    data_set=data_set, start_date=synthetic_data.START_DATE, no_days_to_predict=7), range(6)))
+    finally:
+        render_pool.reset_executor()
+
+    assert len(set(image_names)) == 1
+    assert os.listdir(tmp_path) == image_names[:1]
+    assert (tmp_path / image_names[0]).read_bytes().startswith(b'\x89PNG')
+    assert render_cache.get_statistics()['misses'] == statistics['misses'] + 1
+    assert render_cache.get_statistics()['hits'] == statistics['hits'] + 5
@@ -0,0 +1,20 @@
+from database import database_session, engine, writing_to
+from database.data_model import DutchReproductionNumbers
+import reproduction
+
+
+def stored_reproduction_numbers():
+    session = database_session()
+    rows = sorted((record.region_type, record.region, record.reported_date, record.growth_rate,
+                   record.reproduction_no) for record in session.query(DutchReproductionNumbers))
+    session.close()
+    return rows
+
+
+def test_regions_calculated_by_workers_match_in_process(refreshed_data):
+    calculated_in_process = stored_reproduction_numbers()
+    with writing_to(engine):
+        no_rows = reproduction.calculate_regional_reproduction_numbers(max_workers=2)
+
+    assert no_rows == len(calculated_in_process) > 0
+    assert stored_reproduction_numbers() == calculated_in_process
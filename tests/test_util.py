@@ -0,0 +1,46 @@
+import json
+import pytest
+import util
+
+RECORDS = [{'Date_of_report': '2021-03-01 10:00:00', 'Municipality_name': "'s-Hertogenbosch", 'Total_reported': 12},
+           {'Municipality_name': 'Brackets ] and [ commas , in "quotes"', 'Total_reported': None},
+           {'Municipality_name': 'Escaped \\" quote and \\\\ backslash', 'Nested': [[1, 2], {'a': ']'}]},
+           12345, 'text, with ] bracket', [], {}, True, None]
+
+
+def write(tmp_path, content):
+    path = tmp_path / 'data.json'
+    path.write_text(content, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 8, 13, 64, 1024 * 1024])
+@pytest.mark.parametrize('separators', [(',', ':'), (', ', ': '), (',\n  ', ': ')])
+def test_elements_split_over_chunks(tmp_path, chunk_size, separators):
+    path = write(tmp_path, json.dumps(RECORDS, separators=separators))
+    assert list(util.iterate_json_array(path, chunk_size)) == RECORDS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 1024])
+def test_leading_whitespace_longer_than_a_chunk(tmp_path, chunk_size):
+    path = write(tmp_path, ' \n' * 20 + json.dumps(RECORDS) + '\n')
+    assert list(util.iterate_json_array(path, chunk_size)) == RECORDS
+
+
+@pytest.mark.parametrize('content', ['[]', '[ ]', '\n[\n]\n'])
+@pytest.mark.parametrize('chunk_size', [1, 1024])
+def test_empty_array(tmp_path, content, chunk_size):
+    assert list(util.iterate_json_array(write(tmp_path, content), chunk_size)) == []
+
+
+@pytest.mark.parametrize('content', ['', '   ', '{"Date": "2021-03-01"}'])
+def test_not_an_array(tmp_path, content):
+    with pytest.raises(ValueError, match='does not contain a JSON array'):
+        list(util.iterate_json_array(write(tmp_path, content), 4))
+
+
+@pytest.mark.parametrize('content', ['[{"a": 1}, {"b": ', '[{"a": 1}, {"b": 2}', '[{"a": 1}, "text', '[1, 2, '])
+@pytest.mark.parametrize('chunk_size', [1, 3, 1024])
+def test_truncated_file(tmp_path, content, chunk_size):
+    with pytest.raises(ValueError):
+        list(util.iterate_json_array(write(tmp_path, content), chunk_size))
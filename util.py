@@ -1,17 +1,209 @@
-from config import Endpoints
+from config import Config, Endpoints
 import concurrent.futures
+import multiprocessing
+import itertools
 import callouts
+import hashlib
+import metrics
+import json
+import sys
+import os
 
+DOWNLOAD_STATE_FILE = 'download_state'
+DATA_VERSION_FILE = 'data_version'
 
-def refresh_data_files():
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        for key, value in Endpoints.__dict__.items():
-            if not key.startswith('_'):
-                executor.submit(write_response_to_file, key, value)
 
+def start_data_file_refreshes(executor, download=True):
+    """Starts the download or hashing of every data file in the executor, returns the future per file name"""
+    os.makedirs(Config.DATA_FILES_DIR, exist_ok=True)
+    download_state = read_download_state()
+    if download:
+        return {filename: executor.submit(write_response_to_file, filename, endpoint, download_state.get(filename, {}))
+                for filename, endpoint in get_endpoints().items()}
+    return {filename: executor.submit(hash_data_file, filename) for filename in get_endpoints()}
 
-def write_response_to_file(filename, endpoint):
-    new_file = open(file='data_files/' + filename + '.json', mode='wb')
-    data = callouts.get_covid_stats(endpoint)
-    new_file.write(data)
-    new_file.close()
+
+def record_data_file(download_state, filename, result):
+    """
+    Adds the result of the refresh of a data file to the download state
+
+    :return:
+    True when the content of the file has not been processed yet
+    """
+    file_state = download_state.setdefault(filename, {})
+    if result['status'] == 'modified':
+        file_state.update(etag=result['etag'], last_modified=result['last_modified'], sha256=result['sha256'])
+        metrics.add_rows(1)
+        metrics.add_bytes_read(os.path.getsize(data_file_path(filename)))
+    elif result['status'] == 'hashed':
+        file_state['sha256'] = result['sha256']
+    elif result['status'] == 'failed':
+        metrics.add_failed_downloads(1)
+    return bool(file_state.get('sha256')) and file_state.get('sha256') != file_state.get('processed_sha256')
+
+
+def hash_data_file(filename):
+    path = data_file_path(filename)
+    if not os.path.exists(path):
+        return {'status': 'missing'}
+    return {'status': 'hashed', 'sha256': file_sha256(path)}
+
+
+def write_response_to_file(filename, endpoint, file_state):
+    path = data_file_path(filename)
+    # Only ask for changes when the previous download is still present
+    if not os.path.exists(path):
+        file_state = {}
+    return callouts.download_covid_stats(endpoint, path,
+                                         etag=file_state.get('etag'),
+                                         last_modified=file_state.get('last_modified'))
+
+
+def file_sha256(path):
+    content_hash = hashlib.sha256()
+    with open(path, mode='rb') as data_file:
+        for chunk in iter(lambda: data_file.read(Config.DOWNLOAD_CHUNK_SIZE), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def mark_data_files_processed(filenames):
+    """Stores that the current content of the data files is in the database, so it will not be parsed again"""
+    download_state = read_download_state()
+    for filename in filenames:
+        file_state = download_state.setdefault(filename, {})
+        file_state['processed_sha256'] = file_state.get('sha256')
+    write_download_state(download_state)
+
+
+def read_download_state():
+    try:
+        with open(data_file_path(DOWNLOAD_STATE_FILE)) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_download_state(download_state):
+    path = data_file_path(DOWNLOAD_STATE_FILE)
+    with open(path + '.tmp', mode='w') as state_file:
+        json.dump(download_state, state_file, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def get_data_version():
+    """Returns the number of the current data version, which is increased by every refresh that changed data"""
+    try:
+        with open(data_file_path(DATA_VERSION_FILE)) as version_file:
+            return json.load(version_file)
+    except FileNotFoundError:
+        return 0
+
+
+def bump_data_version():
+    path = data_file_path(DATA_VERSION_FILE)
+    data_version = get_data_version() + 1
+    with open(path + '.tmp', mode='w') as version_file:
+        json.dump(data_version, version_file)
+    os.replace(path + '.tmp', path)
+    return data_version
+
+
+def get_endpoints():
+    return {key: value for key, value in Endpoints.__dict__.items() if not key.startswith('_')}
+
+
+def data_file_path(filename):
+    return os.path.join(Config.DATA_FILES_DIR, filename + '.json')
+
+
+def load_data_file(filename):
+    """Parses a data file as a whole, the bytes read count towards the running stage"""
+    path = data_file_path(filename)
+    metrics.add_bytes_read(os.path.getsize(path))
+    with open(path) as data_file:
+        return json.load(data_file)
+
+
+def iterate_json_array(path, chunk_size=Config.INGEST_READ_CHUNK_SIZE):
+    """
+    Yields the elements of a top level JSON array one at a time.
+    Only a single chunk of the file is kept in memory, so the file size does not affect memory usage.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, mode='r', encoding='utf-8') as json_file:
+        buffer = json_file.read(chunk_size).lstrip()
+        # Leading whitespace can take more than a chunk
+        while not buffer:
+            chunk = json_file.read(chunk_size)
+            if not chunk:
+                break
+            buffer = chunk.lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(path + ' does not contain a JSON array')
+        position = 1
+        end_of_file = False
+        while True:
+            # Skip the separators between the elements
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+
+            if position < len(buffer) and buffer[position] == ']':
+                return
+
+            # An element can only be decoded reliably when it does not end at the edge of the buffer
+            try:
+                element, element_end = decoder.raw_decode(buffer, position)
+                if element_end < len(buffer) or end_of_file:
+                    yield element
+                    position = element_end
+                    continue
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+
+            if end_of_file:
+                raise ValueError(path + ' ends before the JSON array is closed')
+
+            # Drop the consumed part of the buffer and read the next chunk
+            chunk = json_file.read(chunk_size)
+            end_of_file = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def create_process_pool(max_workers, preload=()):
+    """
+    Pool of worker processes started by a forkserver, or spawned where there is none, rather than forked from this
+    process. A fork copies the locks held by the other threads, like the download and writer threads of a refresh or
+    the request threads of the server, and the worker deadlocks on them. The workers start with the Config of this
+    process, which may have been changed since it was imported.
+
+    The forkserver imports the modules of preload once and forks the workers from itself, so the workers do not
+    import them again. It is shared by all pools of this process and only the preload of the first pool is used.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # Workers import the main module again, a main module run with -m is only preloaded by its name
+        main_name = getattr(getattr(sys.modules['__main__'], '__spec__', None), 'name', '__main__')
+        context.set_forkserver_preload(['__main__'] + ([] if main_name.endswith('__main__') else [main_name]) +
+                                       list(preload))
+    else:
+        context = multiprocessing.get_context('spawn')
+    settings = {name: value for name, value in vars(Config).items() if not name.startswith('_')}
+    return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                                  initializer=apply_config, initargs=(settings,))
+
+
+def apply_config(settings):
+    for name, value in settings.items():
+        setattr(Config, name, value)
+
+
+def batched(iterable, batch_size):
+    """Splits an iterable into lists of at most batch_size elements"""
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, batch_size))